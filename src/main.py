@@ -2,7 +2,8 @@ from fastapi import FastAPI, Request, status, Depends
 from fastapi.security import HTTPBearer
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, text
 import os
 import json
 from fastapi.middleware.cors import CORSMiddleware
@@ -21,7 +22,8 @@ from .config.auth_db import AuthBase, auth_engine
 from .schema.schema_builder import SchemaBuilder
 from .model.query_model import QueryModel
 from .utils.auth import verify_token
-from .routes import auth_routes, query_routes, role_routes, user_routes, database_routes, schema_routes, llm_routes
+from .utils.http_client import start_http_session, close_http_session
+from .routes import auth_routes, query_routes, role_routes, user_routes, database_routes, schema_routes, llm_routes, metrics_routes
 
 # 添加Session中间件
 app.add_middleware(
@@ -100,7 +102,14 @@ try:
         model_name=llm_config["model_name"],
         temperature=llm_config["temperature"],
         max_tokens=llm_config["max_tokens"],
-        top_p=llm_config["top_p"]
+        top_p=llm_config["top_p"],
+        generation_cache_config=llm_config.get("generation_cache"),
+        schema_selection_config=llm_config.get("schema_selection"),
+        token_config=llm_config.get("token_accounting"),
+        scheduler_config=llm_config.get("scheduler"),
+        endpoints=llm_config.get("endpoints"),
+        endpoint_pool_config=llm_config.get("endpoint_pool"),
+        example_adaptation_config=llm_config.get("example_adaptation")
     )
     print("查询模型初始化成功")
 except Exception as e:
@@ -149,6 +158,7 @@ app.include_router(user_routes.router)
 app.include_router(database_routes.router)
 app.include_router(schema_routes.router)
 app.include_router(llm_routes.router)
+app.include_router(metrics_routes.router)
 
 # 根路由
 @app.get("/", dependencies=[Depends(verify_token)])
@@ -160,14 +170,52 @@ async def root():
 async def health_check():
     return {"status": "ok", "message": "服务运行正常"}
 
+def _check_db_pool(engine) -> dict:
+    """检查数据库连接池是否可用"""
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return {"state": "ready", "pool": engine.pool.status()}
+    except Exception as e:
+        return {"state": "failed", "error": str(e)}
+
+# 就绪检查：各子系统加载完成后才返回200
+@app.get("/ready")
+async def readiness_check():
+    subsystems = await query_model.vector_store.readiness()
+    subsystems["schema_cache"] = {
+        "state": "ready" if query_model.schema_manager.schema_builder is not None else "failed"
+    }
+    subsystems["db_pools"] = {
+        "query_db": await run_in_threadpool(_check_db_pool, query_model.engine),
+        "auth_db": await run_in_threadpool(_check_db_pool, auth_engine),
+    }
+    states = [subsystems[name]["state"] for name in ("embedding_model", "index", "schema_cache")]
+    states += [pool["state"] for pool in subsystems["db_pools"].values()]
+    ready = all(state == "ready" for state in states)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "not_ready", "subsystems": subsystems}
+    )
+
 # 启动事件
 @app.on_event("startup")
 async def startup():
     # 启动时的初始化代码
-    pass
+    # 创建共享的HTTP会话，调用大模型接口时复用连接
+    await start_http_session(llm_config.get("http_pool"))
+    # 定期检查各大模型接口，剔除和恢复接口
+    query_model.llm_pool.start_health_checks()
+    # 在后台加载向量模型和索引，不阻塞服务启动
+    query_model.vector_store.start_background_load()
 
 # 关闭事件
 @app.on_event("shutdown")
 async def shutdown():
     # 关闭时的清理代码
-    pass
\ No newline at end of file
+    await query_model.llm_pool.close()
+    await close_http_session()
+    # 保存向量索引，下次启动时可直接加载；close 会释放记录存储，必须在其之前保存
+    query_model.vector_store.save_index()
+    await query_model.vector_store.close()
+    query_model.vector_store.executor.shutdown(wait=False)
\ No newline at end of file
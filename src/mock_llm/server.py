@@ -0,0 +1,280 @@
+"""
+模拟大模型服务 - 兼容 OpenAI /v1/chat/completions 协议，用于离线压测和延迟测试
+
+用法:
+    python -m src.mock_llm.server
+    python -m src.mock_llm.server --port 8900 --latency-ms 800 --latency-dist lognormal --error-rate 0.02 --rate-limit-rate 0.05
+    python -m src.mock_llm.server --replay feedback/feedback_data.json --rules config/mock_llm_rules.json
+
+在 llm_config.json 中把 api_url 设置为 http://127.0.0.1:8900/v1/chat/completions 即可让 QueryModel 使用模拟服务，
+也可以作为 endpoints 列表中的一个接口。
+
+SQL来源依次为：回放文件中规范化后相同的查询、规则文件中第一条匹配的正则、默认SQL。
+规则文件格式: [{"pattern": "AQI", "sql": "SELECT ..."}]
+"""
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from aiohttp import web
+from ..utils.text import normalize_query
+from ..utils.token_counter import estimate_tokens
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+# 提示词中用户问题的位置，与 QueryModel._build_messages 的格式一致
+_USER_QUERY = re.compile(r"用户查询:\s*(.*)\s*$", re.DOTALL)
+
+
+class LatencyModel:
+    """按指定分布生成响应延迟（秒）"""
+
+    def __init__(self, mean_ms: float, distribution: str = "fixed", jitter_ms: float = 0.0,
+                 rng: Optional[random.Random] = None):
+        self.mean = max(0.0, mean_ms) / 1000
+        self.jitter = max(0.0, jitter_ms) / 1000
+        self.distribution = distribution
+        self.rng = rng or random.Random()
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+        if self.distribution == "uniform":
+            return self.rng.uniform(max(0.0, self.mean - self.jitter), self.mean + self.jitter)
+        if self.distribution == "normal":
+            return max(0.0, self.rng.gauss(self.mean, self.jitter))
+        if self.distribution == "lognormal":
+            # 中位数为 mean，jitter/mean 作为对数标准差，得到接近真实接口的长尾
+            sigma = self.jitter / self.mean if self.jitter else 0.5
+            return self.mean * self.rng.lognormvariate(0.0, sigma)
+        return self.mean
+
+
+class SQLSource:
+    """根据用户问题返回SQL：先查回放数据，再按规则匹配，最后返回默认SQL"""
+
+    def __init__(self, replay_path: Optional[Path] = None, rules_path: Optional[Path] = None,
+                 default_sql: str = "SELECT 1"):
+        self.replay: Dict[str, str] = {}
+        self.rules: List[Tuple[re.Pattern, str]] = []
+        self.default_sql = default_sql
+        if replay_path is not None and replay_path.exists():
+            self._load_replay(replay_path)
+        if rules_path is not None and rules_path.exists():
+            with open(rules_path, 'r', encoding='utf-8') as f:
+                self.rules = [(re.compile(rule["pattern"]), rule["sql"]) for rule in json.load(f)]
+            print(f"已加载 {len(self.rules)} 条SQL规则: {rules_path}")
+
+    def _load_replay(self, path: Path):
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        # 同一查询有多条反馈时，取评分最高、时间最新的一条
+        best: Dict[str, Tuple] = {}
+        for record in records:
+            if not record.get("query") or not record.get("sql"):
+                continue
+            key = normalize_query(record["query"])
+            rank = (record.get("rating") or 0, record.get("timestamp") or "")
+            if key not in best or rank >= best[key][0]:
+                best[key] = (rank, record["sql"])
+        self.replay = {key: sql for key, (_, sql) in best.items()}
+        print(f"已加载 {len(self.replay)} 条回放查询: {path}")
+
+    def lookup(self, query: str) -> Tuple[str, str]:
+        """返回 (SQL, 来源)"""
+        sql = self.replay.get(normalize_query(query))
+        if sql is not None:
+            return sql, "replay"
+        for pattern, rule_sql in self.rules:
+            if pattern.search(query):
+                return rule_sql, "rule"
+        return self.default_sql, "default"
+
+
+def extract_user_query(messages: List[Dict]) -> str:
+    """取最后一条用户消息中的问题，没有固定格式时返回整条消息"""
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content") or ""
+            match = _USER_QUERY.search(content)
+            return match.group(1).strip() if match else content.strip()
+    return ""
+
+
+class MockLLMServer:
+    """
+    模拟 OpenAI 兼容的聊天接口
+
+    每个请求先按概率返回429（带 Retry-After）或500，再按延迟分布等待后返回SQL。
+    流式请求的总延迟分为首个片段前的等待和片段之间的间隔。
+    usage 中的缓存命中token模拟前缀缓存：system 消息与之前的请求相同时按其token数计为命中。
+    """
+
+    def __init__(self, source: SQLSource, latency: LatencyModel, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, chunk_chars: int = 8,
+                 chunk_delay_ms: float = 20.0, model: str = "mock-sql", rng: Optional[random.Random] = None):
+        self.source = source
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chunk_chars = max(1, chunk_chars)
+        self.chunk_delay = max(0.0, chunk_delay_ms) / 1000
+        self.model = model
+        self.rng = rng or random.Random()
+        self._seen_prefixes = set()
+        self.counts = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0,
+                       "replay": 0, "rule": 0, "default": 0}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    def _usage(self, messages: List[Dict], completion: str) -> Dict:
+        prompt_tokens = sum(estimate_tokens(message.get("content") or "") + 4 for message in messages)
+        cached = 0
+        system = next((message.get("content") or "" for message in messages if message.get("role") == "system"), "")
+        if system:
+            digest = hashlib.sha256(system.encode('utf-8')).hexdigest()
+            if digest in self._seen_prefixes:
+                cached = estimate_tokens(system)
+            self._seen_prefixes.add(digest)
+        completion_tokens = estimate_tokens(completion)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+            "prompt_cache_hit_tokens": cached,
+            "prompt_cache_miss_tokens": prompt_tokens - cached,
+        }
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.counts["requests"] += 1
+        try:
+            body = await request.json()
+        except Exception:
+            return web.json_response({"error": {"message": "请求体不是有效的JSON"}}, status=400)
+        messages = body.get("messages") or []
+
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.counts["rate_limited"] += 1
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                                     status=429, headers={"Retry-After": f"{self.retry_after:g}"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.counts["errors"] += 1
+            await asyncio.sleep(self.latency.sample() * self.rng.random())
+            return web.json_response({"error": {"message": "Internal error", "type": "server_error"}}, status=500)
+
+        sql, origin = self.source.lookup(extract_user_query(messages))
+        self.counts[origin] += 1
+        usage = self._usage(messages, sql)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model") or self.model
+
+        if body.get("stream"):
+            self.counts["streams"] += 1
+            return await self._stream(request, sql, usage, completion_id, created, model,
+                                      bool((body.get("stream_options") or {}).get("include_usage")))
+
+        await asyncio.sleep(self.latency.sample())
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": sql}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    async def _stream(self, request: web.Request, sql: str, usage: Dict, completion_id: str,
+                      created: int, model: str, include_usage: bool) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(choices: List[Dict], extra: Optional[Dict] = None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": choices}
+            chunk.update(extra or {})
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        # 首个片段前的等待即首token延迟
+        await asyncio.sleep(self.latency.sample())
+        await send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for start in range(0, len(sql), self.chunk_chars):
+            await send([{"index": 0, "delta": {"content": sql[start:start + self.chunk_chars]}, "finish_reason": None}])
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if include_usage:
+            await send([], {"usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": self.model, "object": "model", "owned_by": "mock"}]})
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.counts, replay_queries=len(self.source.replay), rules=len(self.source.rules)))
+
+
+def _resolve(path: Optional[str]) -> Optional[Path]:
+    if not path:
+        return None
+    resolved = Path(path)
+    return resolved if resolved.is_absolute() else PROJECT_ROOT / resolved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 OpenAI 兼容的大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--replay", default="feedback/feedback_data.json", help="回放的反馈数据文件，空字符串表示不使用")
+    parser.add_argument("--rules", default="", help="正则规则文件")
+    parser.add_argument("--default-sql", default="SELECT 1")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="非流式为总延迟，流式为首token延迟")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "normal", "lognormal"], default="fixed")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0, help="uniform 为半宽，normal 为标准差，lognormal 按比例换算为对数标准差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429响应的 Retry-After（秒）")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="流式响应每个片段的字符数")
+    parser.add_argument("--chunk-delay-ms", type=float, default=20.0, help="流式响应片段之间的间隔")
+    parser.add_argument("--model", default="mock-sql")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = MockLLMServer(
+        SQLSource(_resolve(args.replay), _resolve(args.rules), args.default_sql),
+        LatencyModel(args.latency_ms, args.latency_dist, args.latency_jitter_ms, rng),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        chunk_chars=args.chunk_chars,
+        chunk_delay_ms=args.chunk_delay_ms,
+        model=args.model,
+        rng=rng
+    )
+    print(f"模拟大模型服务: http://{args.host}:{args.port}/v1/chat/completions")
+    web.run_app(server.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+示例改写模块 - 新问题与最相近的示例只差站点、日期或指标时，直接替换示例SQL中的对应取值，不调用大模型
+
+例如示例 "坂头2018年1月AQI平均值" 的SQL中有 CDMC = '坂头' 和 CYRQ LIKE '2018-01%'，
+新问题 "西湖2019年3月PM2.5平均值" 与示例除这些取值外逐字相同，改写为 CDMC = '西湖'、'2019-03%' 和 PM25。
+示例问题中能在SQL里找到对应取值的部分作为槽位，其余文字必须与新问题完全一致，否则交给大模型生成。
+文本槽位的新取值必须是该字段已知的取值（示例SQL中出现过，或数据库中该字段的不同取值），
+避免把 "非国控" 这类带修饰的文字当作取值。
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import re
+import threading
+import time
+from ..utils.text import normalize_query
+from ..validator.sql_validator import SQLValidator
+from ..vector_store.lexical_index import lexical_key
+
+# 默认配置，可在 llm_config.json 的 example_adaptation 中覆盖
+default_adaptation_config = {
+    "enabled": True,
+    # 最相近示例的向量距离（L2平方）不超过该值时才尝试改写，实际是否改写由问题模板是否一致决定
+    "max_distance": 8.0,
+    # 站点等文本取值的最大长度
+    "max_value_length": 20,
+    # 以这些字开头的文本是否定或排除条件，不能当作取值替换
+    "negation_prefixes": ["非", "不", "除"],
+    # 是否查询数据库中字段的不同取值，作为示例SQL之外的已知取值
+    "distinct_lookup": True,
+    # 不同取值超过该数量的字段不缓存，只接受示例SQL中出现过的取值
+    "max_distinct_values": 2000,
+    # 字段不同取值的缓存时间
+    "distinct_ttl_seconds": 3600,
+    # 问题中的指标名称（小写）与表字段的对应关系
+    "metrics": {
+        "aqi": "AQI", "空气质量指数": "AQI",
+        "pm2.5": "PM25", "pm25": "PM25", "pm10": "PM",
+        "so2": "SO2", "二氧化硫": "SO2", "no2": "NO2", "二氧化氮": "NO2",
+        "o3": "O3", "臭氧": "O3", "co": "CO", "一氧化碳": "CO"
+    }
+}
+
+_STRING_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+# 与字符串常量比较的字段，如 CDMC = '坂头'、JCQ LIKE '%集美%'
+_COLUMN_LITERAL = re.compile(r"([A-Za-z_]\w*)\s*(=|<>|!=|\bLIKE\b)\s*'((?:[^']|'')*)'", re.IGNORECASE)
+_YEAR_MONTH = re.compile(r"(\d{4})年(\d{1,2})月")
+_YEAR = re.compile(r"(\d{4})年")
+# 包含多个取值或泛指的文本不能当作单个站点名替换
+_MULTI_VALUE = re.compile(r"[和与及或、,，/;；]|以及|所有|各个|每个|全部")
+# 前端保存编辑后的SQL时在问题前加的标记
+_EDIT_MARK = re.compile(r"^\[编辑\]\s*")
+
+
+class _Slot:
+    """示例问题中的一个可替换取值"""
+
+    def __init__(self, kind: str, start: int, end: int, value, column: str = "", table: str = "",
+                 contains: bool = False):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.value = value
+        # 文本槽位对应的字段、所在表（SQL只涉及一个表时）以及是否为 LIKE '%...%' 包含匹配
+        self.column = column
+        self.table = table
+        self.contains = contains
+
+
+def _outside_literals(sql: str, replace) -> str:
+    """只对SQL中字符串常量以外的部分调用 replace"""
+    parts = []
+    position = 0
+    for match in _STRING_LITERAL.finditer(sql):
+        parts.append(replace(sql[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(replace(sql[position:]))
+    return "".join(parts)
+
+
+class ExampleAdapter:
+    """
+    改写最相近示例的SQL
+
+    adapt 只做文本层面的替换，返回的SQL仍需经过 SQLValidator 校验；
+    校验结果通过 record_hit / record_miss 回报，stats 中的 hit_rate 为改写成功的请求占比。
+    文本字段的已知取值由 learn 从示例SQL中收集，distinct_values(表名, 字段名, 条数上限) 读取数据库中的不同取值，
+    读取结果按 distinct_ttl_seconds 缓存。distinct_values 会访问数据库，adapt 应在线程池中调用。
+    """
+
+    def __init__(self, config: Optional[Dict] = None,
+                 distinct_values: Optional[Callable[[str, str, int], Iterable[str]]] = None):
+        self.config = default_adaptation_config.copy()
+        self.config.update(config or {})
+        self.distinct_values = distinct_values if self.config["distinct_lookup"] else None
+        self._sql_validator = SQLValidator()
+        # 字段名（小写） -> 示例SQL中出现过的取值（小写）
+        self.known_values: Dict[str, Set[str]] = {}
+        # (表名, 字段名) -> (过期时间, 不同取值)，取值过多或读取失败时为None
+        self._distinct_cache: Dict[Tuple[str, str], Tuple[float, Optional[Set[str]]]] = {}
+        metrics = {name.lower(): column for name, column in self.config["metrics"].items()}
+        self.metrics = metrics
+        # 长的名称优先匹配，pm2.5 不会被拆成 pm 和 2.5
+        names = sorted(metrics, key=len, reverse=True)
+        self._metric_pattern = r"(?<![a-z0-9.])(" + "|".join(re.escape(name) for name in names) + r")(?![a-z0-9.])"
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.misses: Dict[str, int] = {}
+
+    def adapt(self, query: str, nearest: Optional[Tuple[Dict, float]]) -> Optional[str]:
+        """
+        按最相近的示例改写SQL，不能改写时返回None
+
+        Args:
+            nearest: (示例, 向量距离)，没有示例时为None
+        """
+        with self._lock:
+            self.requests += 1
+        if nearest is None:
+            return self.record_miss("no_example")
+        example, distance = nearest
+        if distance > self.config["max_distance"]:
+            return self.record_miss("distance")
+        if not example.get("query") or not example.get("sql"):
+            return self.record_miss("no_example")
+        stored_query = normalize_query(_EDIT_MARK.sub("", example["query"]))
+        new_query = normalize_query(query)
+        # 检索只对与示例只差空白或标点的问题报告距离0，其余都是问题向量与示例向量的实际距离；
+        # 不满足该条件的0距离不是实测值，不据此改写
+        if distance <= 0.0 and lexical_key(stored_query) != lexical_key(new_query):
+            return self.record_miss("distance")
+        stored_sql = example["sql"]
+
+        slots = self._find_slots(stored_query, stored_sql)
+        match = re.fullmatch(self._template(stored_query, slots), new_query)
+        if match is None:
+            return self.record_miss("template")
+        values, reason = self._new_values(slots, match)
+        if values is None:
+            return self.record_miss(reason)
+        sql, reason = self._substitute(stored_sql, slots, values)
+        if sql is None:
+            return self.record_miss(reason)
+        print(f"示例改写: {example['query']} -> {query}，距离 {distance:.3f}")
+        return sql
+
+    def _find_slots(self, stored_query: str, sql: str) -> List[_Slot]:
+        """找出示例问题中在SQL里有对应取值的日期、指标和文本，按位置排序且互不重叠"""
+        literals = [match.group(1) for match in _STRING_LITERAL.finditer(sql)]
+        code = _outside_literals(sql, lambda part: part).lower()
+        tables = self._tables(sql)
+        table = tables[0] if len(tables) == 1 else ""
+        slots: List[_Slot] = []
+
+        def free(start: int, end: int) -> bool:
+            return all(end <= slot.start or start >= slot.end for slot in slots)
+
+        for match in _YEAR_MONTH.finditer(stored_query):
+            year, month = int(match.group(1)), int(match.group(2))
+            if any(f"{year}-{month:02d}" in literal for literal in literals):
+                slots.append(_Slot("month", match.start(), match.end(), (year, month)))
+        for match in _YEAR.finditer(stored_query):
+            year = int(match.group(1))
+            if free(match.start(), match.end()) and re.search(rf"(?<!\d){year}(?!\d)", sql):
+                slots.append(_Slot("year", match.start(), match.end(), year))
+        for match in re.finditer(self._metric_pattern, stored_query):
+            column = self.metrics[match.group(1)]
+            if free(match.start(), match.end()) and re.search(rf"\b{re.escape(column.lower())}\b", code):
+                slots.append(_Slot("metric", match.start(), match.end(), column))
+        # 只有与字段比较的字符串常量可以作为槽位，新取值需按字段检查是否已知
+        for column, operator, literal in _COLUMN_LITERAL.findall(sql):
+            value = literal.strip("%").lower()
+            if not value or re.fullmatch(r"[\d\-:\s.]+", value):
+                continue
+            contains = operator.upper() == "LIKE" and literal.startswith("%") and literal.endswith("%")
+            for match in re.finditer(re.escape(value), stored_query):
+                if free(match.start(), match.end()):
+                    slots.append(_Slot("literal", match.start(), match.end(), value, column, table, contains))
+        return sorted(slots, key=lambda slot: slot.start)
+
+    def _template(self, stored_query: str, slots: List[_Slot]) -> str:
+        """把示例问题中的槽位换成捕获组，其余文字原样匹配"""
+        pattern = []
+        position = 0
+        for slot in slots:
+            pattern.append(re.escape(stored_query[position:slot.start]))
+            if slot.kind == "month":
+                pattern.append(r"(\d{4})年(\d{1,2})月")
+            elif slot.kind == "year":
+                pattern.append(r"(\d{4})年")
+            elif slot.kind == "metric":
+                pattern.append(self._metric_pattern)
+            else:
+                pattern.append(r"(.+?)")
+            position = slot.end
+        pattern.append(re.escape(stored_query[position:]))
+        return "".join(pattern)
+
+    def _new_values(self, slots: List[_Slot], match) -> Tuple[Optional[List], str]:
+        """读取新问题中各槽位的取值，同一个旧取值必须对应同一个新取值"""
+        groups = iter(match.groups())
+        values = []
+        for slot in slots:
+            if slot.kind == "month":
+                year, month = int(next(groups)), int(next(groups))
+                if not 1 <= month <= 12:
+                    return None, "value"
+                values.append((year, month))
+            elif slot.kind == "year":
+                values.append(int(next(groups)))
+            elif slot.kind == "metric":
+                values.append(self.metrics[next(groups)])
+            else:
+                value = next(groups).strip()
+                if (not value or len(value) > self.config["max_value_length"] or "'" in value or "\\" in value
+                        or _MULTI_VALUE.search(value) or _YEAR.search(value)
+                        or re.search(self._metric_pattern, value)):
+                    return None, "value"
+                if value.lower() != slot.value and value.startswith(tuple(self.config["negation_prefixes"])):
+                    return None, "negation"
+                if value.lower() != slot.value and not self._is_known(slot, value):
+                    return None, "unknown_value"
+                values.append(value)
+        mapping = {}
+        for slot, value in zip(slots, values):
+            if mapping.setdefault((slot.kind, slot.value), value) != value:
+                return None, "value"
+        return values, ""
+
+    def _substitute(self, sql: str, slots: List[_Slot], values: List) -> Tuple[Optional[str], str]:
+        """先把旧取值换成占位符再填入新取值，避免两个取值互换时相互覆盖"""
+        fills = []
+
+        def placeholder(text: str) -> str:
+            fills.append(text)
+            return f"\x00{len(fills) - 1}\x00"
+
+        done = set()
+        for slot, value in sorted(zip(slots, values), key=lambda item: item[0].kind != "month"):
+            key = (slot.kind, slot.value)
+            if key in done or slot.value == value:
+                continue
+            done.add(key)
+            count = 0
+            if slot.kind == "month":
+                (old_year, old_month), (year, month) = slot.value, value
+                # 月末日期换月后可能不存在，例如 '2018-01-31' 改为2月
+                if re.search(rf"{old_year}-{old_month:02d}-(29|30|31)", sql):
+                    return None, "date_range"
+                sql, count = re.subn(rf"{old_year}-{old_month:02d}",
+                                     lambda _: placeholder(f"{year}-{month:02d}"), sql)
+            elif slot.kind == "year":
+                if re.search(rf"{slot.value}-02-29", sql):
+                    return None, "date_range"
+                sql, count = re.subn(rf"(?<!\d){slot.value}(?!\d)", lambda _: placeholder(str(value)), sql)
+            elif slot.kind == "metric":
+                old, new = slot.value, value
+
+                def replace_metric(part: str) -> str:
+                    nonlocal count
+                    # 字段名和以字段名结尾的别名（如 avg_aqi）一起替换
+                    part, replaced = re.subn(rf"\b{re.escape(old)}\b", lambda _: placeholder(new), part,
+                                             flags=re.IGNORECASE)
+                    part, renamed = re.subn(rf"(?<=\w_){re.escape(old.lower())}\b",
+                                            lambda _: placeholder(new.lower()), part)
+                    count += replaced + renamed
+                    return part
+
+                sql = _outside_literals(sql, replace_metric)
+            else:
+                def replace_literal(match) -> str:
+                    nonlocal count
+                    literal = match.group(1)
+                    if literal.strip("%").lower() != slot.value:
+                        return match.group(0)
+                    count += 1
+                    return "'" + literal.replace(literal.strip("%"), placeholder(value)) + "'"
+
+                sql = _STRING_LITERAL.sub(replace_literal, sql)
+            if count == 0:
+                return None, "sql"
+        return re.sub(r"\x00(\d+)\x00", lambda match: fills[int(match.group(1))], sql), ""
+
+    def learn(self, sql: str):
+        """收集示例SQL中与字段比较的字符串取值"""
+        for column, _, literal in _COLUMN_LITERAL.findall(sql or ""):
+            value = literal.strip("%").lower()
+            if value:
+                with self._lock:
+                    self.known_values.setdefault(column.lower(), set()).add(value)
+
+    def _tables(self, sql: str) -> List[str]:
+        try:
+            return self._sql_validator._extract_tables(sql)
+        except Exception:
+            return []
+
+    def _is_known(self, slot: _Slot, value: str) -> bool:
+        """新取值是否为该字段已知的取值，LIKE '%...%' 只要求是某个已知取值的一部分"""
+        value = value.lower()
+        with self._lock:
+            known = set(self.known_values.get(slot.column.lower(), ()))
+        if slot.table:
+            known |= self._distinct(slot.table, slot.column) or set()
+        if slot.contains:
+            return any(value in candidate for candidate in known)
+        return value in known
+
+    def _distinct(self, table: str, column: str) -> Optional[Set[str]]:
+        """数据库中字段的不同取值（小写），过期前复用缓存"""
+        if self.distinct_values is None:
+            return None
+        key = (table.lower(), column.lower())
+        now = time.time()
+        with self._lock:
+            cached = self._distinct_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        limit = self.config["max_distinct_values"]
+        try:
+            values = {str(value).strip().lower() for value in self.distinct_values(table, column, limit + 1)}
+            if len(values) > limit:
+                print(f"字段 {table}.{column} 的不同取值超过 {limit} 个，只使用示例中的取值")
+                values = None
+        except Exception as e:
+            print(f"读取字段 {table}.{column} 的取值失败: {str(e)}")
+            values = None
+        with self._lock:
+            self._distinct_cache[key] = (now + self.config["distinct_ttl_seconds"], values)
+        return values
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, reason: str) -> None:
+        with self._lock:
+            self.misses[reason] = self.misses.get(reason, 0) + 1
+        return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": True,
+                "max_distance": self.config["max_distance"],
+                "requests": self.requests,
+                "hits": self.hits,
+                "misses": dict(self.misses),
+                "known_columns": len(self.known_values),
+                "cached_distinct_columns": len(self._distinct_cache),
+                "hit_rate": self.hits / self.requests if self.requests else 0.0,
+            }
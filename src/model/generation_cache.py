@@ -0,0 +1,200 @@
+"""
+SQL生成缓存模块 - 相同问题、相同权限schema、相同示例和模型参数下复用已生成的SQL
+"""
+from typing import Dict, List, Optional
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from ..utils.text import normalize_query
+
+# 已创建的缓存实例，权限或schema变化时统一清空
+_instances: "weakref.WeakSet[GenerationCache]" = weakref.WeakSet()
+
+
+def invalidate_generation_caches(reason: str = ""):
+    """清空所有SQL生成缓存，在角色权限、用户角色、schema或数据库配置变化后调用，其他进程通过版本文件得知"""
+    for cache in list(_instances):
+        cache.clear()
+    print(f"SQL生成缓存已清空{f'（{reason}）' if reason else ''}")
+
+
+class GenerationCache:
+    """
+    SQL生成结果的LRU缓存，可选SQLite持久化
+
+    键由规范化查询、schema文本哈希、所选示例和模型参数共同决定，
+    内存中保留最近使用的 max_size 条，超过 ttl_seconds 的条目视为过期。
+    backend 为 sqlite 时条目同时写入本地数据库，重启后仍可命中。
+    多个进程共用缓存时，clear 会写入新的版本号到 version_path，各进程读写前比较版本号，
+    发现变化就丢弃本进程内存中的条目，避免一个进程清空后其他进程继续返回旧的SQL。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 86400,
+                 backend: str = "memory", sqlite_path: Optional[Path] = None,
+                 persistent_max_size: int = 100000, version_path: Optional[Path] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.persistent_max_size = persistent_max_size
+        self.version_path = Path(version_path) if version_path is not None else None
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self.external_invalidations = 0
+        self._version = self._read_version()
+        if backend == "sqlite" and sqlite_path is not None:
+            try:
+                self._open_db(Path(sqlite_path))
+            except Exception as e:
+                print(f"打开SQL生成缓存数据库失败，仅使用内存缓存: {str(e)}")
+                self._db = None
+        _instances.add(self)
+
+    def _open_db(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generation_cache ("
+            "key TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.commit()
+        print(f"已打开SQL生成缓存数据库: {path}")
+
+    def _read_version(self) -> Optional[str]:
+        if self.version_path is None:
+            return None
+        try:
+            return self.version_path.read_text(encoding='utf-8').strip()
+        except FileNotFoundError:
+            return ""
+        except Exception as e:
+            print(f"读取SQL生成缓存版本失败: {str(e)}")
+            return getattr(self, "_version", None)
+
+    def _check_version(self):
+        """其他进程清空过缓存时丢弃内存中的条目，调用方需持有 self._lock"""
+        version = self._read_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            self.external_invalidations += 1
+
+    def _bump_version(self):
+        """写入新的版本号，先写临时文件再替换，其他进程不会读到不完整的内容"""
+        if self.version_path is None:
+            return
+        version = uuid.uuid4().hex
+        try:
+            self.version_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.version_path.with_name(f"{self.version_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(version, encoding='utf-8')
+            os.replace(tmp_path, self.version_path)
+            self._version = version
+        except Exception as e:
+            print(f"更新SQL生成缓存版本失败: {str(e)}")
+
+    @staticmethod
+    def make_key(query: str, schema_info: str, examples: List[Dict], model_params: Dict) -> str:
+        """根据规范化查询、schema哈希、示例和模型参数计算缓存键"""
+        material = {
+            "query": normalize_query(query),
+            "schema": hashlib.sha256((schema_info or "").encode('utf-8')).hexdigest(),
+            "examples": [[example.get('query'), example.get('sql')] for example in examples],
+            "model_params": model_params,
+        }
+        return hashlib.sha256(json.dumps(material, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["created_at"] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["sql"]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT sql, created_at FROM generation_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    self._db.execute("UPDATE generation_cache SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def _remember(self, key: str, sql: str, created_at: float):
+        self._entries[key] = {"sql": sql, "created_at": created_at}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, sql: str):
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            self._remember(key, sql, now)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO generation_cache (key, sql, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, sql, now, now))
+                self._writes += 1
+                # 定期清理过期条目和超出上限的最久未使用条目
+                if self._writes % 100 == 0:
+                    self._db.execute("DELETE FROM generation_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                    self._db.execute(
+                        "DELETE FROM generation_cache WHERE key NOT IN "
+                        "(SELECT key FROM generation_cache ORDER BY last_access DESC LIMIT ?)",
+                        (self.persistent_max_size,))
+                self._db.commit()
+            except Exception as e:
+                print(f"写入SQL生成缓存数据库失败: {str(e)}")
+
+    def clear(self):
+        """清空内存和数据库中的条目，并通知共用缓存的其他进程"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM generation_cache")
+                    self._db.commit()
+                except Exception as e:
+                    print(f"清空SQL生成缓存数据库失败: {str(e)}")
+            self._bump_version()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "backend": "sqlite" if self._db is not None else "memory",
+                "hits": self.hits,
+                "misses": self.misses,
+                "persistent_hits": self.persistent_hits,
+                "external_invalidations": self.external_invalidations,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+            if self._db is not None:
+                stats["persistent_size"] = self._db.execute("SELECT COUNT(*) FROM generation_cache").fetchone()[0]
+        return stats
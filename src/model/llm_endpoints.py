@@ -0,0 +1,336 @@
+"""
+大模型接口池 - 多个接口按优先级和权重路由，主接口响应慢时对冲请求，失败的接口暂时剔除
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+from collections import deque
+import asyncio
+import random
+import time
+from ..utils.http_client import get_http_session
+from .llm_scheduler import LLMScheduler
+
+# 默认配置，可在 llm_config.json 的 endpoint_pool 中覆盖
+default_pool_config = {
+    # 主接口超过自身延迟分位数仍未返回时，向下一个接口发出对冲请求
+    "hedging_enabled": True,
+    "hedge_percentile": 0.95,
+    # 延迟样本不足 min_samples 时使用 initial_hedge_delay_ms
+    "min_samples": 20,
+    "initial_hedge_delay_ms": 3000,
+    "min_hedge_delay_ms": 200,
+    "max_hedge_delay_ms": 15000,
+    # 单次请求最多使用的接口数（含对冲和故障转移）
+    "max_endpoints_per_request": 3,
+    # 连续失败达到该次数后剔除接口，健康检查通过后恢复
+    "eject_after_failures": 3,
+    # 健康检查间隔（秒），0表示不做主动检查
+    "health_check_interval": 30,
+    "health_check_timeout": 5
+}
+
+
+class LLMEndpoint:
+    """单个大模型接口，持有自己的调度器、延迟样本和健康状态"""
+
+    def __init__(self, config: Dict, scheduler_config: Optional[Dict] = None):
+        self.name = config.get("name") or config["api_url"]
+        self.api_url = config["api_url"]
+        self.api_key = config.get("api_key", "")
+        self.model = config.get("model_name", "deepseek-chat")
+        self.custom_health_url = config.get("health_url")
+        self.priority = config.get("priority", 0)
+        self.weight = max(0.0, float(config.get("weight", 1.0)))
+        self.scheduler = LLMScheduler(dict(scheduler_config or {}, **config.get("scheduler", {})))
+        self.latencies: Deque[float] = deque(maxlen=500)
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.last_error = ""
+        # 统计信息
+        self.calls = 0
+        self.successes = 0
+        self.wins = 0
+        self.cancelled = 0
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+    def health_url(self) -> str:
+        """健康检查地址，未单独配置时使用 OpenAI 兼容接口的模型列表地址"""
+        if self.custom_health_url:
+            return self.custom_health_url
+        base = self.api_url
+        for suffix in ("/chat/completions", "/completions"):
+            if base.endswith(suffix):
+                return base[:-len(suffix)] + "/models"
+        return base
+
+    def stats(self) -> Dict:
+        p50 = self.latency_percentile(0.5)
+        p99 = self.latency_percentile(0.99)
+        return {
+            "name": self.name,
+            "api_url": self.api_url,
+            "model": self.model,
+            "priority": self.priority,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "calls": self.calls,
+            "successes": self.successes,
+            "wins": self.wins,
+            "cancelled": self.cancelled,
+            "latency_ms": {
+                "p50": p50 * 1000 if p50 is not None else None,
+                "p99": p99 * 1000 if p99 is not None else None,
+                "samples": len(self.latencies),
+            },
+            "scheduler": self.scheduler.stats(),
+        }
+
+
+class LLMEndpointPool:
+    """
+    大模型接口池
+
+    接口按 priority 从小到大排序，同一优先级内按 weight 随机排序；已剔除的接口排在最后，全部剔除时仍按顺序尝试。
+    每次请求先发往第一个接口，超过该接口延迟分位数仍未返回时对冲到下一个接口，先成功的结果生效，其余请求取消；
+    某个接口失败时立即转到下一个接口。连续失败的接口被剔除，由后台健康检查恢复。
+    """
+
+    def __init__(self, endpoints: List[Dict], config: Optional[Dict] = None,
+                 scheduler_config: Optional[Dict] = None):
+        if not endpoints:
+            raise ValueError("至少需要配置一个大模型接口")
+        self.config = default_pool_config.copy()
+        self.config.update(config or {})
+        self.endpoints = [LLMEndpoint(endpoint, scheduler_config) for endpoint in endpoints]
+        self._health_task: Optional[asyncio.Task] = None
+        # 统计信息
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @classmethod
+    def from_llm_config(cls, llm_config: Dict) -> "LLMEndpointPool":
+        """
+        根据 llm_config.json 创建接口池
+
+        配置了 endpoints 列表时使用列表，列表项未填写的 api_key 和 model_name 继承顶层配置；
+        否则使用顶层的 api_url/api_key/model_name 作为唯一接口。
+        """
+        defaults = {
+            "api_url": llm_config.get("api_url"),
+            "api_key": llm_config.get("api_key", ""),
+            "model_name": llm_config.get("model_name", "deepseek-chat"),
+        }
+        endpoints = [dict(defaults, **{key: value for key, value in endpoint.items() if value not in (None, "")})
+                     for endpoint in llm_config.get("endpoints") or [] if endpoint.get("enabled", True)]
+        return cls(endpoints or [defaults], llm_config.get("endpoint_pool"), llm_config.get("scheduler"))
+
+    def signature(self) -> List[List[str]]:
+        """参与生成的接口和模型，用于SQL生成缓存的键"""
+        return [[endpoint.api_url, endpoint.model] for endpoint in self.endpoints]
+
+    def ordered(self) -> List[LLMEndpoint]:
+        """本次请求尝试接口的顺序"""
+        def weighted_key(endpoint: LLMEndpoint) -> float:
+            # 按权重的随机排序（Efraimidis-Spirakis），权重为0的排在同优先级最后
+            return random.random() ** (1.0 / endpoint.weight) if endpoint.weight > 0 else -1.0
+
+        keyed = [(not endpoint.healthy, endpoint.priority, -weighted_key(endpoint), pos, endpoint)
+                 for pos, endpoint in enumerate(self.endpoints)]
+        return [item[-1] for item in sorted(keyed)]
+
+    def hedge_delay(self, endpoint: LLMEndpoint) -> float:
+        """对冲等待时间（秒）：该接口近期延迟的分位数，样本不足时使用初始值"""
+        delay = self.config["initial_hedge_delay_ms"] / 1000
+        if len(endpoint.latencies) >= self.config["min_samples"]:
+            delay = endpoint.latency_percentile(self.config["hedge_percentile"])
+        return min(max(delay, self.config["min_hedge_delay_ms"] / 1000), self.config["max_hedge_delay_ms"] / 1000)
+
+    def record_success(self, endpoint: LLMEndpoint, elapsed: float):
+        endpoint.successes += 1
+        endpoint.latencies.append(elapsed)
+        endpoint.consecutive_failures = 0
+        endpoint.healthy = True
+
+    def record_failure(self, endpoint: LLMEndpoint, error: BaseException):
+        endpoint.consecutive_failures += 1
+        endpoint.last_error = str(error)[:200]
+        if endpoint.healthy and endpoint.consecutive_failures >= self.config["eject_after_failures"]:
+            endpoint.healthy = False
+            print(f"大模型接口 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，暂时剔除")
+
+    async def _attempt(self, endpoint: LLMEndpoint, request: Callable[[LLMEndpoint], Awaitable[Any]]) -> Any:
+        endpoint.calls += 1
+        start = time.monotonic()
+        try:
+            result = await endpoint.scheduler.run(lambda: request(endpoint))
+        except asyncio.CancelledError:
+            endpoint.cancelled += 1
+            raise
+        except Exception as e:
+            self.record_failure(endpoint, e)
+            raise
+        self.record_success(endpoint, time.monotonic() - start)
+        return result
+
+    async def call(self, request: Callable[[LLMEndpoint], Awaitable[Any]]) -> Any:
+        """
+        发送请求，返回最先成功的结果
+
+        Args:
+            request: 对指定接口发送一次请求的协程函数，重试由各接口的调度器负责
+        """
+        self.requests += 1
+        candidates = self.ordered()[:max(1, self.config["max_endpoints_per_request"])]
+        running: Dict[asyncio.Task, LLMEndpoint] = {}
+        hedges = set()
+        next_pos = 0
+        last_error: Optional[BaseException] = None
+
+        def launch(hedge: bool = False):
+            nonlocal next_pos
+            endpoint = candidates[next_pos]
+            next_pos += 1
+            if hedge:
+                hedges.add(endpoint)
+            running[asyncio.ensure_future(self._attempt(endpoint, request))] = endpoint
+
+        launch()
+        try:
+            while running:
+                timeout = None
+                # 只对第一个尚未返回的请求计时，超时后对冲到下一个接口
+                if self.config["hedging_enabled"] and next_pos < len(candidates) and len(running) == 1:
+                    timeout = self.hedge_delay(next(iter(running.values())))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    print(f"大模型接口 {next(iter(running.values())).name} 超过 {timeout:.2f} 秒未返回，发出对冲请求")
+                    launch(hedge=True)
+                    continue
+                for task in done:
+                    endpoint = running.pop(task)
+                    if task.exception() is None:
+                        endpoint.wins += 1
+                        if endpoint in hedges:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"大模型接口 {endpoint.name} 请求失败: {str(last_error)[:200]}")
+                # 失败后立即转到下一个接口
+                if not running and next_pos < len(candidates):
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def stream(self, open_stream: Callable[[LLMEndpoint], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        流式请求，不做对冲
+
+        输出第一段内容之前失败时按接口的调度器重试，仍失败则转到下一个接口；
+        已输出内容后的失败记入调度器和接口的失败统计后直接抛出。
+        """
+        self.requests += 1
+        candidates = self.ordered()[:max(1, self.config["max_endpoints_per_request"])]
+        last_error: Optional[Exception] = None
+        for pos, endpoint in enumerate(candidates):
+            if pos:
+                self.failovers += 1
+                print(f"转到大模型接口 {endpoint.name}")
+            endpoint.calls += 1
+            start = time.monotonic()
+            attempt = 0
+            started = False
+            while True:
+                try:
+                    async with endpoint.scheduler.slot():
+                        async for item in open_stream(endpoint):
+                            started = True
+                            yield item
+                except Exception as e:
+                    if started:
+                        # 已输出内容后不能重试，但中途的5xx和连接中断同样计入熔断和接口剔除
+                        endpoint.scheduler.record_failure(e)
+                        delay = None
+                    else:
+                        delay = endpoint.scheduler.on_failure(e, attempt)
+                    if delay is None:
+                        self.record_failure(endpoint, e)
+                        if started:
+                            raise
+                        last_error = e
+                        break
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                endpoint.scheduler.on_success()
+                self.record_success(endpoint, time.monotonic() - start)
+                endpoint.wins += 1
+                return
+        raise last_error
+
+    async def _check_endpoint(self, endpoint: LLMEndpoint):
+        try:
+            session = get_http_session()
+            headers = {"Authorization": f"Bearer {endpoint.api_key}"}
+            async with session.get(endpoint.health_url(), headers=headers,
+                                   timeout=self.config["health_check_timeout"]) as response:
+                # 能连通且认证有效即视为健康，不提供模型列表的接口返回404也算通过
+                ok = response.status < 500 and response.status not in (401, 403)
+                if not ok:
+                    endpoint.last_error = f"健康检查返回 {response.status}"
+        except Exception as e:
+            ok = False
+            endpoint.last_error = f"健康检查失败: {str(e)[:200]}"
+        if ok and not endpoint.healthy:
+            print(f"大模型接口 {endpoint.name} 健康检查通过，恢复使用")
+            endpoint.consecutive_failures = 0
+        elif not ok and endpoint.healthy:
+            print(f"大模型接口 {endpoint.name} 健康检查未通过，暂时剔除")
+        endpoint.healthy = ok
+
+    async def check_health(self):
+        """检查所有接口"""
+        await asyncio.gather(*(self._check_endpoint(endpoint) for endpoint in self.endpoints))
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.config["health_check_interval"])
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"大模型接口健康检查出错: {str(e)}")
+
+    def start_health_checks(self):
+        """在当前事件循环中启动后台健康检查"""
+        if self.config["health_check_interval"] > 0 and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._health_task = None
+
+    def stats(self) -> Dict:
+        return {
+            "config": dict(self.config),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+        }
@@ -0,0 +1,306 @@
+"""
+大模型请求调度模块 - 限制并发和速率，429/5xx时退避重试，接口持续失败时熔断
+"""
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+import asyncio
+import random
+import time
+import aiohttp
+
+# 默认配置，可在 llm_config.json 的 scheduler 中覆盖
+default_scheduler_config = {
+    # 同时进行的大模型请求数上限
+    "max_concurrency": 8,
+    # 令牌桶：每秒发放的请求数和桶容量，rate_per_second 为0时不限速
+    "rate_per_second": 5.0,
+    "burst": 10,
+    # 429/5xx/超时的最大重试次数
+    "max_retries": 3,
+    # 指数退避的初始值和上限（秒），实际等待时间在 [0, 退避值] 之间随机
+    "base_backoff": 0.5,
+    "max_backoff": 20.0,
+    # Retry-After 的上限（秒）
+    "max_retry_after": 60.0,
+    # 等待并发名额和令牌的最长时间（秒）
+    "queue_timeout": 30.0,
+    # 连续失败达到该次数后熔断，熔断 breaker_reset_seconds 秒后放行一个探测请求
+    "breaker_failure_threshold": 5,
+    "breaker_reset_seconds": 30.0
+}
+
+
+class LLMHTTPError(Exception):
+    """大模型接口返回非200状态码"""
+
+    def __init__(self, status: int, text: str, retry_after: Optional[float] = None):
+        super().__init__(f"API 请求失败: {text}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMUnavailableError(Exception):
+    """调度器拒绝请求，未发送到大模型接口"""
+    pass
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """熔断期间直接拒绝请求"""
+    pass
+
+
+class QueueTimeoutError(LLMUnavailableError):
+    """排队等待超时"""
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头，支持秒数和HTTP日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, LLMHTTPError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+class TokenBucket:
+    """令牌桶限速，等待的请求按到达顺序获得令牌"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed: 正常放行；连续失败达到阈值后转为 open，直接拒绝请求；
+    reset_seconds 后转为 half_open，只放行一个探测请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probe_started: Optional[float] = None
+
+    def check(self):
+        """请求前调用，熔断中抛出 CircuitOpenError"""
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(f"大模型接口连续失败，已熔断，{remaining:.0f} 秒后重试")
+            self.state = "half_open"
+            self._probe_started = None
+        if self.state == "half_open":
+            # 探测请求被取消或没有结果时，超过 reset_seconds 后允许新的探测
+            now = time.monotonic()
+            if self._probe_started is not None and now - self._probe_started < self.reset_seconds:
+                raise CircuitOpenError("大模型接口恢复探测中，请稍后重试")
+            self._probe_started = now
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_started = None
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened_count += 1
+                print(f"大模型接口连续失败 {self.failures} 次，熔断 {self.reset_seconds} 秒")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    大模型请求调度器
+
+    每个请求先通过熔断检查，再依次等待令牌桶和并发名额；
+    429、5xx、超时和连接错误按带随机抖动的指数退避重试，响应带 Retry-After 时至少等待该时长。
+    只有5xx、超时和连接错误计入熔断，429和其他错误说明接口可达，重置熔断计数。
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = default_scheduler_config.copy()
+        self.config.update(config or {})
+        self.bucket = TokenBucket(self.config["rate_per_second"], self.config["burst"])
+        self.breaker = CircuitBreaker(self.config["breaker_failure_threshold"], self.config["breaker_reset_seconds"])
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 统计信息
+        self.waiting = 0
+        self.active = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._recent_waits: Deque[float] = deque(maxlen=1000)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.config["max_concurrency"])
+            self.bucket = TokenBucket(self.config["rate_per_second"], self.config["burst"])
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self):
+        """获取一个请求名额，退出时释放"""
+        try:
+            self.breaker.check()
+        except LLMUnavailableError:
+            self.rejected += 1
+            raise
+        semaphore = self._get_semaphore()
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._acquire(semaphore), self.config["queue_timeout"])
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise QueueTimeoutError(f"大模型请求排队超过 {self.config['queue_timeout']} 秒")
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - start
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self._recent_waits.append(waited)
+        self.requests += 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+    async def _acquire(self, semaphore: asyncio.Semaphore):
+        await semaphore.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            semaphore.release()
+            raise
+
+    def on_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self, error: Exception) -> bool:
+        """
+        只记录失败、更新熔断器，不决定是否重试；返回False表示请求未发出（熔断中）
+
+        服务端错误和连接中断计入熔断，429限流和请求本身的错误不计入
+        """
+        self.failures += 1
+        if isinstance(error, LLMUnavailableError):
+            return False
+        if is_retryable(error) and not (isinstance(error, LLMHTTPError) and error.status == 429):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return True
+
+    def on_failure(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        记录一次失败，返回重试前应等待的秒数，不应重试时返回None
+
+        Args:
+            attempt: 已重试的次数，从0开始
+        """
+        if not self.record_failure(error):
+            return None
+        if not is_retryable(error):
+            return None
+        if attempt >= self.config["max_retries"]:
+            return None
+        backoff = min(self.config["max_backoff"], self.config["base_backoff"] * (2 ** attempt))
+        delay = random.uniform(0, backoff)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.config["max_retry_after"]))
+        self.retries += 1
+        print(f"大模型请求失败（{str(error)[:100]}），{delay:.2f} 秒后第 {attempt + 1} 次重试")
+        return delay
+
+    async def run(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """在调度下执行一次请求，失败时按策略重试"""
+        attempt = 0
+        while True:
+            try:
+                async with self.slot():
+                    result = await call()
+            except Exception as e:
+                delay = self.on_failure(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.on_success()
+            return result
+
+    def stats(self) -> Dict:
+        waits = sorted(self._recent_waits)
+
+        def percentile(p: float) -> float:
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000 if waits else 0.0
+
+        return {
+            "config": dict(self.config),
+            "queue_depth": self.waiting,
+            "active": self.active,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "avg": self.wait_total / self.requests * 1000 if self.requests else 0.0,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": self.wait_max * 1000,
+            },
+            "breaker": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "opened": self.breaker.opened_count,
+            },
+        }
@@ -0,0 +1,85 @@
+"""
+提示词组装模块 - 按稳定程度排列提示词各部分，使同一角色的请求共享完全相同的前缀，命中接口侧的上下文缓存
+
+顺序: 固定说明 -> 角色schema（system 消息） -> 相似示例 -> 相关表提示 -> 用户问题（user 消息）
+"""
+from typing import Dict, List, Optional, Tuple
+
+# 与问题无关的固定说明，修改后所有缓存的前缀都会失效
+INSTRUCTIONS = """你是一个SQL专家。请根据提供的数据库结构和用户查询，生成符合以下权限约束的SQL查询语句。
+
+权限约束：
+1. 你只能查询用户有权限访问的表和字段
+2. 必须应用指定的过滤条件（如果有）
+3. 不要尝试绕过这些限制
+4. 如果用户请求访问未授权的表或字段，返回以"ERROR:"开头的消息，说明权限问题
+
+返回格式要求：
+- 对于有效查询：仅返回SQL查询语句，不要包含任何解释或markdown格式
+- 对于无权限查询：返回以"ERROR:"开头的简短消息，例如"ERROR: 您没有权限访问请求的表或字段"
+"""
+
+# 每个部分所在的消息和模板，按从最稳定到最易变的顺序排列
+SEGMENTS = [
+    ("instructions", "system", "{instructions}"),
+    ("schema", "system", "\n数据库结构：\n{schema}\n"),
+    ("examples", "user", "相似查询示例：\n{examples}\n\n"),
+    ("tables", "user", "与问题相关的表：{tables}\n\n"),
+    ("query", "user", "用户查询: {query}"),
+]
+
+# 内容为空时省略的部分
+OPTIONAL_SEGMENTS = {"examples", "tables"}
+
+
+def canonical_schema(tables: List[Dict]) -> str:
+    """
+    按表名排序后拼接各表描述
+
+    用户schema由权限集合生成，表的顺序在不同进程间可能不同，排序后同一角色得到逐字节相同的文本
+    """
+    return "\n".join(table["text"].strip("\n") for table in sorted(tables, key=lambda table: table["name"]))
+
+
+def format_examples(examples: List[Dict]) -> str:
+    return "\n\n".join(f"User Query: {example['query']}\nSQL: {example['sql']}" for example in examples)
+
+
+class PromptBuilder:
+    """
+    按 SEGMENTS 组装消息
+
+    固定说明和schema组成 system 消息，只要角色的schema不变，该消息就与之前的请求完全相同，
+    可以被接口侧的前缀缓存复用；示例、相关表提示和问题放在 user 消息中，为空的部分省略。
+    开启前缀缓存时 schema 始终为角色的完整schema，按问题裁剪的结果只作为相关表提示传入。
+    """
+
+    def __init__(self, instructions: str = INSTRUCTIONS):
+        self.instructions = instructions
+
+    def segments(self, query: str, examples: List[Dict], schema_info: str,
+                 relevant_tables: Optional[List[str]] = None) -> List[Tuple[str, str, str]]:
+        """返回 (部分名称, 消息角色, 文本) 列表"""
+        values = {
+            "instructions": self.instructions,
+            "schema": schema_info,
+            "examples": format_examples(examples),
+            "tables": "、".join(relevant_tables or []),
+            "query": query,
+        }
+        return [(name, role, template.format(**{name: values[name]}))
+                for name, role, template in SEGMENTS if name not in OPTIONAL_SEGMENTS or values[name]]
+
+    def build(self, query: str, examples: List[Dict], schema_info: str,
+              relevant_tables: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        messages: List[Dict[str, str]] = []
+        for _, role, text in self.segments(query, examples, schema_info, relevant_tables):
+            if messages and messages[-1]["role"] == role:
+                messages[-1]["content"] += text
+            else:
+                messages.append({"role": role, "content": text})
+        return messages
+
+    def stable_prefix(self, schema_info: str) -> str:
+        """同一schema的所有请求共享的 system 消息"""
+        return self.build("", [], schema_info)[0]["content"]
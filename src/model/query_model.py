@@ -1,5 +1,8 @@
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple, List, AsyncIterator
 import aiohttp
+import asyncio
+import hashlib
+import time
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.pool import QueuePool
 from ..context.query_context import QueryContext
@@ -7,13 +10,31 @@ import json
 from pathlib import Path
 from ..vector_store.feedback_store import FeedbackVectorStore
 from ..schema.schema_manager import SchemaManager  # 导入SchemaManager
+from ..schema.schema_selector import SchemaSelector
 from ..database.models.role import RolePermission  # 导入角色权限模型
 from fastapi import Request  # 添加这一行导入Request
 from ..validator.sql_validator import SQLValidator  # 导入SQL校验器
+from ..utils.http_client import get_http_session
+from ..utils.single_flight import SingleFlight
+from ..utils.token_counter import (default_token_config, create_tokenizer, count_message_tokens,
+                                   TokenUsageTracker)
+from ..utils.text import normalize_query, normalize_sql
+from .generation_cache import GenerationCache
+from .llm_scheduler import LLMHTTPError, parse_retry_after
+from .llm_endpoints import LLMEndpoint, LLMEndpointPool
+from .prompt_builder import PromptBuilder, canonical_schema, format_examples
+from .example_adapter import ExampleAdapter
 
 class QueryModel:
     def __init__(self, db_url: str, api_key: str, api_url: str, model_name: str = "deepseek-chat", 
-                 temperature: float = 0.7, max_tokens: int = 2000, top_p: float = 0.95):
+                 temperature: float = 0.7, max_tokens: int = 2000, top_p: float = 0.95,
+                 generation_cache_config: Optional[Dict[str, Any]] = None,
+                 schema_selection_config: Optional[Dict[str, Any]] = None,
+                 token_config: Optional[Dict[str, Any]] = None,
+                 scheduler_config: Optional[Dict[str, Any]] = None,
+                 endpoints: Optional[List[Dict[str, Any]]] = None,
+                 endpoint_pool_config: Optional[Dict[str, Any]] = None,
+                 example_adaptation_config: Optional[Dict[str, Any]] = None):
         self.engine = create_engine(
             db_url,
             pool_size=5,
@@ -43,9 +64,56 @@ class QueryModel:
         # 不在初始化时加载schema信息，而是设置为空字符串
         print("跳过加载数据库Schema信息，将在用户登录后按需加载...")
         self._schema_info = ""
+        self._schema_tables: List[Dict] = []
         self._examples = self._load_examples()
-        self.vector_store = FeedbackVectorStore()
-        print("向量数据库加载完成")
+        # 向量模型和索引在应用启动后于后台加载，加载完成前查询不使用示例
+        self.vector_store = FeedbackVectorStore(lazy=True)
+        # 提示词按稳定程度排列，便于命中接口侧的前缀缓存
+        self.prompt_builder = PromptBuilder()
+        # 提示词token估算、预算和用量统计
+        self.token_config = default_token_config.copy()
+        self.token_config.update(token_config or {})
+        self.tokenizer = create_tokenizer(self.token_config)
+        self.token_usage = TokenUsageTracker()
+        # 按问题挑选相关的表，缩短宽库的schema
+        self.schema_selector = SchemaSelector(self.vector_store, schema_selection_config, self.tokenizer.count)
+        # SQL生成缓存
+        self.generation_cache = self._create_generation_cache(generation_cache_config or {})
+        # 只差站点、日期或指标的问题直接改写最相近示例的SQL
+        example_adaptation_config = example_adaptation_config or {}
+        self.example_adapter = None
+        if example_adaptation_config.get("enabled", True):
+            self.example_adapter = ExampleAdapter(example_adaptation_config, self._distinct_values)
+            self._learn_example_values()
+        # 大模型接口池，每个接口有独立的并发、限速、重试和熔断
+        self.llm_pool = LLMEndpointPool.from_llm_config({
+            "api_url": api_url,
+            "api_key": api_key,
+            "model_name": model_name,
+            "endpoints": endpoints,
+            "endpoint_pool": endpoint_pool_config,
+            "scheduler": scheduler_config
+        })
+        # 合并相同问题、相同权限下同时进行的生成和执行请求
+        self.single_flight = SingleFlight()
+
+    def _create_generation_cache(self, config: Dict[str, Any]) -> Optional[GenerationCache]:
+        if not config.get("enabled", True):
+            print("SQL生成缓存已关闭")
+            return None
+        project_root = Path(__file__).parent.parent.parent
+        sqlite_path = None
+        if config.get("backend") == "sqlite":
+            sqlite_path = project_root / config.get("sqlite_path", "cache/generation_cache.db")
+        return GenerationCache(
+            max_size=config.get("max_size", 1024),
+            ttl_seconds=config.get("ttl_seconds", 86400),
+            backend=config.get("backend", "memory"),
+            sqlite_path=sqlite_path,
+            persistent_max_size=config.get("persistent_max_size", 100000),
+            # 多个工作进程通过该文件同步缓存失效
+            version_path=project_root / config.get("version_path", "cache/generation_cache.version")
+        )
 
     def _load_examples(self) -> str:
         try:
@@ -180,112 +248,388 @@ class QueryModel:
         # 使用属性装饰器，返回缓存的 schema 信息
         return self._schema_info
 
+    async def _retrieve_examples(self, query: str, user_id: Optional[int] = None, auth_db = None) -> List[Tuple[Dict, float]]:
+        """检索相似示例，返回 (示例, 向量距离) 列表"""
+        # 只检索SQL涉及的表在用户权限范围内的示例
+        allowed_tables = None
+        if user_id and auth_db:
+            allowed_tables = self.schema_manager.get_user_permissions(user_id, auth_db).get('allowed_tables', [])
+        
+        # 获取相似的示例，检索失败时不使用示例继续生成
+        try:
+            neighbors = await self.vector_store.find_similar_examples_async(
+                query, allowed_tables=allowed_tables, with_distances=True)
+        except Exception as e:
+            print(f"检索相似示例失败: {str(e)}")
+            neighbors = []
+        print(f"找到 {len(neighbors)} 个相似示例")
+        return neighbors
+
+    def _learn_example_values(self):
+        """示例SQL中字段的取值作为改写时可接受的新取值"""
+        try:
+            feedback_path = Path(__file__).parent.parent.parent / 'feedback' / 'feedback_data.json'
+            with open(feedback_path, 'r', encoding='utf-8') as f:
+                for record in json.load(f):
+                    self.example_adapter.learn(record.get('sql') or '')
+        except Exception as e:
+            print(f"加载示例取值失败: {str(e)}")
+
+    def _distinct_values(self, table: str, column: str, limit: int) -> List[Any]:
+        """读取字段的不同取值，表名和字段名取自示例SQL，按标识符转义"""
+        preparer = self.engine.dialect.identifier_preparer
+        sql = f"SELECT DISTINCT {preparer.quote(column)} FROM {preparer.quote(table)} LIMIT {int(limit)}"
+        with self.engine.connect() as connection:
+            return [row[0] for row in connection.execute(text(sql)) if row[0] is not None]
+
+    async def _adapt_example(self, query: str, neighbors: List[Tuple[Dict, float]],
+                             user_id: Optional[int] = None, auth_db = None) -> Optional[str]:
+        """最相近的示例只差站点、日期或指标时改写其SQL，校验通过后直接使用，不调用大模型"""
+        if self.example_adapter is None:
+            return None
+        try:
+            # 判断取值是否已知时可能查询数据库，在线程池中执行
+            sql = await asyncio.get_running_loop().run_in_executor(
+                None, self.example_adapter.adapt, query, neighbors[0] if neighbors else None)
+        except Exception as e:
+            print(f"改写示例SQL失败: {str(e)}")
+            self.example_adapter.record_miss("error")
+            return None
+        if sql is None:
+            return None
+        is_valid, error_msg, _ = await self.validate_sql(sql, user_id, auth_db)
+        if not is_valid:
+            print(f"改写的SQL未通过校验，改由大模型生成: {error_msg}")
+            self.example_adapter.record_miss("validation")
+            return None
+        self.example_adapter.record_hit()
+        print(f"\n改写示例得到的 SQL: {sql}")
+        return sql
+
+    async def _prepare_generation(self, query: str, user_id: Optional[int] = None, auth_db = None,
+                                  neighbors: Optional[List[Tuple[Dict, float]]] = None) -> Dict[str, Any]:
+        """检索相似示例并获取用户的schema，返回生成SQL所需的上下文"""
+        if neighbors is None:
+            neighbors = await self._retrieve_examples(query, user_id, auth_db)
+        similar_examples = [example for example, _ in neighbors]
+        
+        # 获取用户的个性化schema，每个表为包含字段、外键和表描述的结构
+        if user_id and auth_db:
+            # 如果提供了用户ID和auth_db，获取用户特定的schema
+            tables = self.schema_manager.get_user_schema_tables(user_id, auth_db)
+            print(f"获取用户 {user_id} 的个性化schema，共 {len(tables)} 个表")
+        else:
+            # 如果没有提供用户信息，获取完整的schema（仅用于开发/测试）
+            if not self._schema_tables:
+                print("警告: Schema 信息为空，获取完整schema")
+                self._schema_tables = self.schema_manager.get_all_schema_tables()
+            tables = self._schema_tables
+            print("使用完整schema（仅用于开发/测试）")
+        
+        if not tables:
+            raise Exception("无法获取数据库schema信息")
+        
+        selected = tables
+        try:
+            selected = await self.schema_selector.select(query, tables)
+        except Exception as e:
+            print(f"Schema裁剪失败，使用完整schema: {str(e)}")
+        
+        if not self.schema_selector.config["prefix_cache"]:
+            prepared = await self._fit_prompt_budget(query, similar_examples, selected)
+        else:
+            # 开启前缀缓存时 system 消息保留角色的完整schema，裁剪结果作为相关表提示
+            relevant_tables = sorted(table["name"] for table in selected) if len(selected) < len(tables) else None
+            prepared = await self._fit_prompt_budget(query, similar_examples, tables, relevant_tables)
+        # 按实际发送的schema统计裁剪节省的token
+        self.schema_selector.record_sent(self.tokenizer.count(canonical_schema(tables)),
+                                         prepared["components"]["schema"])
+        return prepared
+
+    def _prompt_components(self, query: str, examples: List[Dict], schema_info: str,
+                           relevant_tables: Optional[List[str]] = None) -> Dict[str, int]:
+        """估算提示词各部分的token数，overhead 为小标题和消息格式开销"""
+        components = {
+            "instructions": self.tokenizer.count(self.prompt_builder.instructions),
+            "schema": self.tokenizer.count(schema_info),
+            "examples": self.tokenizer.count(format_examples(examples)),
+            "query": self.tokenizer.count(query),
+        }
+        if relevant_tables:
+            components["tables"] = self.tokenizer.count("、".join(relevant_tables))
+        total = count_message_tokens(self.tokenizer, self._build_messages(query, examples, schema_info, relevant_tables),
+                                     self.token_config["message_overhead"])
+        components["overhead"] = max(0, total - sum(components.values()))
+        return components
+
+    async def _fit_prompt_budget(self, query: str, examples: List[Dict], tables: List[Dict],
+                                 relevant_tables: Optional[List[str]] = None) -> Dict[str, Any]:
+        """提示词超过预算时先去掉排名靠后的示例，仍超出再按相关性裁剪schema"""
+        # 表按名称排序，同一角色的schema文本在各进程间保持一致
+        schema_info = canonical_schema(tables)
+        components = self._prompt_components(query, examples, schema_info, relevant_tables)
+        budget = self.token_config["prompt_budget"]
+        if budget and sum(components.values()) > budget:
+            before = sum(components.values())
+            while examples and sum(components.values()) > budget:
+                examples = examples[:-1]
+                components = self._prompt_components(query, examples, schema_info, relevant_tables)
+            if sum(components.values()) > budget:
+                # 裁剪后的schema本身只含相关表，不再需要提示
+                relevant_tables = None
+                schema_budget = budget - (sum(components.values()) - components["schema"] - components.get("tables", 0))
+                tables = await self.schema_selector.select(query, tables, token_budget=max(schema_budget, 0))
+                schema_info = canonical_schema(tables)
+                components = self._prompt_components(query, examples, schema_info)
+            after = sum(components.values())
+            print(f"提示词超出预算 {budget}: 约 {before} -> {after} tokens，保留 {len(examples)} 个示例")
+        return {"examples": examples, "schema_info": schema_info, "relevant_tables": relevant_tables,
+                "components": components}
+
+    def _user_roles(self, user_id: Optional[int], auth_db) -> List[str]:
+        """用户的角色名，用于按角色汇总token用量"""
+        if not (user_id and auth_db):
+            return []
+        try:
+            from ..database.models.role import UserRole, Role
+            rows = auth_db.query(Role.role_name).join(UserRole, UserRole.role_id == Role.id).filter(
+                UserRole.user_id == user_id).all()
+            return [row[0] for row in rows]
+        except Exception as e:
+            print(f"获取用户角色失败: {str(e)}")
+            return []
+
+    def _record_usage(self, prepared: Dict[str, Any], usage: Optional[Dict], sql: str,
+                      user_id: Optional[int] = None, auth_db = None):
+        counts = self.token_usage.record(prepared["components"], usage, self.tokenizer.count(sql),
+                                         user_id, self._user_roles(user_id, auth_db))
+        print(f"Token用量: 提示词 {counts['prompt_tokens']}（缓存命中 {counts['cached_prompt_tokens']}），"
+              f"补全 {counts['completion_tokens']}{'（估算）' if counts['estimated'] else ''}，"
+              f"各部分估算 {prepared['components']}")
+
+    def _build_messages(self, query: str, examples: List[Dict], schema_info: str,
+                        relevant_tables: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """组装发送给大模型的消息，固定说明和schema在前，同一角色的请求共享相同的前缀"""
+        return self.prompt_builder.build(query, examples, schema_info, relevant_tables)
+
+    async def _call_llm(self, messages: List[Dict[str, str]]) -> Tuple[str, Optional[Dict]]:
+        """调用大模型接口，返回生成的SQL和接口返回的token用量"""
+        # 经接口池发送：各接口的调度器限制并发、限速和重试，主接口响应慢时对冲到备用接口
+        return await self.llm_pool.call(lambda endpoint: self._post_chat(endpoint, messages))
+
+    async def _post_chat(self, endpoint: LLMEndpoint, messages: List[Dict[str, str]]) -> Tuple[str, Optional[Dict]]:
+        """向指定接口发送一次非流式请求"""
+        print("\n--- API 请求详情 ---")
+        print(f"准备建立连接到: {endpoint.name} ({endpoint.api_url})")
+        # 使用应用级共享会话，复用到大模型接口的连接
+        session = get_http_session()
+        headers = {
+            "Authorization": f"Bearer {endpoint.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": endpoint.model,
+            "messages": messages,
+            "temperature": self.model_params["temperature"],  # 使用模型参数
+            "max_tokens": self.model_params["max_tokens"]     # 使用模型参数
+        }
+        print(f"请求体: {payload}")
+        
+        print("\n正在发送 POST 请求...")
+        async with session.post(endpoint.api_url, headers=headers, json=payload, timeout=30) as response:
+            print(f"请求已发送，等待响应...")
+            print(f"API 响应状态码: {response.status}")
+            
+            response_text = await response.text()
+            print(f"原始响应内容: {response_text}")
+            
+            if response.status != 200:
+                raise LLMHTTPError(response.status, response_text,
+                                   parse_retry_after(response.headers.get("Retry-After")))
+            
+            result = await response.json()
+            print(f"解析后的响应内容: {result}")
+            
+            if not result.get("choices") or not result["choices"][0].get("message"):
+                raise Exception("API 响应格式错误")
+            
+            sql = result["choices"][0]["message"]["content"].strip()
+            print(f"\n生成的 SQL: {sql}")
+            
+            return sql, result.get("usage")
+
+    def _permission_fingerprint(self, user_id: Optional[int] = None, auth_db = None) -> str:
+        """用户权限内容的指纹，权限相同的用户共享合并的请求"""
+        if not (user_id and auth_db):
+            return "full"
+        permissions = self.schema_manager.get_user_permissions(user_id, auth_db)
+        material = {
+            "tables": sorted(permissions.get('allowed_tables', [])),
+            "fields": {table: sorted(fields) for table, fields in permissions.get('allowed_fields', {}).items()},
+            "filters": {table: sorted(conditions) for table, conditions in permissions.get('filter_conditions', {}).items()},
+        }
+        return hashlib.sha256(json.dumps(material, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
     async def generate_sql(self, request: Request, query: str, context_id: str, user_id: Optional[int] = None, auth_db = None) -> str:
+        """生成SQL，同一时间相同问题和权限的请求只调用一次大模型"""
+        key = ("generate", normalize_query(query), self._permission_fingerprint(user_id, auth_db))
+        return await self.single_flight.do(key, lambda: self._generate_sql(query, user_id, auth_db))
+
+    async def _generate_sql(self, query: str, user_id: Optional[int] = None, auth_db = None) -> str:
         try:
             print("\n=== 开始生成 SQL ===")
             print(f"接收到的查询: {query}")
             
-            # 获取相似的示例
-            similar_examples = self.vector_store.find_similar_examples(query)
-            print(f"找到 {len(similar_examples)} 个相似示例")
+            neighbors = await self._retrieve_examples(query, user_id, auth_db)
+            adapted_sql = await self._adapt_example(query, neighbors, user_id, auth_db)
+            if adapted_sql is not None:
+                return adapted_sql
             
-            examples_text = []
-            for example in similar_examples:
-                examples_text.append(f"User Query: {example['query']}\nSQL: {example['sql']}")
-            examples_prompt = "\n\n".join(examples_text)
+            prepared = await self._prepare_generation(query, user_id, auth_db, neighbors)
             
-            context = self.context_manager.get_context(context_id)
-            history = context['history'] if context else []
+            # 相同问题、schema、示例和模型参数下直接复用已生成的SQL
+            cache_key = self._generation_cache_key(query, prepared)
+            if cache_key is not None:
+                cached_sql = self.generation_cache.get(cache_key)
+                if cached_sql is not None:
+                    print(f"命中SQL生成缓存: {cached_sql}")
+                    return cached_sql
             
-            # 获取用户的个性化schema
-            schema_info = ""
-            # 删除这两行错误代码
-            # user_id = Depends(get_current_user_id)
-            # auth_db = Depends(get_auth_db)
+            sql, usage = await self._call_llm(self._build_messages(query, prepared["examples"], prepared["schema_info"],
+                                                                   prepared["relevant_tables"]))
+            self._record_usage(prepared, usage, sql, user_id, auth_db)
             
-            # 使用传入的user_id和auth_db参数
-            if user_id and auth_db:
-                # 如果提供了用户ID和auth_db，获取用户特定的schema
-                schema_info = self.schema_manager.get_user_schema(user_id, auth_db)
-                print(f"Schema_info:{schema_info}")
-                print(f"获取用户 {user_id} 的个性化schema")
-            else:
-                # 如果没有提供用户信息，获取完整的schema（仅用于开发/测试）
-                if not self._schema_info:
-                    print("警告: Schema 信息为空，获取完整schema")
-                    self._schema_info = self._get_schema_info()
-                schema_info = self._schema_info
-                print("使用完整schema（仅用于开发/测试）")
-            
-            if not schema_info:
-                raise Exception("无法获取数据库schema信息")
-            
-            print("\n--- API 请求详情 ---")
-            print(f"准备建立连接到: {self.api_url}")
-            connector = aiohttp.TCPConnector(ssl=False)
-            async with aiohttp.ClientSession(connector=connector) as session:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                print(f"请求头: {headers}")
-                
-                payload = {
-                    "model": self.model_params["model"],  # 使用模型参数
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": f"""你是一个SQL专家。请根据提供的数据库结构和用户查询，生成符合以下权限约束的SQL查询语句。
+            # 权限错误提示不缓存
+            if cache_key is not None and not sql.startswith("ERROR:"):
+                self.generation_cache.put(cache_key, sql)
+            return sql
+                            
+        except aiohttp.ClientError as e:
+            print(f"网络请求错误: {str(e)}")
+            raise Exception(f"API 请求失败: {str(e)}")
+        except Exception as e:
+            print(f"\n=== SQL 生成错误 ===\n{str(e)}")
+            raise Exception(f"SQL 生成失败: {str(e)}")
 
-权限约束：
-1. 你只能查询用户有权限访问的表和字段
-2. 必须应用指定的过滤条件（如果有）
-3. 不要尝试绕过这些限制
-4. 如果用户请求访问未授权的表或字段，返回以"ERROR:"开头的消息，说明权限问题
+    async def configure_llm(self, llm_config: Dict[str, Any]):
+        """按新的大模型配置更新模型参数和接口池"""
+        self.api_url = llm_config["api_url"]
+        self.api_key = llm_config["api_key"]
+        self.model_params = {
+            "model": llm_config["model_name"],
+            "temperature": llm_config["temperature"],
+            "max_tokens": llm_config["max_tokens"],
+            "top_p": llm_config["top_p"]
+        }
+        old_pool = self.llm_pool
+        self.llm_pool = LLMEndpointPool.from_llm_config(llm_config)
+        await old_pool.close()
+        self.llm_pool.start_health_checks()
+        print(f"大模型接口池已更新，共 {len(self.llm_pool.endpoints)} 个接口")
 
-相似查询示例：
-{examples_prompt}
+    def _generation_cache_key(self, query: str, prepared: Dict[str, Any]) -> Optional[str]:
+        if self.generation_cache is None:
+            return None
+        # 相关表提示也是提示词的一部分
+        schema_info = prepared["schema_info"]
+        if prepared["relevant_tables"]:
+            schema_info += "\n" + "、".join(prepared["relevant_tables"])
+        return GenerationCache.make_key(query, schema_info, prepared["examples"],
+                                        dict(self.model_params, endpoints=self.llm_pool.signature()))
 
-返回格式要求：
-- 对于有效查询：仅返回SQL查询语句，不要包含任何解释或markdown格式
-- 对于无权限查询：返回以"ERROR:"开头的简短消息，例如"ERROR: 您没有权限访问请求的表或字段"
-"""
-                        },
-                        {
-                            "role": "user",
-                            "content": f"""数据库结构：
-{schema_info}
+    async def _stream_llm(self, endpoint: LLMEndpoint, messages: List[Dict[str, str]],
+                          usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        """以流式方式调用指定接口，逐段返回生成的内容，接口返回的token用量写入 usage"""
+        session = get_http_session()
+        headers = {
+            "Authorization": f"Bearer {endpoint.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+        payload = {
+            "model": endpoint.model,
+            "messages": messages,
+            "temperature": self.model_params["temperature"],
+            "max_tokens": self.model_params["max_tokens"],
+            "stream": True,
+            # 要求在最后一个数据块中返回token用量
+            "stream_options": {"include_usage": True}
+        }
+        print(f"正在发送流式请求到: {endpoint.name} ({endpoint.api_url})")
+        async with session.post(endpoint.api_url, headers=headers, json=payload, timeout=30) as response:
+            if response.status != 200:
+                raise LLMHTTPError(response.status, await response.text(),
+                                   parse_retry_after(response.headers.get("Retry-After")))
+            # 响应为SSE格式，每行 "data: {...}"，以 "data: [DONE]" 结束
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if usage is not None and chunk.get("usage"):
+                    usage.update(chunk["usage"])
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
 
-用户查询: {query}"""
-                        }
-                    ],
-                    "temperature": self.model_params["temperature"],  # 使用模型参数
-                    "max_tokens": self.model_params["max_tokens"]     # 使用模型参数
-                }
-                print(f"请求体: {payload}")
-                
-                print("\n正在发送 POST 请求...")
-                async with session.post(self.api_url, headers=headers, json=payload, timeout=30) as response:
-                    print(f"请求已发送，等待响应...")
-                    print(f"API 响应状态码: {response.status}")
-                    
-                    response_text = await response.text()
-                    print(f"原始响应内容: {response_text}")
-                    
-                    if response.status != 200:
-                        raise Exception(f"API 请求失败: {response_text}")
-                    
-                    result = await response.json()
-                    print(f"解析后的响应内容: {result}")
-                    
-                    if not result.get("choices") or not result["choices"][0].get("message"):
-                        raise Exception("API 响应格式错误")
-                    
-                    sql = result["choices"][0]["message"]["content"].strip()
-                    print(f"\n生成的 SQL: {sql}")
-                    
-                    return sql
-                                
+    async def generate_sql_stream(self, query: str, user_id: Optional[int] = None,
+                                  auth_db = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式生成SQL，依次产生阶段事件
+
+        事件: retrieval（示例检索和schema准备完成）、token（模型输出片段）、sql（完整SQL）
+        """
+        print("\n=== 开始流式生成 SQL ===")
+        print(f"接收到的查询: {query}")
+        start = time.perf_counter()
+        try:
+            neighbors = await self._retrieve_examples(query, user_id, auth_db)
+            adapted_sql = await self._adapt_example(query, neighbors, user_id, auth_db)
+            if adapted_sql is not None:
+                elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+                yield {"event": "retrieval", "data": {"examples": len(neighbors), "elapsed_ms": elapsed_ms}}
+                yield {"event": "sql", "data": {"sql": adapted_sql, "cached": False, "adapted": True,
+                                                "elapsed_ms": elapsed_ms}}
+                return
+            
+            prepared = await self._prepare_generation(query, user_id, auth_db, neighbors)
+            yield {"event": "retrieval", "data": {
+                "examples": len(prepared["examples"]),
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+            }}
+            
+            cache_key = self._generation_cache_key(query, prepared)
+            if cache_key is not None:
+                cached_sql = self.generation_cache.get(cache_key)
+                if cached_sql is not None:
+                    print(f"命中SQL生成缓存: {cached_sql}")
+                    yield {"event": "sql", "data": {"sql": cached_sql, "cached": True}}
+                    return
+            
+            parts = []
+            usage = {}
+            messages = self._build_messages(query, prepared["examples"], prepared["schema_info"],
+                                            prepared["relevant_tables"])
+            # 流式请求不做对冲，输出内容前失败时转到下一个接口
+            async for content in self.llm_pool.stream(lambda endpoint: self._stream_llm(endpoint, messages, usage)):
+                parts.append(content)
+                yield {"event": "token", "data": {"text": content}}
+            sql = "".join(parts).strip()
+            print(f"\n生成的 SQL: {sql}")
+            if not sql:
+                raise Exception("API 响应格式错误")
+            self._record_usage(prepared, usage, sql, user_id, auth_db)
+            if cache_key is not None and not sql.startswith("ERROR:"):
+                self.generation_cache.put(cache_key, sql)
+            yield {"event": "sql", "data": {"sql": sql, "cached": False,
+                                            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}}
         except aiohttp.ClientError as e:
             print(f"网络请求错误: {str(e)}")
             raise Exception(f"API 请求失败: {str(e)}")
@@ -327,7 +671,11 @@ class QueryModel:
             return False, f"SQL验证失败: {str(e)}", None
 
     async def execute_query(self, sql: str, user_id: int = None, auth_db = None) -> Any:
-        """执行SQL查询，添加权限验证"""
+        """执行SQL查询，添加权限验证，同一时间相同SQL和权限的请求只执行一次"""
+        key = ("execute", normalize_sql(sql), self._permission_fingerprint(user_id, auth_db))
+        return await self.single_flight.do(key, lambda: self._execute_query(sql, user_id, auth_db))
+
+    async def _execute_query(self, sql: str, user_id: int = None, auth_db = None) -> Any:
         try:
             # 验证SQL
             is_valid, error_msg, corrected_sql = await self.validate_sql(sql, user_id, auth_db)
@@ -341,40 +689,44 @@ class QueryModel:
                 sql = corrected_sql
             print(f"SQL开始执行")
             
-            # 执行查询
-            try:
-                with self.engine.connect() as connection:
-                    # 开始事务
-                    with connection.begin():
-                        print(f"执行SQL: {sql}")
-                        result = connection.execute(text(sql))
-                        columns = result.keys()
-                        rows = result.fetchall()
-                        print(f"查询成功，获取到 {len(rows)} 条记录")
-                        result_list = [dict(zip(columns, row)) for row in rows]
-                print(f"SQL执行成功")
-                return result_list
-            except Exception as e:
-                print(f"SQL执行错误: {str(e)}")
-                # 如果是连接错误，尝试重新连接
-                if "MySQL server has gone away" in str(e):
-                    try:
-                        print("尝试重新连接数据库...")
-                        with self.engine.connect() as connection:
-                            with connection.begin():
-                                result = connection.execute(text(sql))
-                                columns = result.keys()
-                                rows = result.fetchall()
-                                print(f"重连成功，获取到 {len(rows)} 条记录")
-                                return [dict(zip(columns, row)) for row in rows]
-                    except Exception as retry_error:
-                        print(f"重连失败: {str(retry_error)}")
-                        raise Exception(f"SQL执行错误(重连失败): {str(retry_error)}")
-                raise Exception(f"SQL执行错误: {str(e)}")
+            # 在线程池中执行查询，执行期间其他请求可以等待合并
+            return await asyncio.get_running_loop().run_in_executor(None, self._run_sql, sql)
         except Exception as e:
             print(f"执行查询失败: {str(e)}")
             raise Exception(f"执行查询失败: {str(e)}")
 
+    def _run_sql(self, sql: str) -> List[Dict[str, Any]]:
+        """执行已通过校验的SQL，返回结果行"""
+        try:
+            with self.engine.connect() as connection:
+                # 开始事务
+                with connection.begin():
+                    print(f"执行SQL: {sql}")
+                    result = connection.execute(text(sql))
+                    columns = result.keys()
+                    rows = result.fetchall()
+                    print(f"查询成功，获取到 {len(rows)} 条记录")
+                    result_list = [dict(zip(columns, row)) for row in rows]
+            print(f"SQL执行成功")
+            return result_list
+        except Exception as e:
+            print(f"SQL执行错误: {str(e)}")
+            # 如果是连接错误，尝试重新连接
+            if "MySQL server has gone away" in str(e):
+                try:
+                    print("尝试重新连接数据库...")
+                    with self.engine.connect() as connection:
+                        with connection.begin():
+                            result = connection.execute(text(sql))
+                            columns = result.keys()
+                            rows = result.fetchall()
+                            print(f"重连成功，获取到 {len(rows)} 条记录")
+                            return [dict(zip(columns, row)) for row in rows]
+                except Exception as retry_error:
+                    print(f"重连失败: {str(retry_error)}")
+                    raise Exception(f"SQL执行错误(重连失败): {str(retry_error)}")
+            raise Exception(f"SQL执行错误: {str(e)}")
+
     async def execute_edited_query(self, original_sql: str, edited_sql: str) -> Any:
         """执行编辑后的 SQL 查询"""
         try:
@@ -5,6 +5,7 @@ import json
 import os
 
 from ..utils.auth import verify_token
+from ..model.generation_cache import invalidate_generation_caches
 from .models import DatabaseConnection, DatabaseConfig
 
 router = APIRouter(tags=["数据库管理"])
@@ -138,6 +139,7 @@ async def save_database_config(config: DatabaseConfig):
         with open(DB_CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(config.dict(), f, ensure_ascii=False, indent=2)
         
+        invalidate_generation_caches("数据库配置已更新")
         return {"status": "success", "message": "数据库配置保存成功"}
     except SQLAlchemyError as e:
         raise HTTPException(status_code=400, detail=f"数据库连接失败: {str(e)}")
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
 import json
 import os
-import aiohttp
 from ..utils.auth import verify_token
+from ..utils.http_client import get_http_session
 from .models import LLMConfig
 
 router = APIRouter(tags=["LLM配置"])
@@ -59,7 +59,12 @@ async def save_llm_config(config: LLMConfig):
         print(f"确保配置目录存在: {config_dir}")
         os.makedirs(config_dir, exist_ok=True)  # 确保目录存在
         
-        config_data = config.dict()
+        # 与已有配置合并，保留接口之外的配置项（如 http_pool）
+        config_data = {}
+        if os.path.exists(LLM_CONFIG_FILE):
+            with open(LLM_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config_data = json.load(f)
+        config_data.update(config.dict(exclude_none=True))
         print(f"准备保存的配置数据: {config_data}")
         
         # 使用绝对路径并确保文件可写
@@ -67,16 +72,9 @@ async def save_llm_config(config: LLMConfig):
         with open(LLM_CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(config_data, f, ensure_ascii=False, indent=2)
         
-        # 更新当前运行的模型配置
+        # 更新当前运行的模型配置和接口池
         from ..main import query_model
-        query_model.api_url = config.api_url
-        query_model.api_key = config.api_key
-        query_model.model_params = {
-            "model": config.model_name,
-            "temperature": config.temperature,
-            "max_tokens": config.max_tokens,
-            "top_p": config.top_p
-        }
+        await query_model.configure_llm(config_data)
         
         print(f"LLM配置已成功保存到: {LLM_CONFIG_FILE}")
         # 确保返回正确的响应格式
@@ -94,38 +92,38 @@ async def test_llm_connection(config: LLMConfig):
         print(f"测试LLM连接: {config.api_url}")
         print(f"使用API密钥: {config.api_key[:5]}...{config.api_key[-5:]}")
         
-        # 使用aiohttp进行异步请求，与QueryModel中使用的方式保持一致
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {config.api_key}"
-            }
-            
-            data = {
-                "model": config.model_name,
-                "messages": [{"role": "user", "content": "Hello"}],
-                "temperature": config.temperature,
-                "max_tokens": 10
-            }
-            
-            print(f"发送测试请求到: {config.api_url}")
-            print(f"请求数据: {data}")
+        # 使用与QueryModel相同的共享会话
+        session = get_http_session()
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {config.api_key}"
+        }
+        
+        data = {
+            "model": config.model_name,
+            "messages": [{"role": "user", "content": "Hello"}],
+            "temperature": config.temperature,
+            "max_tokens": 10
+        }
+        
+        print(f"发送测试请求到: {config.api_url}")
+        print(f"请求数据: {data}")
+        
+        async with session.post(
+            config.api_url,
+            headers=headers,
+            json=data,
+            timeout=config.timeout
+        ) as response:
+            response_text = await response.text()
+            status_code = response.status
+            print(f"API响应状态码: {status_code}")
+            print(f"API响应内容: {response_text[:200]}...")
             
-            async with session.post(
-                config.api_url,
-                headers=headers,
-                json=data,
-                timeout=config.timeout
-            ) as response:
-                response_text = await response.text()
-                status_code = response.status
-                print(f"API响应状态码: {status_code}")
-                print(f"API响应内容: {response_text[:200]}...")
-                
-                if status_code == 200:
-                    return {"status": "success", "message": "LLM API连接成功"}
-                else:
-                    return {"status": "error", "message": f"LLM API连接失败: {response_text}"}
+            if status_code == 200:
+                return {"status": "success", "message": "LLM API连接成功"}
+            else:
+                return {"status": "error", "message": f"LLM API连接失败: {response_text}"}
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends
+from ..utils.auth import verify_token
+from ..utils.http_client import http_session_stats
+
+router = APIRouter(tags=["运行指标"])
+
+# 依赖项：获取查询模型
+def get_query_model():
+    from ..main import query_model
+    return query_model
+
+@router.get("/metrics/retrieval", dependencies=[Depends(verify_token)])
+async def retrieval_metrics(query_model = Depends(get_query_model)):
+    """获取向量检索线程池和批处理的运行指标"""
+    return {"status": "success", "data": query_model.vector_store.stats()}
+
+@router.get("/metrics/http", dependencies=[Depends(verify_token)])
+async def http_metrics():
+    """获取共享HTTP会话的连接池配置和连接数"""
+    return {"status": "success", "data": http_session_stats()}
+
+@router.get("/metrics/generation", dependencies=[Depends(verify_token)])
+async def generation_metrics(query_model = Depends(get_query_model)):
+    """获取SQL生成缓存、示例改写的命中情况和并发请求合并情况"""
+    cache = query_model.generation_cache
+    data = cache.stats() if cache is not None else {"enabled": False}
+    data["single_flight"] = query_model.single_flight.stats()
+    adapter = query_model.example_adapter
+    data["example_adaptation"] = adapter.stats() if adapter is not None else {"enabled": False}
+    return {"status": "success", "data": data}
+
+@router.get("/metrics/schema", dependencies=[Depends(verify_token)])
+async def schema_metrics(query_model = Depends(get_query_model)):
+    """获取schema裁剪节省的token情况"""
+    return {"status": "success", "data": query_model.schema_selector.stats()}
+
+@router.get("/metrics/tokens", dependencies=[Depends(verify_token)])
+async def token_metrics(query_model = Depends(get_query_model)):
+    """获取大模型调用的token用量，按用户和角色汇总"""
+    data = query_model.token_usage.stats()
+    data["tokenizer"] = query_model.tokenizer.name
+    data["prompt_budget"] = query_model.token_config["prompt_budget"]
+    return {"status": "success", "data": data}
+
+@router.get("/metrics/llm", dependencies=[Depends(verify_token)])
+async def llm_metrics(query_model = Depends(get_query_model)):
+    """获取各大模型接口的排队、重试、熔断、对冲和健康情况"""
+    return {"status": "success", "data": query_model.llm_pool.stats()}
@@ -31,6 +31,16 @@ class DatabaseConfig(BaseModel):
     username: str
     password: str
 
+# LLM API接口列表中的单个接口，未填写的 api_key 和 model_name 使用顶层配置
+class LLMEndpointConfig(BaseModel):
+    name: str = ""
+    api_url: str
+    api_key: str = ""
+    model_name: str = ""
+    priority: int = 0
+    weight: float = 1.0
+    enabled: bool = True
+
 # LLM API配置模型
 class LLMConfig(BaseModel):
     api_url: str
@@ -39,4 +49,6 @@ class LLMConfig(BaseModel):
     temperature: float = 0.7
     max_tokens: int = 2000
     top_p: float = 0.95
-    timeout: int = 60
\ No newline at end of file
+    timeout: int = 60
+    # 多个接口按优先级和权重路由，为None时保留已保存的列表
+    endpoints: Optional[List[LLMEndpointConfig]] = None
\ No newline at end of file
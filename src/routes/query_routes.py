@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Body, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from datetime import datetime
 import json
@@ -7,7 +8,7 @@ import os
 from ..protocol.query_protocol import QueryRequest, QueryResponse
 from ..utils.auth import verify_token, get_current_user_id  # 添加get_current_user_id导入
 from ..model.query_model import QueryModel
-from ..config.auth_db import get_auth_db  # 添加get_auth_db导入
+from ..config.auth_db import get_auth_db, AuthSessionLocal  # 添加get_auth_db导入
 from fastapi import APIRouter, Depends, status
 from sqlalchemy.exc import SQLAlchemyError
 from ..utils.error_handler import AppError
@@ -86,7 +87,7 @@ async def execute_edited_query(
         return {"status": "error", "message": str(e)}
 
 @router.post("/feedback", dependencies=[Depends(verify_token)])
-async def feedback(request: Request):
+async def feedback(request: Request, query_model: QueryModel = Depends(get_query_model)):
     data = await request.json()
     query = data.get("query")
     sql = data.get("sql")
@@ -114,6 +115,16 @@ async def feedback(request: Request):
             json.dump(existing_data, f, ensure_ascii=False, indent=2)
             
         print(f"反馈已保存 - 查询: {query}, SQL: {sql}, 评分: {rating}")
+        
+        # 增量更新向量数据库，新反馈立即可被检索到
+        try:
+            await query_model.vector_store.add_feedback_async(feedback_data)
+        except Exception as e:
+            print(f"更新向量数据库失败: {str(e)}")
+        # 新反馈SQL中的取值可用于改写示例
+        if query_model.example_adapter is not None:
+            query_model.example_adapter.learn(sql)
+        
         return {"status": "success"}
         
     except Exception as e:
@@ -177,4 +188,81 @@ async def query_natural_language(
         print(f"已返回")
     except Exception as e:
         print(f"查询执行错误: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse_event(event: str, data) -> str:
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _query_event_stream(query_model: QueryModel, query_text: str, context_id: str = None,
+                              user_id: int = None, auth_db: Session = None):
+    """
+    依次推送查询各阶段的事件
+
+    retrieval -> token... -> sql -> validation -> rows -> done，出错时推送 error 并结束
+    """
+    try:
+        sql = None
+        async for item in query_model.generate_sql_stream(query_text, user_id, auth_db):
+            if item["event"] == "sql":
+                sql = item["data"]["sql"]
+            yield _sse_event(item["event"], item["data"])
+        
+        is_valid, error_msg, corrected_sql = await query_model.validate_sql(sql, user_id, auth_db)
+        yield _sse_event("validation", {"valid": is_valid, "message": error_msg, "corrected_sql": corrected_sql})
+        if not is_valid:
+            yield _sse_event("error", {"message": f"SQL权限验证失败: {error_msg}"})
+            return
+        
+        # 与非流式接口共用合并执行，相同SQL和权限的并发请求只查询一次数据库
+        result = await query_model.execute_query(sql, user_id, auth_db)
+        yield _sse_event("rows", {"count": len(result), "result": result})
+        
+        if not context_id:
+            context_id = query_model.context_manager.create_context()
+        query_model.context_manager.update_context(context_id, {
+            'query': query_text,
+            'sql': sql,
+            'result': result,
+            'state': 'completed'
+        })
+        yield _sse_event("done", {"context_id": context_id})
+    except Exception as e:
+        print(f"流式查询出错: {str(e)}")
+        yield _sse_event("error", {"message": str(e)})
+
+def _event_stream_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # 关闭nginx等反向代理的缓冲，事件才能及时到达前端
+        "X-Accel-Buffering": "no"
+    })
+
+@router.post("/query_nl_stream", dependencies=[Depends(verify_token)])
+async def process_query_stream(request: QueryRequest, query_model: QueryModel = Depends(get_query_model)):
+    """流式处理自然语言查询，通过SSE推送生成的SQL片段和各阶段进度"""
+    print(f"收到流式查询请求: {request.query_text}")
+    context_id = request.context_id or query_model.context_manager.create_context()
+    return _event_stream_response(_query_event_stream(query_model, request.query_text, context_id))
+
+@router.post("/query_nl_with_auth_stream", dependencies=[Depends(verify_token)])
+async def query_natural_language_stream(
+    query_data: dict = Body(...),
+    query_model: QueryModel = Depends(get_query_model),
+    user_id: int = Depends(get_current_user_id)
+):
+    """流式处理自然语言查询（带权限控制）"""
+    print(f"处理带权限的流式查询，用户ID: {user_id}")
+
+    async def events():
+        # 依赖注入的会话在响应开始发送前就会关闭，流式推送期间使用自己的会话
+        auth_db = AuthSessionLocal()
+        try:
+            async for event in _query_event_stream(query_model, query_data.get("query_text"),
+                                                   query_data.get("context_id"), user_id, auth_db):
+                yield event
+        finally:
+            auth_db.close()
+
+    return _event_stream_response(events())
@@ -5,6 +5,7 @@ from typing import List
 from ..config.auth_db import get_auth_db
 from ..database.models.role import Role, RolePermission
 from ..utils.auth import verify_token
+from ..model.generation_cache import invalidate_generation_caches
 from .models import RolePermissionCreate
 
 router = APIRouter(tags=["角色管理"])
@@ -77,6 +78,7 @@ async def delete_role(role_id: int, db: Session = Depends(get_auth_db)):
     try:
         db.delete(role)
         db.commit()
+        invalidate_generation_caches("角色已删除")
         return {"status": "success"}
     except Exception as e:
         db.rollback()
@@ -110,6 +112,7 @@ async def set_role_permissions(
             db.add(new_perm)
         
         db.commit()
+        invalidate_generation_caches("角色权限已更新")
         return {"status": "success"}
     except Exception as e:
         db.rollback()
@@ -166,6 +169,7 @@ async def delete_permission(
         
         db.delete(permission)
         db.commit()
+        invalidate_generation_caches("权限已删除")
         return {"status": "success", "message": "权限删除成功"}
     except Exception as e:
         db.rollback()
@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from ..config.auth_db import get_auth_db
 from ..database.models.role import RolePermission, UserRole
 from ..utils.auth import verify_token
+from ..model.generation_cache import invalidate_generation_caches
 from ..schema.schema_builder import SchemaBuilder
 
 router = APIRouter(tags=["Schema管理"])
@@ -41,6 +42,7 @@ async def build_schema_for_role(
         schema = schema_builder.build_schema_for_role(perm_list)
         
         if schema:
+            invalidate_generation_caches(f"角色 {role_id} 的schema已重新构建")
             return {"status": "success", "data": schema, "message": f"角色 {role_id} 的schema构建成功"}
         else:
             return {"status": "error", "message": f"角色 {role_id} 的schema构建失败"}
@@ -7,6 +7,7 @@ from ..config.auth_db import get_auth_db
 from ..database.models.user import User
 from ..database.models.role import UserRole, RolePermission, Role  # 添加Role导入
 from ..utils.auth import verify_token
+from ..model.generation_cache import invalidate_generation_caches
 
 router = APIRouter(tags=["用户管理"])
 
@@ -169,6 +170,7 @@ async def set_user_roles(user_id: int, role_ids: List[int], db: Session = Depend
             db.add(user_role)
         
         db.commit()
+        invalidate_generation_caches("用户角色已更新")
         return {"status": "success", "message": "用户角色设置成功"}
     except Exception as e:
         db.rollback()
@@ -8,8 +8,9 @@ class SchemaBuilder:
     """
     根据用户角色权限构建个性化数据库schema
     """
-    def __init__(self, db_url: str):
-        self.engine = create_engine(db_url)
+    def __init__(self, db_url):
+        # 可以传入数据库URL，也可以直接复用已创建的引擎
+        self.engine = db_url if isinstance(db_url, Engine) else create_engine(db_url)
         self.inspector = inspect(self.engine)
         self.metadata = MetaData()
         self.tables_info = {}
@@ -87,11 +88,11 @@ class SchemaBuilder:
             # 处理列信息
             for col in columns:
                 if col["name"] in field_list:
-                    # 查找字段的注释信息
-                    comment = ""
-                    for field in field_info:
+                    # 查找字段的注释信息，权限中没有配置时使用数据库中的字段注释
+                    comment = col.get("comment") or ""
+                    for field in field_info or []:
                         if field.get("name") == col["name"]:
-                            comment = field.get("comment", "")
+                            comment = field.get("comment") or comment
                             break
                     
                     column_info = {
@@ -135,12 +136,15 @@ class SchemaBuilder:
         if key not in self.relationships:
             self.relationships[key] = []
         
-        self.relationships[key].append({
+        relationship = {
             "from_columns": from_cols,
             "to_schema": to_schema,
             "to_table": to_table,
             "to_columns": to_cols
-        })
+        }
+        # 同一个表会被反复读取（每次请求都会获取用户schema），已记录的关系不重复添加
+        if relationship not in self.relationships[key]:
+            self.relationships[key].append(relationship)
     
     def _build_relationships(self, tables: Dict) -> List[Dict]:
         """构建表关系列表"""
@@ -0,0 +1,199 @@
+"""
+Schema裁剪模块 - 按问题相关性挑选表，减少发送给大模型的schema长度
+"""
+from typing import Callable, Dict, List, Optional, Set
+from collections import OrderedDict
+import hashlib
+import numpy as np
+from ..utils.text import normalize_query
+from ..utils.token_counter import estimate_tokens
+from ..vector_store.lexical_index import lexical_key, char_ngrams
+
+# 默认配置，可在 llm_config.json 的 schema_selection 中覆盖
+default_schema_selection_config = {
+    "enabled": True,
+    # schema估算token数超过该值时才裁剪
+    "token_budget": 3000,
+    # 按相关性最多选取的表数，外键关联表另计
+    "max_tables": 8,
+    # 是否补充所选表的外键关联表
+    "include_fk_neighbors": True,
+    # 缓存的表向量条数上限
+    "max_cached_tables": 4096,
+    # 接口侧前缀缓存，默认关闭：发送按问题裁剪并按表名排序后的schema，保留的表相同的请求共享相同前缀，
+    # 裁剪节省的token优先于前缀缓存。开启时 system 消息始终包含角色的完整schema，同一角色的所有请求共享相同前缀，
+    # 裁剪结果只作为相关表提示放在 user 消息中，提示词更长且不节省token，适合接口对缓存部分大幅降价的场景。
+    # 提示词超过 prompt_budget 时两种方式都会裁剪schema
+    "prefix_cache": False
+}
+
+
+def table_description(table: Dict) -> str:
+    """表名及各字段的名称、类型和注释，用于计算表与问题的相关性"""
+    lines = [table["name"]]
+    for column in table.get("columns", []):
+        lines.append(" ".join(part for part in (column["name"], column.get("type", ""), column.get("comment", "")) if part))
+    return "\n".join(lines)
+
+
+def foreign_key_neighbors(tables: List[Dict]) -> Dict[str, Set[str]]:
+    """由各表的外键信息得到双向邻接表，只保留给定表之间的关联"""
+    names = {table["name"] for table in tables}
+    neighbors: Dict[str, Set[str]] = {name: set() for name in names}
+    for table in tables:
+        for fk in table.get("foreign_keys", []):
+            referred = fk.get("referred_table")
+            if referred in names and referred != table["name"]:
+                neighbors[table["name"]].add(referred)
+                neighbors[referred].add(table["name"])
+    return neighbors
+
+
+class SchemaSelector:
+    """
+    按问题挑选相关的表
+
+    输入为 SchemaManager 给出的表结构列表，表描述（表名、字段名、类型和注释）直接取自表信息，
+    编码后的向量只在内存中缓存，不写入示例检索的向量磁盘缓存；问题向量优先复用示例检索时已缓存的结果。
+    各表描述文本估算token数之和不超过预算时原样返回；超过时按与问题的相似度依次加入表及其外键关联表，直到用完预算。
+    向量模型不可用时（未加载完成或使用独立检索服务）按字符片段重合度排序。
+    """
+
+    def __init__(self, vector_store, config: Optional[Dict] = None,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.vector_store = vector_store
+        self.count_tokens = count_tokens
+        self.config = default_schema_selection_config.copy()
+        self.config.update(config or {})
+        self._table_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # 统计信息
+        self.selections = 0
+        self.pruned = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    async def select(self, query: str, tables: List[Dict], token_budget: Optional[int] = None) -> List[Dict]:
+        """
+        返回保留的表，保持输入顺序
+
+        Args:
+            tables: 表结构列表，每个表包含 name、columns、foreign_keys 和发送给大模型的 text
+            token_budget: 为None时使用配置的预算
+        """
+        if not self.config["enabled"] and token_budget is None:
+            return tables
+        self.selections += 1
+        before = self.count_tokens("\n".join(table["text"] for table in tables))
+        budget = self.config["token_budget"] if token_budget is None else token_budget
+        if before <= budget or len(tables) <= 1:
+            return tables
+
+        descriptions = [table_description(table) for table in tables]
+        try:
+            scores = await self._score(query, descriptions)
+        except Exception as e:
+            print(f"计算表相关性失败，改用字符匹配: {str(e)}")
+            scores = self._lexical_scores(query, descriptions)
+        chosen = self._choose(tables, scores, budget)
+
+        pruned = [table for table in tables if table["name"] in chosen]
+        self.pruned += 1
+        print(f"Schema裁剪: 保留 {len(chosen)}/{len(tables)} 个表")
+        return pruned
+
+    def record_sent(self, full_tokens: int, sent_tokens: int):
+        """记录角色完整schema与实际发送的schema的token数，节省比例只按实际发送的内容统计"""
+        self.tokens_before += full_tokens
+        self.tokens_after += sent_tokens
+
+    def _choose(self, tables: List[Dict], scores: np.ndarray, budget: int) -> Set[str]:
+        """按相关性依次加入表和外键关联表，至少保留最相关的一个表"""
+        costs = {table["name"]: self.count_tokens(table["text"]) for table in tables}
+        neighbors = foreign_key_neighbors(tables) if self.config["include_fk_neighbors"] else {}
+        positions = {table["name"]: pos for pos, table in enumerate(tables)}
+        chosen: List[str] = []
+        used = 0
+
+        def try_add(name: str) -> bool:
+            nonlocal used
+            if name in chosen:
+                return True
+            if chosen and used + costs[name] > budget:
+                return False
+            chosen.append(name)
+            used += costs[name]
+            return True
+
+        picked = 0
+        for pos in np.argsort(-scores, kind="stable"):
+            if picked >= self.config["max_tables"]:
+                break
+            name = tables[pos]["name"]
+            if not try_add(name):
+                continue
+            picked += 1
+            # 关联表按相关性顺序补充，便于生成JOIN
+            for neighbor in sorted(neighbors.get(name, ()),
+                                   key=lambda other: -scores[positions[other]]):
+                try_add(neighbor)
+        return set(chosen)
+
+    async def _score(self, query: str, descriptions: List[str]) -> np.ndarray:
+        """问题与各表描述的余弦相似度"""
+        store = self.vector_store
+        if store._use_remote() or not store.is_ready:
+            return self._lexical_scores(query, descriptions)
+        key = normalize_query(query)
+        query_vector = store.query_cache.get_embedding(key)
+        if query_vector is None:
+            # 与示例检索共用查询向量缓存，同样编码原始问题
+            query_vector = np.asarray(await store.batcher.encode(query), dtype='float32').reshape(1, -1)
+            store.query_cache.put_embedding(key, query_vector)
+        table_vectors = await self._table_matrix(descriptions)
+        query_vector = query_vector.reshape(-1)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        return table_vectors @ query_vector
+
+    async def _table_matrix(self, texts: List[str]) -> np.ndarray:
+        """获取表描述的单位向量，未缓存的一次性批量编码"""
+        keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        missing = [pos for pos, key in enumerate(keys) if key not in self._table_vectors]
+        if missing:
+            store = self.vector_store
+            # 直接调用模型编码，表向量不写入示例检索的向量磁盘缓存
+            vectors = await store.executor.run(store._encode, [texts[pos] for pos in missing])
+            vectors = np.asarray(vectors, dtype='float32')
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            for pos, vector in zip(missing, vectors):
+                self._table_vectors[keys[pos]] = vector
+        matrix = np.stack([self._table_vectors[key] for key in keys])
+        for key in keys:
+            self._table_vectors.move_to_end(key)
+        while len(self._table_vectors) > self.config["max_cached_tables"]:
+            self._table_vectors.popitem(last=False)
+        return matrix
+
+    @staticmethod
+    def _lexical_scores(query: str, descriptions: List[str]) -> np.ndarray:
+        """问题片段在表描述中出现的比例"""
+        grams = set(char_ngrams(lexical_key(query)))
+        if not grams:
+            return np.zeros(len(descriptions), dtype='float32')
+        scores = []
+        for description in descriptions:
+            description_key = lexical_key(description)
+            scores.append(sum(1 for gram in grams if gram in description_key) / len(grams))
+        return np.array(scores, dtype='float32')
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.config["enabled"],
+            "token_budget": self.config["token_budget"],
+            "prefix_cache": self.config["prefix_cache"],
+            "selections": self.selections,
+            "pruned": self.pruned,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "saved_ratio": 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0,
+            "cached_tables": len(self._table_vectors),
+        }
@@ -0,0 +1,87 @@
+"""
+有界线程池模块 - 将阻塞计算移出事件循环，并限制排队长度
+"""
+from typing import Callable, Dict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from collections import deque
+import asyncio
+import threading
+import time
+
+
+class ExecutorBusyError(RuntimeError):
+    """排队任务已达上限"""
+    pass
+
+
+class BoundedExecutor(Executor):
+    """
+    有界线程池
+
+    排队（尚未开始执行）的任务超过 max_queue 时拒绝新任务，
+    同时统计排队深度、执行中任务数和任务等待时间。
+    """
+
+    def __init__(self, name: str, max_workers: int = 2, max_queue: int = 64):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        # 最近任务的排队等待时间（毫秒）
+        self._wait_times = deque(maxlen=1000)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorBusyError(f"{self.name} 线程池排队任务已满 ({self.max_queue})")
+            self._queued += 1
+            self._submitted += 1
+        enqueued_at = time.perf_counter()
+
+        def task():
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_times.append((time.perf_counter() - enqueued_at) * 1000)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        return self._executor.submit(task)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """在线程池中执行函数并异步等待结果"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        self._executor.shutdown(wait=wait, **kwargs)
+
+    def stats(self) -> Dict:
+        """返回线程池统计信息"""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            stats = {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+        if waits:
+            stats["wait_ms_p50"] = waits[len(waits) // 2]
+            stats["wait_ms_p99"] = waits[min(len(waits) - 1, int(len(waits) * 0.99))]
+            stats["wait_ms_max"] = waits[-1]
+        return stats
@@ -0,0 +1,74 @@
+"""
+HTTP客户端模块 - 应用级共享的aiohttp会话，复用到大模型接口的连接
+"""
+from typing import Dict, Optional
+import aiohttp
+
+# 默认连接池配置，可在 llm_config.json 的 http_pool 中覆盖
+default_http_pool_config = {
+    # 连接总数上限和单个主机的连接上限
+    "limit": 100,
+    "limit_per_host": 20,
+    # 空闲连接保持时间（秒）
+    "keepalive_timeout": 60,
+    # DNS解析结果缓存时间（秒）
+    "ttl_dns_cache": 300,
+    # 建立连接的超时时间（秒），整个请求的超时由各调用方指定
+    "connect_timeout": 10,
+    "verify_ssl": False
+}
+
+_session: Optional[aiohttp.ClientSession] = None
+_config: Dict = default_http_pool_config.copy()
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=_config["limit"],
+        limit_per_host=_config["limit_per_host"],
+        keepalive_timeout=_config["keepalive_timeout"],
+        ttl_dns_cache=_config["ttl_dns_cache"],
+        use_dns_cache=True,
+        ssl=None if _config["verify_ssl"] else False
+    )
+    timeout = aiohttp.ClientTimeout(connect=_config["connect_timeout"])
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def start_http_session(config: Optional[Dict] = None) -> aiohttp.ClientSession:
+    """应用启动时创建共享会话"""
+    global _session, _config
+    _config = default_http_pool_config.copy()
+    _config.update(config or {})
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = _create_session()
+    print(f"已创建共享HTTP会话，连接上限 {_config['limit']}，单主机上限 {_config['limit_per_host']}")
+    return _session
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """获取共享会话，未启动或已关闭时按当前配置重新创建（需在事件循环中调用）"""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+async def close_http_session():
+    """应用关闭时关闭共享会话及其连接"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        print("共享HTTP会话已关闭")
+    _session = None
+
+
+def http_session_stats() -> Dict:
+    """返回连接池配置和当前连接数"""
+    stats = {"config": dict(_config), "open": _session is not None and not _session.closed}
+    if stats["open"]:
+        connector = _session.connector
+        stats["acquired"] = len(getattr(connector, "_acquired", ()))
+        stats["idle"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    return stats
@@ -0,0 +1,63 @@
+"""
+请求合并模块 - 相同键的并发请求只执行一次，后到的请求等待第一个请求的结果
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同键的进行中请求
+
+    第一个请求创建执行任务，执行期间到达的相同键请求直接等待该任务的结果，
+    执行结束（成功或失败）后键即被移除，之后的请求重新执行。
+    单个等待者被取消不会影响其他等待者；所有等待者都取消后才取消执行任务。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task, key=key: self._forget(key, task))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            # shield 保证某个等待者被取消时执行任务继续为其他等待者运行
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        call = self._calls.get(key)
+        if call is not None and call.task is task:
+            del self._calls[key]
+        # 无人等待时取出异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,50 @@
+"""
+文本处理工具
+"""
+import re
+import unicodedata
+
+# 查询末尾可忽略的标点
+TRAILING_PUNCTUATION = "?？。.!！;；,，、 "
+
+
+def normalize_query(query: str) -> str:
+    """
+    规范化自然语言查询，用作缓存和去重的键
+
+    统一全角/半角字符和大小写，合并空白，去掉末尾标点
+    """
+    if not query:
+        return ""
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(TRAILING_PUNCTUATION)
+
+
+# SQL中的字符串常量，支持反斜杠转义和两个引号的转义
+_SQL_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+
+
+def _normalize_sql_code(code: str) -> str:
+    code = re.sub(r"\s+", " ", code)
+    return re.sub(r"\s*([(),=<>])\s*", r"\1", code)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    规范化SQL语句，用于判断两条SQL是否等价
+
+    合并空白，去掉运算符和括号两侧的空格以及末尾分号；不转换大小写，
+    MySQL 的 lower_case_table_names=0 时表名区分大小写，'A' 与 'a'、'%a  b%' 与 '%a b%' 的查询结果也可能不同，
+    字符串常量原样保留
+    """
+    if not sql:
+        return ""
+    parts = []
+    position = 0
+    for match in _SQL_LITERAL.finditer(sql):
+        parts.append(_normalize_sql_code(sql[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(_normalize_sql_code(sql[position:]))
+    return "".join(parts).strip().rstrip(";").strip()
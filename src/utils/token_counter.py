@@ -0,0 +1,150 @@
+"""
+Token统计模块 - 估算提示词各部分的token数，按用户和角色汇总大模型接口返回的用量
+"""
+from typing import Dict, Iterable, List, Optional
+import re
+import threading
+
+# 默认配置，可在 llm_config.json 的 token_accounting 中覆盖
+default_token_config = {
+    # 分词器: heuristic（按字符估算）、tiktoken、huggingface
+    "tokenizer": "heuristic",
+    # tiktoken 的编码名或 huggingface 的模型名
+    "tokenizer_name": "cl100k_base",
+    # 提示词token上限，超过时先减少示例再裁剪schema，0表示不限制
+    "prompt_budget": 0,
+    # 每条消息的固定开销（角色标记等）
+    "message_overhead": 4
+}
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文字符按1个计，其余按4个字符1个计"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class HeuristicTokenizer:
+    """不依赖模型词表的估算分词器"""
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        return estimate_tokens(text)
+
+
+class TiktokenTokenizer:
+    """OpenAI 兼容模型使用的 tiktoken 分词器"""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken:{encoding_name}"
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text or "", disallowed_special=()))
+
+
+class HuggingFaceTokenizer:
+    """使用模型自带的分词器，例如 deepseek-ai/DeepSeek-V3"""
+
+    def __init__(self, model_name: str):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.name = f"huggingface:{model_name}"
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text or "", add_special_tokens=False))
+
+
+def create_tokenizer(config: Optional[Dict] = None):
+    """按配置创建分词器，依赖未安装或加载失败时回退到估算分词器"""
+    config = dict(default_token_config, **(config or {}))
+    kind = config["tokenizer"]
+    try:
+        if kind == "tiktoken":
+            return TiktokenTokenizer(config["tokenizer_name"])
+        if kind == "huggingface":
+            return HuggingFaceTokenizer(config["tokenizer_name"])
+    except Exception as e:
+        print(f"加载分词器 {kind} 失败，使用估算分词器: {str(e)}")
+    return HeuristicTokenizer()
+
+
+class TokenUsageTracker:
+    """
+    汇总每次大模型调用的token用量
+
+    提示词和补全token优先取接口返回的 usage，接口未返回时使用本地估算值。
+    按全局、用户和角色分别累计，同时累计提示词各部分（instructions、schema、examples、query）的估算值。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = self._empty()
+        self.by_user: Dict[str, Dict] = {}
+        self.by_role: Dict[str, Dict] = {}
+
+    @staticmethod
+    def _empty() -> Dict:
+        return {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_prompt_tokens": 0,
+            "estimated_requests": 0,
+            "components": {},
+        }
+
+    @staticmethod
+    def _add(bucket: Dict, prompt_tokens: int, completion_tokens: int, cached_tokens: int,
+             estimated: bool, components: Dict[str, int]):
+        bucket["requests"] += 1
+        bucket["prompt_tokens"] += prompt_tokens
+        bucket["completion_tokens"] += completion_tokens
+        bucket["cached_prompt_tokens"] += cached_tokens
+        if estimated:
+            bucket["estimated_requests"] += 1
+        for name, tokens in components.items():
+            bucket["components"][name] = bucket["components"].get(name, 0) + tokens
+
+    def record(self, components: Dict[str, int], usage: Optional[Dict], completion_estimate: int,
+               user_id: Optional[int] = None, roles: Iterable[str] = ()) -> Dict:
+        """记录一次调用，返回本次使用的计数"""
+        usage = usage or {}
+        estimated = "prompt_tokens" not in usage
+        prompt_tokens = usage.get("prompt_tokens", sum(components.values()))
+        completion_tokens = usage.get("completion_tokens", completion_estimate)
+        # OpenAI 返回 prompt_tokens_details.cached_tokens，DeepSeek 返回 prompt_cache_hit_tokens
+        cached_tokens = ((usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+                         or usage.get("prompt_cache_hit_tokens") or 0)
+        args = (prompt_tokens, completion_tokens, cached_tokens, estimated, components)
+        with self._lock:
+            self._add(self.total, *args)
+            user_key = str(user_id) if user_id else "anonymous"
+            self._add(self.by_user.setdefault(user_key, self._empty()), *args)
+            for role in roles:
+                self._add(self.by_role.setdefault(str(role), self._empty()), *args)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "cached_prompt_tokens": cached_tokens, "estimated": estimated}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "total": _copy(self.total),
+                "by_user": {key: _copy(bucket) for key, bucket in self.by_user.items()},
+                "by_role": {key: _copy(bucket) for key, bucket in self.by_role.items()},
+            }
+
+
+def _copy(bucket: Dict) -> Dict:
+    hit_ratio = bucket["cached_prompt_tokens"] / bucket["prompt_tokens"] if bucket["prompt_tokens"] else 0.0
+    return dict(bucket, components=dict(bucket["components"]), cache_hit_ratio=hit_ratio)
+
+
+def count_message_tokens(tokenizer, messages: List[Dict[str, str]], overhead: int = 4) -> int:
+    """整个消息列表的token数"""
+    return sum(tokenizer.count(message["content"]) + overhead for message in messages)
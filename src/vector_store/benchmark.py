@@ -0,0 +1,174 @@
+"""
+向量检索基准测试 - 对比各类近似索引相对flat索引的召回率和查询延迟
+
+用法:
+    python -m src.vector_store.benchmark --size 100000 --dim 768 --queries 200 --top-k 5
+    python -m src.vector_store.benchmark --from-cache --nprobe 8,16,32 --ef-search 32,64,128
+    python -m src.vector_store.benchmark --storage-modes float32,fp16,sq8,pq
+"""
+from typing import Dict, List, Tuple
+import argparse
+import json
+import time
+import numpy as np
+import faiss
+from .feedback_store import load_vector_config, PROJECT_ROOT
+from .embedding_cache import EmbeddingCache
+from .index_factory import build_index, describe_index, index_memory_bytes, STORAGE_MODES
+
+
+def make_vectors(size: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """生成带聚类结构的合成向量，近似真实查询向量的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 100), dimension)).astype('float32')
+    labels = rng.integers(0, len(centers), size=size)
+    noise = rng.normal(scale=0.3, size=(size, dimension)).astype('float32')
+    return centers[labels] + noise
+
+
+def load_cached_vectors(config: Dict) -> np.ndarray:
+    """读取磁盘向量缓存中的全部向量"""
+    cache_dir = PROJECT_ROOT / config["cache_dir"]
+    with open(cache_dir / 'meta.json', 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    cache = EmbeddingCache(cache_dir, meta['model_id'], meta['dimension'])
+    if len(cache) == 0:
+        raise RuntimeError(f"向量缓存为空: {cache_dir}")
+    return cache.all_vectors()
+
+
+def search_latencies(index: faiss.Index, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, List[float]]:
+    """逐条查询并记录每次查询的耗时（毫秒）"""
+    results = np.zeros((len(queries), top_k), dtype='int64')
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = indices[0]
+    return results, latencies
+
+
+def recall_at_k(truth: np.ndarray, approx: np.ndarray) -> float:
+    """近似结果中命中精确top-k的比例"""
+    hits = sum(len(set(t) & set(a)) for t, a in zip(truth, approx))
+    return hits / truth.size
+
+
+def benchmark_index(index_type: str, vectors: np.ndarray, queries: np.ndarray,
+                    truth: np.ndarray, config: Dict, top_k: int) -> Dict:
+    """构建指定类型的索引并测量召回率与延迟"""
+    start = time.perf_counter()
+    index = build_index(index_type, vectors.shape[1], config, vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    build_seconds = time.perf_counter() - start
+    results, latencies = search_latencies(index, queries, top_k)
+    return {
+        "index": describe_index(index),
+        "nprobe": config.get("nprobe") if index_type.startswith("ivf") else None,
+        "ef_search": config.get("ef_search") if index_type == "hnsw" else None,
+        "build_seconds": build_seconds,
+        "recall": recall_at_k(truth, results),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, config: Dict, top_k: int,
+        nprobe_values: List[int], ef_search_values: List[int]) -> List[Dict]:
+    """以flat索引结果为基准，依次测试各索引类型和参数组合"""
+    flat = build_index("flat", vectors.shape[1], dict(config, storage_mode="float32"), vectors)
+    flat.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    truth, flat_latencies = search_latencies(flat, queries, top_k)
+    rows = [{
+        "index": describe_index(flat), "nprobe": None, "ef_search": None, "build_seconds": 0.0,
+        "recall": 1.0,
+        "p50_ms": float(np.percentile(flat_latencies, 50)),
+        "p99_ms": float(np.percentile(flat_latencies, 99)),
+    }]
+    for index_type in ("ivf_flat", "ivf_pq"):
+        for nprobe in nprobe_values:
+            rows.append(benchmark_index(index_type, vectors, queries, truth,
+                                        dict(config, nprobe=nprobe), top_k))
+    for ef_search in ef_search_values:
+        rows.append(benchmark_index("hnsw", vectors, queries, truth,
+                                    dict(config, ef_search=ef_search), top_k))
+    return rows
+
+
+def run_storage(vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, config: Dict,
+                top_k: int, storage_modes: List[str]) -> List[Dict]:
+    """对比flat索引在不同向量存储方式下的内存占用和召回率"""
+    rows = []
+    for storage_mode in storage_modes:
+        mode_config = dict(config, storage_mode=storage_mode)
+        start = time.perf_counter()
+        index = build_index("flat", vectors.shape[1], mode_config, vectors)
+        index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+        build_seconds = time.perf_counter() - start
+        results, latencies = search_latencies(index, queries, top_k)
+        rows.append({
+            "storage_mode": storage_mode,
+            "index": describe_index(index),
+            "index_bytes": index_memory_bytes(index),
+            "bytes_per_vector": index_memory_bytes(index) / len(vectors),
+            "build_seconds": build_seconds,
+            "recall": recall_at_k(truth, results),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+        })
+    return rows
+
+
+def print_storage_report(rows: List[Dict], top_k: int):
+    print(f"\n{'存储方式':<10}{'索引':<24}{'内存(MB)':>10}{'字节/向量':>10}{f'recall@{top_k}':>12}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for row in rows:
+        print(f"{row['storage_mode']:<10}{row['index']:<24}{row['index_bytes'] / 1024 / 1024:>10.2f}"
+              f"{row['bytes_per_vector']:>10.1f}{row['recall']:>12.4f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+
+def print_report(rows: List[Dict], top_k: int):
+    print(f"\n{'索引':<32}{'nprobe':>8}{'efSearch':>10}{'构建(s)':>10}{f'recall@{top_k}':>12}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for row in rows:
+        print(f"{row['index']:<32}{str(row['nprobe'] or '-'):>8}{str(row['ef_search'] or '-'):>10}"
+              f"{row['build_seconds']:>10.2f}{row['recall']:>12.4f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量检索召回率与延迟基准测试")
+    parser.add_argument("--size", type=int, default=100000, help="合成向量数量")
+    parser.add_argument("--dim", type=int, default=768, help="合成向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--from-cache", action="store_true", help="使用磁盘向量缓存代替合成向量")
+    parser.add_argument("--nprobe", type=_int_list, default=[8, 16, 32])
+    parser.add_argument("--ef-search", type=_int_list, default=[32, 64, 128])
+    parser.add_argument("--storage-modes", type=lambda v: [m for m in v.split(',') if m in STORAGE_MODES],
+                        default=[], help="对比的向量存储方式，如 float32,fp16,sq8,pq")
+    args = parser.parse_args()
+
+    config = load_vector_config()
+    if args.from_cache:
+        vectors = load_cached_vectors(config)
+    else:
+        vectors = make_vectors(args.size, args.dim)
+    rng = np.random.default_rng(1)
+    # 查询取自语料并加入扰动，模拟相近但不完全相同的用户问题
+    picks = rng.integers(0, len(vectors), size=args.queries)
+    queries = vectors[picks] + rng.normal(scale=0.1, size=(args.queries, vectors.shape[1])).astype('float32')
+    print(f"语料 {len(vectors)} 条，维度 {vectors.shape[1]}，查询 {len(queries)} 次")
+    rows = run(vectors, queries, config, args.top_k, args.nprobe, args.ef_search)
+    print_report(rows, args.top_k)
+    if args.storage_modes:
+        flat = build_index("flat", vectors.shape[1], dict(config, storage_mode="float32"), vectors)
+        flat.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+        truth, _ = search_latencies(flat, queries, args.top_k)
+        print_storage_report(run_storage(vectors, queries, truth, config, args.top_k, args.storage_modes), args.top_k)
+
+
+if __name__ == "__main__":
+    main()
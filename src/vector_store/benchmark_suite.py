@@ -0,0 +1,287 @@
+"""
+检索基准测试套件 - 在合成反馈语料上测量 FeedbackVectorStore 的构建耗时、内存、检索延迟和召回率
+
+与 benchmark.py 直接测试FAISS索引不同，这里走完整的 FeedbackVectorStore 流程（记录存储、词法索引、
+表权限标记、查询缓存等），结果写入JSON文件，便于在不同提交之间对比。
+默认使用本地哈希编码器代替句向量模型，无需模型文件和网络，加 --encoder model 使用真实模型。
+
+用法:
+    python -m src.vector_store.benchmark_suite --sizes 1000,10000,100000
+    python -m src.vector_store.benchmark_suite --sizes 1000000 --configs flat,hnsw --storage-modes float32,sq8
+    python -m src.vector_store.benchmark_suite --encoder model --sizes 1000 --output results.json
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import zlib
+import numpy as np
+import faiss
+from .feedback_store import FeedbackVectorStore, load_vector_config, PROJECT_ROOT
+from .index_factory import describe_index, index_memory_bytes, INDEX_TYPES
+from .benchmark import recall_at_k
+from ..utils.text import normalize_query
+
+# 合成语料的取值范围，与 feedback_data.json 中的查询风格一致
+STATIONS = ["坂头", "西湖", "鼓山", "洪山桥", "杨桥西路", "五四北", "快安", "师大", "紫阳", "海峡会展中心",
+            "马尾", "长乐", "闽侯", "连江", "罗源", "永泰", "闽清", "平潭", "福清", "晋安"]
+METRICS = [("AQI", "AQI"), ("PM2.5", "PM25"), ("PM10", "PM10"), ("二氧化硫", "SO2"),
+           ("二氧化氮", "NO2"), ("臭氧", "O3"), ("一氧化碳", "CO")]
+AGGREGATES = [("平均值", "AVG"), ("均值", "AVG"), ("最大值", "MAX"), ("最小值", "MIN")]
+TEMPLATES = [
+    "{station}{year}年{month}月{metric}{agg}",
+    "查询{station}{year}年{month}月的{metric}{agg}",
+    "{station}站点{year}年{month}月{metric}的{agg}是多少",
+    "统计{year}年{month}月{station}{metric}{agg}",
+]
+
+
+class HashingEncoder:
+    """
+    本地哈希编码器，替代句向量模型用于基准测试
+
+    把查询的单字和两字片段哈希到固定维度后归一化，字面相近的查询向量也相近，
+    编码速度远快于真实模型，便于测试百万级语料
+    """
+
+    def __init__(self, dimension: int = 128):
+        self.dimension = dimension
+        self.model_id = f"hashing-encoder:{dimension}"
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+            for gram in grams:
+                code = zlib.crc32(gram.encode('utf-8'))
+                vectors[row, code % self.dimension] += 1.0 if code & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+def make_record(rng: np.random.Generator) -> Dict:
+    """生成一条与反馈文件记录结构和长度相近的合成记录"""
+    station = STATIONS[rng.integers(len(STATIONS))]
+    metric, column = METRICS[rng.integers(len(METRICS))]
+    agg, func = AGGREGATES[rng.integers(len(AGGREGATES))]
+    year = int(rng.integers(2015, 2025))
+    month = int(rng.integers(1, 13))
+    template = TEMPLATES[rng.integers(len(TEMPLATES))]
+    query = template.format(station=station, year=year, month=month, metric=metric, agg=agg)
+    sql = (f"SELECT {func}(CAST({column} AS DECIMAL(10, 2))) AS {func.lower()}_{column.lower()}\n"
+           f"FROM envom_origin\nWHERE CDMC = '{station}' AND CYRQ LIKE '{year}-{month:02d}%';")
+    return {
+        "timestamp": f"2025-{int(rng.integers(1, 13)):02d}-{int(rng.integers(1, 29)):02d} 12:00:00",
+        "query": query,
+        "sql": sql,
+        "rating": int(rng.integers(3, 6)),
+    }
+
+
+def make_corpus(size: int, seed: int = 0) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    return [make_record(rng) for _ in range(size)]
+
+
+def make_queries(corpus: List[Dict], count: int, repeat_ratio: float, seed: int = 1) -> List[str]:
+    """生成查询：repeat_ratio 比例取自语料原文（模拟重复提问），其余为新生成的查询"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        if rng.random() < repeat_ratio:
+            queries.append(corpus[rng.integers(len(corpus))]["query"])
+        else:
+            queries.append(make_record(rng)["query"])
+    return queries
+
+
+def rss_bytes() -> int:
+    """当前进程常驻内存，仅Linux下可用，其他平台返回0"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(np.mean(latencies)),
+    }
+
+
+def measure_recall(store: FeedbackVectorStore, queries: List[str], top_k: int) -> float:
+    """向量检索结果相对精确检索的召回率"""
+    vectors = store._encode([normalize_query(query) for query in queries])
+    ids = np.array(list(store.records), dtype='int64')
+    exact = faiss.IndexIDMap(faiss.IndexFlatL2(store.dimension))
+    exact.add_with_ids(store.get_vectors(list(ids)), ids)
+    _, truth = exact.search(vectors, top_k)
+    approx = np.full_like(truth, -1)
+    for row, vector in enumerate(vectors):
+        neighbors = store._search(vector.reshape(1, -1), top_k)
+        approx[row, :len(neighbors)] = [record_id for record_id, _ in neighbors]
+    return recall_at_k(truth, approx)
+
+
+def measure_single(store: FeedbackVectorStore, queries: List[str], top_k: int) -> Dict:
+    """逐条调用同步检索接口的延迟"""
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.find_similar_examples(query, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentiles(latencies)
+
+
+def measure_batched(store: FeedbackVectorStore, queries: List[str], top_k: int, batch_size: int) -> Dict:
+    """按批并发调用异步检索接口，统计每批耗时和吞吐，查询缓存在测量前清空"""
+    async def run():
+        latencies = []
+        start_all = time.perf_counter()
+        for offset in range(0, len(queries), batch_size):
+            batch = queries[offset:offset + batch_size]
+            start = time.perf_counter()
+            await asyncio.gather(*(store.find_similar_examples_async(query, top_k) for query in batch))
+            latencies.append((time.perf_counter() - start) * 1000)
+        elapsed = time.perf_counter() - start_all
+        await store.batcher.close()
+        return latencies, elapsed
+
+    store.query_cache.clear()
+    latencies, elapsed = asyncio.run(run())
+    result = percentiles(latencies)
+    result["batch_size"] = batch_size
+    result["queries_per_second"] = len(queries) / elapsed if elapsed else 0.0
+    return result
+
+
+def run_case(corpus_file: Path, size: int, index_type: str, storage_mode: str, queries: List[str],
+             args, base_config: Dict, model, work_dir: Path) -> Dict:
+    """按一种索引配置构建store并完成全部测量"""
+    config = dict(base_config, index_type=index_type, storage_mode=storage_mode,
+                  cache_enabled=not args.no_cache, cache_dir=str(work_dir / f"cache-{index_type}-{storage_mode}"),
+                  payload_storage=args.payload_storage,
+                  retrieval_queue_size=max(base_config["retrieval_queue_size"], args.batch_size * 2))
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    store = FeedbackVectorStore(config, feedback_path=corpus_file, model=model)
+    build_seconds = time.perf_counter() - start
+    result = {
+        "size": size,
+        "index_type": index_type,
+        "storage_mode": storage_mode,
+        "index": describe_index(store.index),
+        "build_seconds": build_seconds,
+        "index_bytes": index_memory_bytes(store.index),
+        "rss_delta_bytes": rss_bytes() - rss_before,
+        "recall": measure_recall(store, queries, args.top_k),
+        "single": measure_single(store, queries, args.top_k),
+        "batched": measure_batched(store, queries, args.top_k, args.batch_size),
+        "retrieval_paths": dict(store.retrieval_counts),
+    }
+    store.executor.shutdown(wait=False)
+    return result
+
+
+def print_report(rows: List[Dict], top_k: int):
+    print(f"\n{'语料':>9} {'索引':<28}{'构建(s)':>9}{'索引(MB)':>10}{'RSS增量(MB)':>12}{f'recall@{top_k}':>11}"
+          f"{'单条p50':>9}{'单条p99':>9}{'批p50':>9}{'QPS':>9}")
+    for row in rows:
+        print(f"{row['size']:>9} {row['index'] + '/' + row['storage_mode']:<28}{row['build_seconds']:>9.2f}"
+              f"{row['index_bytes'] / 1024 / 1024:>10.2f}{row['rss_delta_bytes'] / 1024 / 1024:>12.1f}"
+              f"{row['recall']:>11.4f}{row['single']['p50_ms']:>9.3f}{row['single']['p99_ms']:>9.3f}"
+              f"{row['batched']['p50_ms']:>9.2f}{row['batched']['queries_per_second']:>9.0f}")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def _str_list(value: str) -> List[str]:
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FeedbackVectorStore 检索基准测试套件")
+    parser.add_argument("--sizes", type=_int_list, default=[1000, 10000, 100000], help="合成语料条数")
+    parser.add_argument("--configs", type=_str_list, default=["flat", "ivf_flat", "ivf_pq", "hnsw"],
+                        help=f"索引类型，可选 {','.join(INDEX_TYPES)}")
+    parser.add_argument("--storage-modes", type=_str_list, default=["float32"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="查询中与语料原文相同的比例")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32, help="并发检索的批大小")
+    parser.add_argument("--encoder", choices=["hashing", "model"], default="hashing",
+                        help="hashing 使用本地哈希编码器，model 使用 text2vec-base-chinese")
+    parser.add_argument("--dim", type=int, default=128, help="哈希编码器的向量维度")
+    parser.add_argument("--payload-storage", choices=["memory", "mmap"], default="memory")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="关闭磁盘向量缓存（缓存目录在临时目录中，构建耗时始终包含全部编码）")
+    parser.add_argument("--output", type=Path, default=None, help="结果JSON文件，默认写入 benchmark_results/")
+    args = parser.parse_args()
+
+    base_config = load_vector_config()
+    model = HashingEncoder(args.dim) if args.encoder == "hashing" else None
+    commit = git_commit()
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="retrieval-bench-") as tmp:
+        work_dir = Path(tmp)
+        for size in args.sizes:
+            corpus = make_corpus(size)
+            corpus_file = work_dir / f"feedback-{size}.json"
+            with open(corpus_file, 'w', encoding='utf-8') as f:
+                json.dump(corpus, f, ensure_ascii=False)
+            queries = make_queries(corpus, args.queries, args.repeat_ratio)
+            print(f"语料 {size} 条（{corpus_file.stat().st_size / 1024 / 1024:.1f} MB），查询 {len(queries)} 次")
+            del corpus
+            for index_type in args.configs:
+                for storage_mode in args.storage_modes:
+                    try:
+                        rows.append(run_case(corpus_file, size, index_type, storage_mode, queries,
+                                             args, base_config, model, work_dir))
+                    except Exception as e:
+                        print(f"基准测试失败 {size}/{index_type}/{storage_mode}: {str(e)}")
+    print_report(rows, args.top_k)
+
+    output = args.output
+    if output is None:
+        output = PROJECT_ROOT / 'benchmark_results' / f"retrieval-{(commit or 'unknown')[:12]}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "commit": commit,
+        "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "faiss": getattr(faiss, "__version__", None),
+        "encoder": model.model_id if model is not None else "text2vec-base-chinese",
+        "args": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "results": rows,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {output}")
+
+
+if __name__ == "__main__":
+    main()
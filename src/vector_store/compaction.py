@@ -0,0 +1,153 @@
+"""
+反馈语料压缩模块 - 合并近似重复的查询/SQL对，缩小索引并减少提示词中的重复示例
+
+用法:
+    python -m src.vector_store.compaction                 # 只输出报告
+    python -m src.vector_store.compaction --apply         # 写回压缩后的反馈文件并重建索引
+    python -m src.vector_store.compaction --threshold 8.0 --top-k 5
+"""
+from typing import Dict, List, Tuple
+import argparse
+import json
+import shutil
+import numpy as np
+import faiss
+from .feedback_store import FeedbackVectorStore
+from ..utils.text import normalize_sql
+
+
+def _rank_key(record: Dict) -> Tuple:
+    """代表记录的优先级：评分高优先，评分相同取最新"""
+    return (record.get('rating') or 0, record.get('timestamp') or '')
+
+
+def cluster_records(record_ids: List[int], records: Dict[int, Dict], vectors: np.ndarray,
+                    threshold: float) -> List[List[int]]:
+    """
+    将近似重复的记录聚类
+
+    两条记录规范化后的SQL相同，且查询向量的L2距离不超过 threshold 时归为一类。
+    每类的第一条记录是代表记录。
+    """
+    vector_by_id = dict(zip(record_ids, vectors))
+    groups: Dict[str, List[int]] = {}
+    for record_id in record_ids:
+        groups.setdefault(normalize_sql(records[record_id].get('sql')), []).append(record_id)
+
+    clusters = []
+    for ids in groups.values():
+        # 按优先级排序后贪心聚类，保证代表记录是类内最优的一条
+        ids = sorted(ids, key=lambda i: _rank_key(records[i]), reverse=True)
+        group_clusters: List[List[int]] = []
+        for record_id in ids:
+            for cluster in group_clusters:
+                distance = float(np.linalg.norm(vector_by_id[record_id] - vector_by_id[cluster[0]]))
+                if distance <= threshold:
+                    cluster.append(record_id)
+                    break
+            else:
+                group_clusters.append([record_id])
+        clusters.extend(group_clusters)
+    return clusters
+
+
+def _prompt_chars(index: faiss.Index, id_map: np.ndarray, records: Dict[int, Dict],
+                  probes: np.ndarray, top_k: int) -> float:
+    """按 generate_sql 的示例格式计算每次检索拼出的示例文本平均长度"""
+    _, indices = index.search(probes, min(top_k, index.ntotal))
+    total = 0
+    for row in indices:
+        examples = [records[int(id_map[i])] for i in row if i >= 0]
+        total += len("\n\n".join(f"User Query: {e['query']}\nSQL: {e['sql']}" for e in examples))
+    return total / len(probes)
+
+
+def _flat_index(vectors: np.ndarray) -> faiss.Index:
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+
+def compact(store: FeedbackVectorStore, threshold: float, top_k: int = 5) -> Dict:
+    """
+    计算压缩方案并生成报告
+
+    Returns:
+        包含保留记录ID和压缩前后对比数据的报告
+    """
+    record_ids = sorted(store.records)
+    vectors = store.get_vectors(record_ids)
+    clusters = cluster_records(record_ids, store.records, vectors, threshold)
+    kept_ids = sorted(cluster[0] for cluster in clusters)
+    position = {record_id: pos for pos, record_id in enumerate(record_ids)}
+    kept_vectors = vectors[[position[i] for i in kept_ids]]
+
+    before_index = _flat_index(vectors)
+    after_index = _flat_index(kept_vectors)
+    # 以语料中的全部查询作为探测查询，评估检索到的示例文本长度
+    before_chars = _prompt_chars(before_index, np.array(record_ids), store.records, vectors, top_k)
+    after_chars = _prompt_chars(after_index, np.array(kept_ids), store.records, vectors, top_k)
+
+    return {
+        "kept_ids": kept_ids,
+        "merged": [cluster for cluster in clusters if len(cluster) > 1],
+        "records_before": len(record_ids),
+        "records_after": len(kept_ids),
+        "index_bytes_before": int(vectors.nbytes),
+        "index_bytes_after": int(kept_vectors.nbytes),
+        "avg_prompt_chars_before": before_chars,
+        "avg_prompt_chars_after": after_chars,
+    }
+
+
+def apply_compaction(store: FeedbackVectorStore, kept_ids: List[int]):
+    """
+    将压缩后的记录写回反馈文件（原文件备份为 .bak）并重建索引
+
+    缺少查询文本的记录无法作为示例，不会写回
+    """
+    backup_path = store.feedback_path.with_suffix('.json.bak')
+    shutil.copyfile(store.feedback_path, backup_path)
+    print(f"原反馈文件已备份到: {backup_path}")
+    compacted = [store.records[record_id] for record_id in kept_ids]
+    with open(store.feedback_path, 'w', encoding='utf-8') as f:
+        json.dump(compacted, f, ensure_ascii=False, indent=2)
+    # 向量已在缓存中，重建索引无需重新编码
+    store.initialize_store()
+
+
+def print_report(report: Dict, records: Dict[int, Dict]):
+    print("\n=== 反馈语料压缩报告 ===")
+    for cluster in report["merged"]:
+        print(f"保留: {records[cluster[0]]['query']}")
+        for record_id in cluster[1:]:
+            print(f"  合并: {records[record_id]['query']}")
+    before, after = report["records_before"], report["records_after"]
+    print(f"记录数: {before} -> {after} (减少 {before - after} 条)")
+    print(f"向量占用: {report['index_bytes_before']} -> {report['index_bytes_after']} 字节")
+    chars_before, chars_after = report["avg_prompt_chars_before"], report["avg_prompt_chars_after"]
+    saved = (1 - chars_after / chars_before) * 100 if chars_before else 0.0
+    print(f"平均示例提示词长度: {chars_before:.0f} -> {chars_after:.0f} 字符 (减少 {saved:.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并近似重复的反馈记录")
+    parser.add_argument("--threshold", type=float, default=None, help="查询向量L2距离阈值")
+    parser.add_argument("--top-k", type=int, default=5, help="评估提示词长度时检索的示例数")
+    parser.add_argument("--apply", action="store_true", help="写回压缩结果并重建索引")
+    args = parser.parse_args()
+
+    store = FeedbackVectorStore()
+    threshold = args.threshold if args.threshold is not None else store.config["compaction_distance"]
+    if not store.records:
+        print("反馈语料为空，无需压缩")
+        return
+    report = compact(store, threshold, args.top_k)
+    print_report(report, store.records)
+    if args.apply:
+        apply_compaction(store, report["kept_ids"])
+        store.save_index()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+向量编码批处理模块 - 将短时间内并发到达的查询合并为一次模型调用
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Executor
+import asyncio
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    查询编码微批处理器
+
+    第一个查询到达后最多等待 max_wait_ms 毫秒收集后续查询，凑满 max_batch_size 条立即编码，
+    编码结果按顺序分发给各个等待的协程。
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 executor: Optional[Executor] = None):
+        """
+        Args:
+            encode_fn: 批量编码函数，输入文本列表，返回向量矩阵
+            max_batch_size: 单批最大条数
+            max_wait_ms: 收集一批查询的最长等待时间（毫秒）
+            executor: 执行编码的线程池，为None时在事件循环中直接执行
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 统计信息
+        self.batch_count = 0
+        self.item_count = 0
+        self.max_observed_batch = 0
+
+    async def encode(self, text: str) -> np.ndarray:
+        """提交一条查询并等待其向量"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    def _ensure_worker(self):
+        """在当前事件循环中启动后台批处理任务"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """等待第一条查询，然后在时间窗口内继续收集直到批满"""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 窗口结束时已在队列中的查询一并处理
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            # 跳过已被取消的请求，相同文本只编码一次
+            pending = [(text, future) for text, future in batch if not future.done()]
+            if not pending:
+                continue
+            texts = list(dict.fromkeys(text for text, _ in pending))
+            try:
+                if self.executor is not None:
+                    vectors = await self._loop.run_in_executor(self.executor, self.encode_fn, texts)
+                else:
+                    vectors = self.encode_fn(texts)
+            except Exception as e:
+                print(f"批量编码失败: {str(e)}")
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batch_count += 1
+            self.item_count += len(pending)
+            self.max_observed_batch = max(self.max_observed_batch, len(pending))
+            vector_by_text = dict(zip(texts, vectors))
+            for text, future in pending:
+                if not future.done():
+                    future.set_result(vector_by_text[text])
+
+    async def close(self):
+        """停止后台批处理任务"""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+    def stats(self) -> Dict:
+        """返回批处理统计信息"""
+        return {
+            "batches": self.batch_count,
+            "items": self.item_count,
+            "avg_batch_size": self.item_count / self.batch_count if self.batch_count else 0.0,
+            "max_batch_size": self.max_observed_batch,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -0,0 +1,238 @@
+"""
+向量缓存模块 - 按查询文本内容哈希在磁盘上缓存向量，避免重启后重复编码
+"""
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class EmbeddingCache:
+    """
+    磁盘向量缓存
+
+    向量以float32行追加写入 embeddings.f32 并通过内存映射读取，
+    keys.txt 中第N行是第N个向量对应的内容哈希。模型标识或维度变化时缓存整体失效。
+    多个进程可共用同一目录：追加和重建在文件锁内进行，行号由文件内容决定，重建时替换文件而不是截断。
+    """
+
+    def __init__(self, cache_dir: Path, model_id: str, dimension: int):
+        self.cache_dir = Path(cache_dir)
+        self.model_id = model_id
+        self.dimension = dimension
+        self.vectors_path = self.cache_dir / 'embeddings.f32'
+        self.keys_path = self.cache_dir / 'keys.txt'
+        self.meta_path = self.cache_dir / 'meta.json'
+        self.lock_path = self.cache_dir / 'cache.lock'
+        self._rows: Dict[str, int] = {}
+        # 已读取的键行数、keys.txt 已读取的字节数和文件inode
+        self._row_count = 0
+        self._keys_read = 0
+        self._keys_inode: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._load()
+
+    @staticmethod
+    def content_key(model_id: str, text: str) -> str:
+        """计算文本在指定模型下的内容哈希"""
+        return hashlib.sha256(f"{model_id}\n{text}".encode('utf-8')).hexdigest()
+
+    def key(self, text: str) -> str:
+        return self.content_key(self.model_id, text)
+
+    @contextmanager
+    def _file_lock(self):
+        """多个进程共用同一缓存目录时，追加、重建和修复文件前加排他锁"""
+        with open(self.lock_path, 'a') as lock_file:
+            # Windows 没有 fcntl，不加锁；多进程部署时应使用检索服务（service_mode）
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_meta(self) -> Dict:
+        if not self.meta_path.exists():
+            return {}
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取向量缓存元数据失败: {str(e)}")
+            return {}
+
+    def _meta_matches(self, meta: Dict) -> bool:
+        return meta.get('model_id') == self.model_id and meta.get('dimension') == self.dimension
+
+    def _load(self):
+        """加载缓存，模型标识不一致时清空缓存"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with self._file_lock():
+            if not self._meta_matches(self._read_meta()):
+                print("向量缓存不存在或模型已变化，重建缓存")
+                self._reset()
+                return
+
+            keys = []
+            if self.keys_path.exists():
+                with open(self.keys_path, 'r', encoding='utf-8') as f:
+                    keys = [line.strip() for line in f if line.strip()]
+            row_bytes = 4 * self.dimension
+            vector_count = self.vectors_path.stat().st_size // row_bytes if self.vectors_path.exists() else 0
+            # 写入中断时向量和键可能不等长，只取两者都完整的部分；
+            # 其他进程映射的行数不会超过完整部分，截掉多出的向量不影响它们
+            count = min(len(keys), vector_count)
+            if vector_count > count:
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(count * row_bytes)
+            if len(keys) > count:
+                self._replace_file(self.keys_path, ''.join(f"{key}\n" for key in keys[:count]).encode('utf-8'))
+            self._sync()
+        print(f"已加载向量缓存，包含 {self._row_count} 条向量")
+
+    def _replace_file(self, path: Path, content: bytes):
+        """写入新文件后替换，已映射旧文件的进程继续读取旧内容，不会因文件变短而崩溃"""
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+
+    def _reset(self):
+        """调用方需持有文件锁"""
+        self._replace_file(self.vectors_path, b'')
+        self._replace_file(self.keys_path, b'')
+        self._replace_file(self.meta_path, json.dumps(
+            {'model_id': self.model_id, 'dimension': self.dimension}).encode('utf-8'))
+        self._rows = {}
+        self._row_count = 0
+        self._keys_read = 0
+        self._keys_inode = None
+        self._vectors = None
+
+    def _sync(self):
+        """
+        读取 keys.txt 中尚未读到的键，第N行的键对应向量文件的第N行，调用方需持有文件锁
+
+        其他进程追加的键也在这里读入；文件被其他进程重建时从头读取
+        """
+        if not self.keys_path.exists():
+            return
+        stat = self.keys_path.stat()
+        if stat.st_ino != self._keys_inode or stat.st_size < self._keys_read:
+            # 先清空旧的键，并发读取只会未命中，不会按旧行号读取新文件
+            self._rows = {}
+            self._row_count = 0
+            self._keys_read = 0
+        rows = self._rows
+        row_count, keys_read = self._row_count, self._keys_read
+        with open(self.keys_path, 'rb') as f:
+            f.seek(keys_read)
+            data = f.read()
+        # 只读取完整的行
+        data = data[:data.rfind(b'\n') + 1]
+        new_rows = {}
+        for line in data.decode('utf-8').splitlines():
+            key = line.strip()
+            if key and key not in rows and key not in new_rows:
+                new_rows[key] = row_count
+            row_count += 1
+        # 先映射更多的行，再公开新的键，并发读取不会访问未映射的行
+        self._map_vectors(row_count)
+        rows.update(new_rows)
+        self._row_count = row_count
+        self._keys_read = keys_read + len(data)
+        self._keys_inode = stat.st_ino
+
+    def _map_vectors(self, count: int):
+        if count == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype='float32', mode='r',
+                                  shape=(count, self.dimension))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._vectors[row])
+
+    def all_vectors(self) -> np.ndarray:
+        """按写入顺序返回全部缓存向量"""
+        if self._vectors is None:
+            return np.zeros((0, self.dimension), dtype='float32')
+        return np.array(self._vectors)
+
+    def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        批量读取向量
+
+        Returns:
+            (向量矩阵, 未命中的位置列表)，未命中位置的行为0
+        """
+        result = np.zeros((len(keys), self.dimension), dtype='float32')
+        missing = []
+        hit_positions = []
+        hit_rows = []
+        for pos, key in enumerate(keys):
+            row = self._rows.get(key)
+            if row is None:
+                missing.append(pos)
+            else:
+                hit_positions.append(pos)
+                hit_rows.append(row)
+        if hit_rows:
+            result[hit_positions] = self._vectors[hit_rows]
+        return result, missing
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        """追加写入新向量，已存在的键会被跳过"""
+        new_keys = []
+        new_rows = []
+        seen = set()
+        for key, vector in zip(keys, vectors):
+            if key in self._rows or key in seen:
+                continue
+            seen.add(key)
+            new_keys.append(key)
+            new_rows.append(vector)
+        if not new_keys:
+            return
+        row_bytes = 4 * self.dimension
+        with self._file_lock():
+            if not self._meta_matches(self._read_meta()):
+                print("向量缓存已被其他进程按不同模型重建，本次不写入")
+                return
+            # 读入其他进程追加的键，跳过它们已写入的向量
+            self._sync()
+            pending = [(key, vector) for key, vector in zip(new_keys, new_rows) if key not in self._rows]
+            if not pending:
+                return
+            # 行号以文件中已有的行数为准
+            vector_count = self.vectors_path.stat().st_size // row_bytes if self.vectors_path.exists() else 0
+            if vector_count < self._row_count:
+                print("向量缓存文件不完整，本次不写入")
+                return
+            if vector_count > self._row_count:
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(self._row_count * row_bytes)
+            # 先写向量再写键，保证键存在时向量一定完整
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.asarray([vector for _, vector in pending], dtype='float32').tobytes())
+            with open(self.keys_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{key}\n" for key, _ in pending))
+            self._sync()
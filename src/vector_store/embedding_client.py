@@ -0,0 +1,183 @@
+"""
+向量检索服务客户端 - 与独立的检索服务进程通信，多个API进程共享同一份模型和索引
+
+协议: 每条消息为4字节大端长度 + UTF-8 JSON，
+请求 {"id": 1, "method": "search", "params": {...}}，响应 {"id": 1, "result": ...} 或 {"id": 1, "error": "..."}。
+同一连接上可以同时发送多个请求，响应按id匹配。
+"""
+from typing import Dict, Optional, Tuple, Union
+from pathlib import Path
+import asyncio
+import itertools
+import json
+import socket
+import struct
+
+# 单条消息的长度上限
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+_HEADER = struct.Struct('>I')
+
+
+def parse_address(address: str, base_dir: Optional[Path] = None) -> Union[str, Tuple[str, int]]:
+    """
+    解析服务地址
+
+    "unix:路径" 表示Unix套接字（相对路径相对 base_dir），"主机:端口" 表示TCP地址
+    """
+    if address.startswith("unix:"):
+        path = Path(address[len("unix:"):])
+        if not path.is_absolute() and base_dir is not None:
+            path = base_dir / path
+        return str(path)
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def encode_message(message: Dict) -> bytes:
+    body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    return _HEADER.pack(len(body)) + body
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[Dict]:
+    """读取一条消息，连接关闭时返回None"""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"消息过长: {length} 字节")
+    return json.loads((await reader.readexactly(length)).decode('utf-8'))
+
+
+class ServiceError(RuntimeError):
+    """检索服务返回的错误"""
+    pass
+
+
+class EmbeddingServiceClient:
+    """
+    检索服务的异步客户端
+
+    每个事件循环维持一条长连接，并发请求在同一连接上发送，由后台任务按id分发响应。
+    连接断开或超时时抛出异常，由调用方决定是否回退到进程内检索。
+    """
+
+    def __init__(self, address: Union[str, Tuple[str, int]], timeout: float = 2.0):
+        self.address = address
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self.calls = 0
+        self.failures = 0
+
+    async def _open(self):
+        if isinstance(self.address, str):
+            return await asyncio.open_unix_connection(self.address)
+        return await asyncio.open_connection(*self.address)
+
+    async def _ensure_connection(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._connect_lock = asyncio.Lock()
+            self._writer = None
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.wait_for(self._open(), self.timeout)
+            self._reader_task = loop.create_task(self._read_loop(self._reader, self._writer))
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """分发响应，连接断开时让所有等待中的请求失败"""
+        error: Exception = ConnectionError("检索服务连接已关闭")
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                future = self._pending.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(ServiceError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        except Exception as e:
+            error = e
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    async def call(self, method: str, **params):
+        """发送请求并等待结果"""
+        self.calls += 1
+        try:
+            await self._ensure_connection()
+            request_id = next(self._ids)
+            future = self._loop.create_future()
+            self._pending[request_id] = future
+            self._writer.write(encode_message({"id": request_id, "method": method, "params": params}))
+            await self._writer.drain()
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            finally:
+                self._pending.pop(request_id, None)
+        except Exception:
+            self.failures += 1
+            raise
+
+    def call_sync(self, method: str, **params):
+        """阻塞方式发送单个请求，用于启动检查等不在事件循环中的场景"""
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            sock.sendall(encode_message({"id": 0, "method": method, "params": params}))
+            header = self._recv_exactly(sock, _HEADER.size)
+            (length,) = _HEADER.unpack(header)
+            message = json.loads(self._recv_exactly(sock, length).decode('utf-8'))
+        if "error" in message:
+            raise ServiceError(message["error"])
+        return message.get("result")
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("检索服务连接已关闭")
+            data += chunk
+        return data
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._reader_task is not None and not self._reader_task.done():
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._reader_task = None
+
+    def stats(self) -> Dict:
+        return {
+            "address": self.address if isinstance(self.address, str) else f"{self.address[0]}:{self.address[1]}",
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "calls": self.calls,
+            "failures": self.failures,
+            "in_flight": len(self._pending),
+        }
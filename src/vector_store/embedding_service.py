@@ -0,0 +1,129 @@
+"""
+向量检索服务 - 独立进程持有一份模型和索引，供同一主机上的多个API进程共享
+
+用法:
+    python -m src.vector_store.embedding_service
+    python -m src.vector_store.embedding_service --address unix:cache/embedding.sock
+    python -m src.vector_store.embedding_service --address 127.0.0.1:8765
+
+API进程在 vector_config.json 中设置 "service_mode": "client" 和相同的 "service_address" 即可使用。
+各进程的并发检索请求在服务端由同一个编码批处理器合并。
+"""
+from typing import Dict
+import argparse
+import asyncio
+import os
+import signal
+from .feedback_store import FeedbackVectorStore, load_vector_config, PROJECT_ROOT
+from .embedding_client import parse_address, encode_message, read_message
+
+
+class EmbeddingService:
+    """按方法名把请求分发给 FeedbackVectorStore"""
+
+    def __init__(self, store: FeedbackVectorStore):
+        self.store = store
+        self.connections = 0
+        self.requests = 0
+
+    async def dispatch(self, method: str, params: Dict):
+        store = self.store
+        if method == "ping":
+            return {"ready": store.is_ready, "records": len(store.records)}
+        if method == "search":
+            if params.get("with_distances"):
+                neighbors = await store.find_similar_examples_async(
+                    params["query"], params.get("top_k", 5), params.get("allowed_tables"), with_distances=True)
+                return {"records": [record for record, _ in neighbors],
+                        "distances": [distance for _, distance in neighbors]}
+            records = await store.find_similar_examples_async(
+                params["query"], params.get("top_k", 5), params.get("allowed_tables"))
+            return {"records": records}
+        if method == "add_feedback":
+            return await store.add_feedback_async(params["record"])
+        if method == "upsert_feedback":
+            return await store.executor.run(store.upsert_feedback, params["record"])
+        if method == "stats":
+            stats = store.stats()
+            stats["service"] = {"connections": self.connections, "requests": self.requests}
+            return stats
+        raise ValueError(f"未知的方法: {method}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """同一连接上的请求并发处理，响应写入时加锁避免交错"""
+        self.connections += 1
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(message: Dict):
+            self.requests += 1
+            try:
+                response = {"id": message.get("id"),
+                            "result": await self.dispatch(message.get("method"), message.get("params") or {})}
+            except Exception as e:
+                print(f"处理检索服务请求失败: {str(e)}")
+                response = {"id": message.get("id"), "error": str(e)}
+            async with write_lock:
+                writer.write(encode_message(response))
+                await writer.drain()
+
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                task = asyncio.create_task(respond(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            print(f"检索服务连接异常: {str(e)}")
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            self.connections -= 1
+            writer.close()
+
+
+async def serve(store: FeedbackVectorStore, address: str):
+    service = EmbeddingService(store)
+    target = parse_address(address, PROJECT_ROOT)
+    if isinstance(target, str):
+        # 清理上次异常退出遗留的套接字文件
+        if os.path.exists(target):
+            os.unlink(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        server = await asyncio.start_unix_server(service.handle_connection, path=target)
+    else:
+        server = await asyncio.start_server(service.handle_connection, *target)
+    print(f"向量检索服务已启动: {address}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    async with server:
+        await stop.wait()
+    await store.batcher.close()
+    store.save_index()
+    store.executor.shutdown(wait=False)
+    if isinstance(target, str) and os.path.exists(target):
+        os.unlink(target)
+    print("向量检索服务已停止")
+
+
+def main():
+    config = load_vector_config()
+    parser = argparse.ArgumentParser(description="共享向量检索服务")
+    parser.add_argument("--address", default=config["service_address"],
+                        help="监听地址，unix:路径 或 主机:端口")
+    args = parser.parse_args()
+    # 服务进程自身始终在进程内加载模型和索引
+    store = FeedbackVectorStore(dict(config, service_mode="local"))
+    asyncio.run(serve(store, args.address))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,754 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, Iterable, Set, FrozenSet
 import json
 from pathlib import Path
 import os
+import hashlib
+import threading
+import time
+import sentence_transformers
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
+from .embedding_cache import EmbeddingCache
+from .embedding_batcher import EmbeddingBatcher
+from .query_cache import QueryCache
+from .payload_store import PayloadStore
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .embedding_client import EmbeddingServiceClient, parse_address
+from .index_factory import (build_index, resolve_index_type, configure_search, describe_index,
+                            supports_remove, index_memory_bytes, filtered_search)
+from ..utils.bounded_executor import BoundedExecutor
+from ..utils.text import normalize_query
+from ..validator.sql_validator import SQLValidator
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+# 向量数据库配置文件路径
+VECTOR_CONFIG_FILE = PROJECT_ROOT / 'config' / 'vector_config.json'
+# 反馈数据文件路径
+FEEDBACK_FILE = PROJECT_ROOT / 'feedback' / 'feedback_data.json'
+
+# 默认向量数据库配置
+default_vector_config = {
+    "cache_enabled": True,
+    "cache_dir": "cache/vector_store",
+    # 索引类型: auto/flat/ivf_flat/ivf_pq/hnsw，auto 在记录数达到阈值后切换为近似索引
+    "index_type": "auto",
+    "auto_threshold": 50000,
+    "auto_index_type": "hnsw",
+    # IVF参数，nlist为0时按记录数自动计算
+    "nlist": 0,
+    "nprobe": 16,
+    "pq_m": 16,
+    "pq_nbits": 8,
+    # HNSW参数
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    # 向量存储方式: float32/fp16/sq8/pq，量化后索引内存约为float32的 1/2、1/4、m/(4*维度)
+    "storage_mode": "float32",
+    # 记录存储方式: memory 保存在内存字典中，mmap 写入磁盘侧文件按需读取
+    "payload_storage": "memory",
+    # 查询编码微批处理：收集窗口（毫秒）和单批上限
+    "batch_window_ms": 5,
+    "batch_max_size": 32,
+    # 检索线程池：编码和FAISS查询在线程池中执行，不阻塞事件循环
+    "retrieval_workers": 2,
+    "retrieval_queue_size": 64,
+    # 查询缓存：规范化查询文本 -> 向量和近邻记录ID
+    "query_cache_size": 1024,
+    "query_cache_ttl": 3600,
+    # 语料压缩：SQL等价且查询向量L2距离不超过该值的记录视为重复
+    "compaction_distance": 6.0,
+    # 混合检索：查询与已有查询只差空白/标点时直接用该记录的向量检索，不调用模型；
+    # 否则向量检索与BM25词法检索的结果按倒数排名融合
+    "lexical_enabled": True,
+    "hybrid_rrf_k": 60,
+    # 编码后端: torch 使用sentence-transformers原模型，onnx/onnx_int8 导出ONNX（及int8动态量化）后用onnxruntime推理
+    "embedding_backend": "torch",
+    "onnx_intra_op_threads": 0,
+    # ONNX编码结果与原模型的最小余弦相似度，低于该值时不启用
+    "onnx_min_cosine": 0.99,
+    # 服务模式: local 在本进程加载模型和索引，client 使用独立的检索服务进程（python -m src.vector_store.embedding_service），
+    # 服务不可用时回退到进程内检索，service_retry_seconds 秒后再尝试服务
+    "service_mode": "local",
+    "service_address": "unix:cache/embedding.sock",
+    "service_timeout": 2.0,
+    "service_retry_seconds": 30
+}
+
+def load_vector_config() -> Dict:
+    """加载向量数据库配置，缺失的配置项使用默认值"""
+    config = default_vector_config.copy()
+    try:
+        if VECTOR_CONFIG_FILE.exists():
+            with open(VECTOR_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+            print(f"已从 {VECTOR_CONFIG_FILE} 加载向量数据库配置")
+    except Exception as e:
+        print(f"加载向量数据库配置失败: {str(e)}")
+    return config
 
 class FeedbackVectorStore:
-    def __init__(self):
-        print("正在加载本地模型...")
-        model_path = Path(__file__).parent.parent / 'models' / 'text2vec-base-chinese'
+    def __init__(self, config: Optional[Dict] = None, lazy: bool = False,
+                 feedback_path: Optional[Path] = None, model=None):
+        """
+        Args:
+            config: 向量数据库配置，为None时从配置文件加载
+            lazy: 为True时不在构造时加载模型，需调用 load() 或 start_background_load()
+            feedback_path: 反馈数据文件，为None时使用默认路径
+            model: 已加载的编码模型（需提供 encode 和 get_sentence_embedding_dimension），
+                为None时加载本地 text2vec-base-chinese，基准测试等场景可传入替代模型
+        """
+        self.config = config or load_vector_config()
+        self.feedback_path = Path(feedback_path) if feedback_path else FEEDBACK_FILE
+        self.model_path = Path(__file__).parent.parent / 'models' / 'text2vec-base-chinese'
+        self.model = model
+        # ONNX编码器，embedding_backend 为 onnx/onnx_int8 且校验通过时使用
+        self.onnx_encoder = None
+        self.dimension = None
+        self.model_id = None
+        self.embedding_cache = None
+        self.index_path = None
+        # 各子系统的加载状态: pending/loading/ready/failed
+        self.status = {"embedding_model": "pending", "index": "pending"}
+        self.load_error = None
+        self._load_thread = None
+        self.index = None
+        self.index_type = None
+        # 记录ID -> 反馈记录，ID与FAISS索引中的ID一一对应
+        self.records: Dict[int, Dict] = {}
+        # 查询文本 -> 记录ID，用于upsert时定位已有记录
+        self._query_ids: Dict[str, int] = {}
+        # 记录ID -> 查询文本内容哈希，用于校验磁盘索引是否与当前记录一致
+        self._keys: Dict[int, str] = {}
+        # 按示例SQL涉及的表分组的记录ID，用于按用户表权限过滤示例
+        self._ids_by_tables: Dict[FrozenSet[str], Set[int]] = {}
+        self._tables_by_id: Dict[int, FrozenSet[str]] = {}
+        self._allowed_ids_cache: Dict[Tuple[FrozenSet[str], int], np.ndarray] = {}
+        self._sql_validator = SQLValidator()
+        # 查询文本的字符n-gram倒排索引
+        self.lexical = LexicalIndex()
+        self.retrieval_counts = {"exact": 0, "hybrid": 0, "vector": 0}
+        self._next_id = 0
+        # 加载完成前收到的新增反馈
+        self._pending_records: List[Dict] = []
+        # 保护索引和记录的并发修改，检索在线程池中执行
+        self._lock = threading.RLock()
+        self.executor = BoundedExecutor(
+            "retrieval",
+            max_workers=self.config["retrieval_workers"],
+            max_queue=self.config["retrieval_queue_size"]
+        )
+        # 索引版本号，索引每次变化时递增，用于使查询缓存中的近邻结果失效
+        self._index_version = 0
+        self.query_cache = QueryCache(
+            max_size=self.config["query_cache_size"],
+            ttl_seconds=self.config["query_cache_ttl"]
+        )
+        # 并发查询的编码请求合并为批量调用
+        self.batcher = EmbeddingBatcher(
+            self._encode,
+            max_batch_size=self.config["batch_max_size"],
+            max_wait_ms=self.config["batch_window_ms"],
+            executor=self.executor
+        )
+        # 客户端模式下的检索服务连接
+        self.client = None
+        self._remote_retry_at = 0.0
+        if self.config.get("service_mode") == "client":
+            self.client = EmbeddingServiceClient(
+                parse_address(self.config["service_address"], PROJECT_ROOT),
+                timeout=self.config["service_timeout"]
+            )
+        if not lazy:
+            self.load()
+
+    @property
+    def is_ready(self) -> bool:
+        return self.status["index"] == "ready"
+
+    def load(self):
+        """加载模型并初始化索引"""
+        self.status["embedding_model"] = "loading"
+        if self.model is None:
+            print("正在加载本地模型...")
+            try:
+                self.model = SentenceTransformer(str(self.model_path))
+                print("成功加载本地模型")
+            except Exception as e:
+                print(f"模型加载失败: {str(e)}")
+                self.status["embedding_model"] = "failed"
+                self.load_error = str(e)
+                raise
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        # 模型标识参与向量缓存的键计算，模型变化时缓存自动失效
+        self.model_id = getattr(self.model, "model_id", None) or \
+            f"{self.model_path.name}:{self.dimension}:st-{sentence_transformers.__version__}"
+        if self.config.get("embedding_backend", "torch") in ("onnx", "onnx_int8"):
+            self._load_onnx_encoder()
+        self.status["embedding_model"] = "ready"
+        if self.config.get("cache_enabled"):
+            cache_dir = PROJECT_ROOT / self.config["cache_dir"]
+            try:
+                self.embedding_cache = EmbeddingCache(cache_dir, self.model_id, self.dimension)
+                self.index_path = cache_dir / 'index.faiss'
+            except Exception as e:
+                print(f"向量缓存初始化失败，将不使用缓存: {str(e)}")
+
+        self.status["index"] = "loading"
+        # 持锁完成初始化和就绪切换，期间到达的新增请求会排队或等待
+        with self._lock:
+            try:
+                self.initialize_store()
+            except Exception as e:
+                print(f"向量数据库初始化失败: {str(e)}")
+                self.status["index"] = "failed"
+                self.load_error = str(e)
+                raise
+            # 补齐加载期间收到的反馈，已在反馈文件中读到的记录会被跳过
+            pending, self._pending_records = self._pending_records, []
+            for record in pending:
+                self._add_record(record)
+            self.status["index"] = "ready"
+
+    def _load_onnx_encoder(self):
+        """加载ONNX编码器，失败或与原模型向量不一致时继续使用原模型"""
+        backend = self.config["embedding_backend"]
         try:
-            self.model = SentenceTransformer(str(model_path))
-            print("成功加载本地模型")
+            from .onnx_encoder import load_onnx_encoder
+            cache_dir = PROJECT_ROOT / self.config["cache_dir"] / 'onnx'
+            self.onnx_encoder = load_onnx_encoder(self.model, cache_dir, self.model_id, self.config,
+                                                  self._sample_queries())
         except Exception as e:
-            print(f"模型加载失败: {str(e)}")
-            raise
-        self.index = None
-        self.feedback_data = []
-        self.initialize_store()
+            print(f"ONNX编码器加载失败，使用原模型: {str(e)}")
+            self.onnx_encoder = None
+        if self.onnx_encoder is not None:
+            # 不同后端的向量略有差异，分别缓存
+            self.model_id = f"{self.model_id}:{backend}"
+
+    def _sample_queries(self, limit: int = 64) -> List[str]:
+        """取反馈文件中的查询作为后端一致性校验样本"""
+        samples = []
+        try:
+            if self.feedback_path.exists():
+                with open(self.feedback_path, 'r', encoding='utf-8') as f:
+                    samples = [item['query'] for item in json.load(f) if item.get('query')][:limit]
+        except Exception as e:
+            print(f"读取校验样本失败: {str(e)}")
+        return samples or ["查询2018年1月的AQI平均值", "列出所有的监测站点"]
+
+    def start_background_load(self):
+        """
+        在后台线程中加载模型和索引，加载完成前检索返回空结果
+
+        客户端模式下先检查检索服务，服务可用时不在本进程加载
+        """
+        if self.client is None:
+            self._start_local_load()
+            return
+        def check_service():
+            try:
+                result = self.client.call_sync("ping")
+                print(f"已连接向量检索服务，服务端记录数: {result.get('records')}")
+            except Exception as e:
+                self._remote_failed(e)
+        threading.Thread(target=check_service, name="vector-service-check", daemon=True).start()
+
+    def _use_remote(self) -> bool:
+        return self.client is not None and time.monotonic() >= self._remote_retry_at
+
+    def _remote_failed(self, error: Exception):
+        """检索服务不可用时回退到进程内检索，一段时间后再尝试服务"""
+        print(f"向量检索服务不可用，改用进程内检索: {str(error) or type(error).__name__}")
+        self._remote_retry_at = time.monotonic() + self.config.get("service_retry_seconds", 30)
+        self._start_local_load()
+
+    def _start_local_load(self):
+        if self._load_thread is not None or self.is_ready:
+            return
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"后台加载向量数据库失败: {str(e)}")
+        self._load_thread = threading.Thread(target=run, name="vector-store-loader", daemon=True)
+        self._load_thread.start()
+        print("已在后台开始加载向量数据库")
 
     def initialize_store(self):
         print("初始化向量数据库...")
-        feedback_path = Path(__file__).parent.parent.parent / 'feedback' / 'feedback_data.json'
-        
-        with open(feedback_path, 'r', encoding='utf-8') as f:
-            self.feedback_data = json.load(f)
-        
-        # 生成查询的向量表示
-        queries = [item['query'] for item in self.feedback_data]
-        embeddings = self.model.encode(queries)
-        
-        # 初始化 FAISS 索引
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(np.array(embeddings).astype('float32'))
-        print(f"向量数据库初始化完成，包含 {len(self.feedback_data)} 条记录")
-
-    def find_similar_examples(self, query: str, top_k: int = 5) -> List[Dict]:
-        query_vector = self.model.encode([query])
-        distances, indices = self.index.search(np.array(query_vector).astype('float32'), top_k)
+        feedback_data = []
+        if self.feedback_path.exists():
+            with open(self.feedback_path, 'r', encoding='utf-8') as f:
+                feedback_data = json.load(f)
+
+        with self._lock:
+            # 记录ID取其在反馈文件中的位置，跳过缺少查询文本的记录
+            valid_items = [(i, item) for i, item in enumerate(feedback_data) if item.get('query')]
+            if self.config.get("payload_storage") == "mmap":
+                if not isinstance(self.records, PayloadStore):
+                    self.records = PayloadStore(PROJECT_ROOT / self.config["cache_dir"])
+                self.records.reset(valid_items)
+            else:
+                self.records = dict(valid_items)
+            self._query_ids = {item['query']: i for i, item in valid_items}
+            self._keys = {i: EmbeddingCache.content_key(self.model_id, item['query'])
+                          for i, item in valid_items}
+            self._ids_by_tables = {}
+            self._tables_by_id = {}
+            for i, item in valid_items:
+                self._tag_record(i, item)
+            self.lexical.reset((i, item['query']) for i, item in valid_items)
+            self._next_id = len(feedback_data)
+            del feedback_data, valid_items
+
+            # 磁盘上的索引与当前记录完全一致时直接加载，无需读取或编码向量
+            self.index_type = resolve_index_type(self.config, len(self.records))
+            self.index = self._load_index()
+            self._index_version += 1
+            if self.index is None:
+                self._rebuild_index()
+                self.save_index()
+        print(f"向量数据库初始化完成，包含 {len(self.records)} 条记录，索引类型: {describe_index(self.index)}")
+
+    def _rebuild_index(self):
+        """按当前记录和配置重建索引，向量优先从缓存读取"""
+        self.index_type = resolve_index_type(self.config, len(self.records))
+        ids = np.array(list(self.records), dtype='int64')
+        embeddings = np.zeros((0, self.dimension), dtype='float32')
+        if self.records:
+            # 生成查询的向量表示，已缓存的向量直接读取
+            embeddings = self.get_vectors(list(ids))
+        self.index = build_index(self.index_type, self.dimension, self.config, embeddings)
+        if len(ids):
+            self.index.add_with_ids(embeddings, ids)
+        self._index_version += 1
+        print(f"索引构建完成: {describe_index(self.index)}")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """将文本编码为float32向量矩阵"""
+        if self.onnx_encoder is not None:
+            return self.onnx_encoder.encode(texts)
+        return np.array(self.model.encode(texts)).astype('float32')
+
+    def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        """编码文本，优先从磁盘缓存读取，只对未命中的文本调用模型"""
+        if self.embedding_cache is None:
+            return self._encode(texts)
+        keys = [self.embedding_cache.key(text) for text in texts]
+        embeddings, missing = self.embedding_cache.get_many(keys)
+        print(f"向量缓存命中 {len(texts) - len(missing)} 条，需编码 {len(missing)} 条")
+        if missing:
+            new_embeddings = self._encode([texts[pos] for pos in missing])
+            embeddings[missing] = new_embeddings
+            try:
+                self.embedding_cache.put_many([keys[pos] for pos in missing], new_embeddings)
+            except Exception as e:
+                print(f"写入向量缓存失败: {str(e)}")
+        return embeddings
+
+    def get_vectors(self, record_ids: List[int]) -> np.ndarray:
+        """获取指定记录的查询向量，优先按内容哈希从磁盘缓存读取，只对未命中的记录读取查询文本"""
+        if self.embedding_cache is None:
+            return self._encode([self.records[record_id]['query'] for record_id in record_ids])
+        embeddings, missing = self.embedding_cache.get_many([self._keys[record_id] for record_id in record_ids])
+        if missing:
+            embeddings[missing] = self._encode_cached([self.records[record_ids[pos]]['query'] for pos in missing])
+        return embeddings
+
+    def _index_signature(self) -> str:
+        """根据记录ID和内容哈希计算索引签名"""
+        digest = hashlib.sha256(self.model_id.encode('utf-8'))
+        for record_id in sorted(self._keys):
+            digest.update(f"{record_id}:{self._keys[record_id]}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load_index(self):
+        """加载磁盘上的FAISS索引，签名不一致或索引文件与元数据不配套时返回None"""
+        if self.index_path is None or not self.index_path.exists():
+            return None
+        meta_path = self.index_path.with_suffix('.json')
+        try:
+            # 与保存时使用同一把文件锁，不会读到其他进程写了一半的索引和元数据
+            with self.embedding_cache._file_lock():
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                data = self.index_path.read_bytes()
+            if meta.get('signature') != self._index_signature():
+                print("磁盘索引与反馈数据不一致，重新构建索引")
+                return None
+            if meta.get('index_type') != self.index_type or meta.get('storage_mode') != self.config.get("storage_mode"):
+                print("索引类型配置已变化，重新构建索引")
+                return None
+            if meta.get('index_sha256') != hashlib.sha256(data).hexdigest():
+                print("磁盘索引文件与元数据不配套，重新构建索引")
+                return None
+            index = faiss.deserialize_index(np.frombuffer(data, dtype='uint8'))
+            if index.ntotal != meta.get('ntotal'):
+                print("磁盘索引条数与元数据不一致，重新构建索引")
+                return None
+            configure_search(index, self.config)
+            print(f"已从 {self.index_path} 加载FAISS索引")
+            return index
+        except Exception as e:
+            print(f"加载FAISS索引失败: {str(e)}")
+            return None
+
+    def save_index(self):
+        """
+        将当前索引及其签名写入磁盘，供下次启动直接加载
+
+        多个工作进程关闭时都会保存：先写临时文件再替换，元数据最后替换并记录索引文件的哈希，
+        加载时哈希不符即视为不配套；整个替换过程持有向量缓存的文件锁
+        """
+        if self.index_path is None or self.index is None:
+            return
+        try:
+            with self._lock:
+                data = faiss.serialize_index(self.index).tobytes()
+                meta = {'signature': self._index_signature(), 'index_type': self.index_type,
+                        'storage_mode': self.config.get("storage_mode"), 'count': len(self.records),
+                        'ntotal': int(self.index.ntotal), 'index_sha256': hashlib.sha256(data).hexdigest()}
+            meta_path = self.index_path.with_suffix('.json')
+            with self.embedding_cache._file_lock():
+                self.embedding_cache._replace_file(self.index_path, data)
+                self.embedding_cache._replace_file(meta_path, json.dumps(meta).encode('utf-8'))
+            print(f"FAISS索引已保存到: {self.index_path}")
+        except Exception as e:
+            print(f"保存FAISS索引失败: {str(e)}")
+
+    def add_feedback(self, record: Dict) -> Optional[int]:
+        """
+        新增一条反馈记录，只对该记录编码一次并插入索引
+
+        Returns:
+            新记录的ID，记录缺少查询文本或索引尚未加载完成时返回None
+        """
+        with self._lock:
+            if not self.is_ready:
+                # 加载完成后补齐
+                self._pending_records.append(record)
+                return None
+        # 释放锁后再编码，编码期间并发检索不需要等待
+        return self._add_record(record)
+
+    def _add_record(self, record: Dict) -> Optional[int]:
+        # 编码在锁外进行，避免阻塞并发检索；调用方不应持有 self._lock（加载阶段补齐记录时除外）
+        embedding = self._encode_cached([record['query']]) if record.get('query') else None
+        with self._lock:
+            # 完全相同的记录已在索引中（例如加载时已从反馈文件读到），不重复添加
+            existing_id = self._query_ids.get(record.get('query'))
+            if existing_id is not None and self.records.get(existing_id) == record:
+                return existing_id
+            # 与反馈文件追加顺序保持一致，即使记录无效也占用一个ID
+            record_id = self._next_id
+            self._next_id += 1
+            if embedding is None:
+                return None
+            self.records[record_id] = record
+            self._query_ids[record['query']] = record_id
+            self._keys[record_id] = EmbeddingCache.content_key(self.model_id, record['query'])
+            self._tag_record(record_id, record)
+            self.lexical.add(record_id, record['query'])
+            if resolve_index_type(self.config, len(self.records)) != self.index_type:
+                # 记录数跨过阈值，切换索引类型
+                print("记录数达到索引切换阈值，重建索引")
+                self._rebuild_index()
+            else:
+                self.index.add_with_ids(embedding, np.array([record_id], dtype='int64'))
+                self._index_version += 1
+        print(f"向量数据库新增记录 {record_id}: {record['query']}")
+        return record_id
+
+    async def add_feedback_async(self, record: Dict) -> Optional[int]:
+        """在检索线程池中新增反馈记录，避免编码阻塞事件循环；客户端模式下由检索服务新增"""
+        if self._use_remote():
+            try:
+                return await self.client.call("add_feedback", record=record)
+            except Exception as e:
+                self._remote_failed(e)
+        return await self.executor.run(self.add_feedback, record)
+
+    def remove_feedback(self, record_id: int) -> bool:
+        """从索引中删除指定ID的记录，返回是否删除成功"""
+        with self._lock:
+            if record_id not in self.records:
+                return False
+            record = self.records.pop(record_id)
+            del self._keys[record_id]
+            self._untag_record(record_id)
+            self.lexical.remove(record_id)
+            if self._query_ids.get(record['query']) == record_id:
+                del self._query_ids[record['query']]
+            if supports_remove(self.index):
+                self.index.remove_ids(np.array([record_id], dtype='int64'))
+                self._index_version += 1
+            else:
+                self._rebuild_index()
+        print(f"向量数据库删除记录 {record_id}")
+        return True
+
+    def find_record_id(self, query: str) -> Optional[int]:
+        """按查询文本查找记录ID，存在多条时返回最新的一条"""
+        return self._query_ids.get(query)
+
+    def upsert_feedback(self, record: Dict) -> Optional[int]:
+        """
+        按查询文本新增或替换反馈记录
+
+        查询文本相同且只有SQL/评分变化时不重新编码，直接替换记录内容
+        """
+        with self._lock:
+            record_id = self.find_record_id(record.get('query'))
+            if record_id is not None:
+                self.records[record_id] = record
+                self._untag_record(record_id)
+                self._tag_record(record_id, record)
+                self._index_version += 1
+        if record_id is None:
+            return self.add_feedback(record)
+        print(f"向量数据库更新记录 {record_id}: {record['query']}")
+        return record_id
+
+    def _tag_record(self, record_id: int, record: Dict):
+        """记录示例SQL涉及的表"""
+        try:
+            tables = frozenset(self._sql_validator._extract_tables(record.get('sql') or ''))
+        except Exception as e:
+            print(f"提取示例 {record_id} 的表名失败: {str(e)}")
+            tables = frozenset()
+        self._tables_by_id[record_id] = tables
+        self._ids_by_tables.setdefault(tables, set()).add(record_id)
+        self._allowed_ids_cache.clear()
+
+    def _untag_record(self, record_id: int):
+        tables = self._tables_by_id.pop(record_id, None)
+        if tables is None:
+            return
+        ids = self._ids_by_tables.get(tables)
+        if ids is not None:
+            ids.discard(record_id)
+            if not ids:
+                del self._ids_by_tables[tables]
+        self._allowed_ids_cache.clear()
+
+    def _allowed_ids(self, allowed_tables: FrozenSet[str]) -> np.ndarray:
+        """SQL涉及的表全部在 allowed_tables 内的记录ID"""
+        cache_key = (allowed_tables, self._index_version)
+        cached = self._allowed_ids_cache.get(cache_key)
+        if cached is None:
+            ids = [record_id for tables, group in self._ids_by_tables.items()
+                   if tables <= allowed_tables for record_id in group]
+            cached = np.array(sorted(ids), dtype='int64')
+            if len(self._allowed_ids_cache) >= 64:
+                self._allowed_ids_cache.clear()
+            self._allowed_ids_cache[cache_key] = cached
+        return cached
+
+    def find_similar_examples(self, query: str, top_k: int = 5,
+                              allowed_tables: Optional[Iterable[str]] = None) -> List[Dict]:
+        if not self.is_ready or not self.records:
+            return []
+        key = normalize_query(query)
+        allowed = frozenset(allowed_tables) if allowed_tables is not None else None
+        neighbors, lexical_hits = self._lexical_search(key, top_k, allowed)
+        if neighbors is None:
+            # 规范化文本只用作查找的键，编码原始问题，与示例向量的编码方式一致
+            neighbors = self._hybrid_search(self._encode([query]), top_k, allowed, lexical_hits)
+        return self._to_records(neighbors)
+
+    async def find_similar_examples_async(self, query: str, top_k: int = 5,
+                                          allowed_tables: Optional[Iterable[str]] = None,
+                                          with_distances: bool = False) -> List:
+        """
+        异步检索相似示例
+
+        先查查询缓存：近邻结果命中时完全跳过模型和索引。
+        再查词法索引：与已有查询只差空白/标点时，直接用该记录已缓存的向量检索，不调用模型。
+        其余查询优先使用缓存的查询向量，未缓存时编码与并发请求合并批处理，向量检索结果与BM25结果融合。
+        编码和检索都在检索线程池中执行，不阻塞事件循环。模型和索引尚未加载完成时返回空列表
+
+        Args:
+            allowed_tables: 用户有权限访问的表，只返回SQL涉及的表全部在其中的示例；为None时不过滤
+            with_distances: 为True时返回 (示例, 向量距离) 列表
+        """
+        if self._use_remote():
+            try:
+                result = await self.client.call(
+                    "search", query=query, top_k=top_k,
+                    allowed_tables=sorted(allowed_tables) if allowed_tables is not None else None,
+                    with_distances=with_distances)
+                if with_distances:
+                    return list(zip(result["records"], result["distances"]))
+                return result["records"]
+            except Exception as e:
+                self._remote_failed(e)
+        if not self.is_ready or not self.records:
+            return []
+        key = normalize_query(query)
+        allowed = frozenset(allowed_tables) if allowed_tables is not None else None
+        version = self._index_version
+        variant = (top_k, allowed)
+        neighbors = self.query_cache.get_neighbors(key, variant, version)
+        if neighbors is None:
+            # 向量缓存命中与否都走同样的词法检索和融合，同一问题每次得到相同的结果
+            neighbors, lexical_hits = await self.executor.run(self._lexical_search, key, top_k, allowed)
+            if neighbors is None:
+                query_vector = self.query_cache.get_embedding(key)
+                if query_vector is None:
+                    # 规范化文本只用作缓存和精确匹配的键，编码原始问题，与示例向量的编码方式一致
+                    query_vector = np.asarray(await self.batcher.encode(query), dtype='float32').reshape(1, -1)
+                    self.query_cache.put_embedding(key, query_vector)
+                neighbors = await self.executor.run(self._hybrid_search, query_vector, top_k, allowed, lexical_hits)
+            self.query_cache.put_neighbors(key, variant, version, neighbors)
+        return self._to_records(neighbors, with_distances)
+
+    def _lexical_search(self, key: str, top_k: int, allowed_tables: Optional[FrozenSet[str]] = None
+                        ) -> Tuple[Optional[List[Tuple[int, float]]], List[Tuple[int, float]]]:
+        """
+        词法检索
+
+        Returns:
+            (近邻结果, BM25结果)。词法键与已有查询相同（只差空白/标点）时视为同一问题，近邻结果以该记录的向量检索得到，
+            该记录排在首位、距离记为0；否则近邻结果为None，需编码查询后做混合检索，得到真实的向量距离。
+            只是高度相似的查询不走这条路径，否则返回的距离是相对相似记录而不是查询本身的
+        """
+        if not self.config.get("lexical_enabled", True):
+            return None, []
+        with self._lock:
+            accept = None
+            if allowed_tables is not None:
+                accept = lambda record_id: self._tables_by_id.get(record_id, frozenset()) <= allowed_tables
+            lexical_hits = self.lexical.search(key, top_k * 2, accept)
+            exact = [record_id for record_id in self.lexical.exact_ids(key) if accept is None or accept(record_id)]
+            anchor_id = max(exact) if exact else None
+            anchor_vector = self._cached_vector(anchor_id) if anchor_id is not None else None
+            if anchor_vector is None:
+                return None, lexical_hits
+            neighbors = self._search(anchor_vector, top_k, allowed_tables)
+            self.retrieval_counts["exact"] += 1
+        neighbors = [(anchor_id, 0.0)] + [item for item in neighbors if item[0] != anchor_id]
+        return neighbors[:top_k], lexical_hits
+
+    def _cached_vector(self, record_id: int) -> Optional[np.ndarray]:
+        """从磁盘缓存读取记录的查询向量，未缓存时返回None"""
+        if self.embedding_cache is None or record_id not in self._keys:
+            return None
+        embeddings, missing = self.embedding_cache.get_many([self._keys[record_id]])
+        return None if missing else embeddings
+
+    def _hybrid_search(self, query_vector: np.ndarray, top_k: int, allowed_tables: Optional[FrozenSet[str]],
+                       lexical_hits: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        """向量检索结果与BM25结果按倒数排名融合，返回 (记录ID, 向量距离) 列表"""
+        if not lexical_hits:
+            self.retrieval_counts["vector"] += 1
+            return self._search(query_vector, top_k, allowed_tables)
+        vector_hits = self._search(query_vector, top_k * 2, allowed_tables)
+        fused = reciprocal_rank_fusion([[record_id for record_id, _ in vector_hits],
+                                        [record_id for record_id, _ in lexical_hits]],
+                                       self.config.get("hybrid_rrf_k", 60))[:top_k]
+        distances = dict(vector_hits)
+        with self._lock:
+            # 只由词法检索召回的记录补算向量距离
+            missing = [record_id for record_id, _ in fused
+                       if record_id not in distances and record_id in self._keys]
+            if missing:
+                vectors = self.get_vectors(missing)
+                for record_id, dist in zip(missing, ((vectors - query_vector) ** 2).sum(axis=1)):
+                    distances[record_id] = float(dist)
+            self.retrieval_counts["hybrid"] += 1
+        return [(record_id, distances[record_id]) for record_id, _ in fused if record_id in distances]
+
+    def _search(self, query_vector: np.ndarray, top_k: int,
+                allowed_tables: Optional[FrozenSet[str]] = None) -> List[Tuple[int, float]]:
+        """按查询向量检索最相近的记录，返回 (记录ID, 距离) 列表"""
+        with self._lock:
+            if not self.records:
+                return []
+            if allowed_tables is None:
+                distances, indices = self.index.search(query_vector, min(top_k, len(self.records)))
+                return [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0]) if idx >= 0]
+
+            allowed_ids = self._allowed_ids(allowed_tables)
+            if len(allowed_ids) == 0:
+                return []
+            k = min(top_k, len(allowed_ids))
+            if len(allowed_ids) == len(self.records):
+                distances, indices = self.index.search(query_vector, k)
+                return [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0]) if idx >= 0]
+            try:
+                distances, indices = filtered_search(self.index, query_vector, k, allowed_ids)
+                results = [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0]) if idx >= 0]
+            except Exception as e:
+                print(f"按ID过滤检索失败，改用扩大范围检索: {str(e)}")
+                results = []
+            if len(results) < k:
+                # HNSW在过滤比例很高时可能召回不足，扩大检索范围后再过滤
+                results = self._search_overfetch(query_vector, k, allowed_tables)
+        return results
+
+    def _search_overfetch(self, query_vector: np.ndarray, top_k: int,
+                          allowed_tables: FrozenSet[str]) -> List[Tuple[int, float]]:
+        """逐步扩大检索条数，直到过滤后凑满 top_k 条或已检索全部记录"""
+        fetch = top_k * 4
+        while True:
+            fetch = min(fetch, len(self.records))
+            distances, indices = self.index.search(query_vector, fetch)
+            results = [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0])
+                       if idx >= 0 and self._tables_by_id.get(int(idx), frozenset()) <= allowed_tables]
+            if len(results) >= top_k or fetch >= len(self.records):
+                return results[:top_k]
+            fetch *= 4
+
+    def _to_records(self, neighbors: List[Tuple[int, float]], with_distances: bool = False) -> List:
+        """将近邻记录ID转换为反馈记录，跳过已删除的记录"""
         similar_examples = []
-        for idx in indices[0]:
-            if idx < len(self.feedback_data):
-                similar_examples.append(self.feedback_data[idx])
-        
-        return similar_examples
\ No newline at end of file
+        for record_id, distance in neighbors:
+            record = self.records.get(record_id)
+            if record is not None:
+                similar_examples.append((record, distance) if with_distances else record)
+
+        return similar_examples
+
+    async def readiness(self) -> Dict:
+        """返回模型和索引的就绪状态，客户端模式下以检索服务的状态为准"""
+        if self._use_remote():
+            try:
+                result = await self.client.call("ping")
+                state = "ready" if result.get("ready") else "loading"
+                return {
+                    "embedding_model": {"state": state, "source": "service"},
+                    "index": {"state": state, "records": result.get("records", 0), "source": "service"},
+                }
+            except Exception as e:
+                self._remote_failed(e)
+        subsystems = {
+            "embedding_model": {"state": self.status["embedding_model"]},
+            "index": {"state": self.status["index"], "records": len(self.records)},
+        }
+        if self.load_error:
+            subsystems["index"]["error"] = self.load_error
+        return subsystems
+
+    async def close(self):
+        """停止编码批处理并关闭检索服务连接"""
+        await self.batcher.close()
+        if self.client is not None:
+            await self.client.close()
+        if isinstance(self.records, PayloadStore):
+            self.records.close()
+
+    def stats(self) -> Dict:
+        """返回检索相关的运行统计"""
+        return {
+            "status": dict(self.status),
+            "records": len(self.records),
+            "embedding_backend": self.config.get("embedding_backend", "torch") if self.onnx_encoder is not None else "torch",
+            "index": describe_index(self.index) if self.index is not None else None,
+            "index_bytes": index_memory_bytes(self.index) if self.index is not None else 0,
+            "executor": self.executor.stats(),
+            "batcher": self.batcher.stats(),
+            "query_cache": self.query_cache.stats(),
+            "retrieval_paths": dict(self.retrieval_counts),
+            "service": self.client.stats() if self.client is not None else None,
+        }
@@ -0,0 +1,178 @@
+"""
+索引工厂模块 - 根据配置构建不同类型的FAISS索引
+"""
+from typing import Dict, Optional, Tuple
+import math
+import numpy as np
+import faiss
+
+# 支持的索引类型
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# 支持的向量存储方式：原始float32、半精度、8位标量量化、乘积量化
+STORAGE_MODES = ("float32", "fp16", "sq8", "pq")
+
+# IVF/PQ 训练时每个聚类中心建议的最少样本数
+MIN_POINTS_PER_CENTROID = 39
+
+
+def resolve_index_type(config: Dict, count: int) -> str:
+    """
+    确定实际使用的索引类型
+
+    index_type 为 auto 时，记录数达到 auto_threshold 后切换为 auto_index_type 指定的近似索引
+    """
+    index_type = config.get("index_type", "auto")
+    if index_type == "auto":
+        if count >= config.get("auto_threshold", 50000):
+            index_type = config.get("auto_index_type", "hnsw")
+        else:
+            index_type = "flat"
+    if index_type not in INDEX_TYPES:
+        print(f"未知的索引类型 {index_type}，使用flat索引")
+        index_type = "flat"
+    return index_type
+
+
+def _resolve_nlist(config: Dict, count: int) -> int:
+    """确定IVF聚类中心数，未配置时取 4*sqrt(N)，并保证训练样本充足"""
+    nlist = config.get("nlist") or int(4 * math.sqrt(max(count, 1)))
+    return max(1, min(nlist, count // MIN_POINTS_PER_CENTROID))
+
+
+def resolve_storage_mode(config: Dict, dimension: int, count: int) -> str:
+    """确定向量编码方式，PQ训练样本不足或参数不合法时降级为sq8"""
+    storage_mode = config.get("storage_mode", "float32")
+    if storage_mode not in STORAGE_MODES:
+        print(f"未知的向量存储方式 {storage_mode}，使用float32")
+        return "float32"
+    if storage_mode == "pq":
+        pq_m = config.get("pq_m", 16)
+        if dimension % pq_m != 0 or count < (1 << config.get("pq_nbits", 8)) * MIN_POINTS_PER_CENTROID:
+            print("PQ参数不合法或训练样本不足，向量存储改用sq8")
+            return "sq8"
+    return storage_mode
+
+
+def _storage_code(storage_mode: str, config: Dict) -> str:
+    """向量编码方式对应的 index_factory 描述"""
+    if storage_mode == "fp16":
+        return "SQfp16"
+    if storage_mode == "sq8":
+        return "SQ8"
+    if storage_mode == "pq":
+        return f"PQ{config.get('pq_m', 16)}x{config.get('pq_nbits', 8)}"
+    return "Flat"
+
+
+def index_factory_string(index_type: str, dimension: int, config: Dict, count: int) -> str:
+    """生成 faiss.index_factory 使用的索引描述字符串"""
+    storage_code = _storage_code(resolve_storage_mode(config, dimension, count), config)
+    if index_type == "ivf_flat":
+        return f"IVF{_resolve_nlist(config, count)},{storage_code}"
+    if index_type == "ivf_pq":
+        pq_m = config.get("pq_m", 16)
+        pq_nbits = config.get("pq_nbits", 8)
+        return f"IVF{_resolve_nlist(config, count)},PQ{pq_m}x{pq_nbits}"
+    if index_type == "hnsw":
+        # HNSW 不支持PQ编码的存储，使用sq8代替
+        if storage_code.startswith("PQ"):
+            storage_code = "SQ8"
+        return f"IDMap,HNSW{config.get('hnsw_m', 32)},{storage_code}"
+    return f"IDMap,{storage_code}"
+
+
+def _check_trainable(index_type: str, dimension: int, config: Dict, count: int) -> str:
+    """训练样本不足或参数不合法时降级为可用的索引类型"""
+    if index_type == "ivf_pq":
+        pq_m = config.get("pq_m", 16)
+        if dimension % pq_m != 0:
+            print(f"向量维度 {dimension} 不能被 pq_m={pq_m} 整除，改用ivf_flat索引")
+            index_type = "ivf_flat"
+        elif count < (1 << config.get("pq_nbits", 8)) * MIN_POINTS_PER_CENTROID:
+            print(f"记录数 {count} 不足以训练PQ编码，改用ivf_flat索引")
+            index_type = "ivf_flat"
+    if index_type.startswith("ivf") and count < MIN_POINTS_PER_CENTROID:
+        print(f"记录数 {count} 不足以训练IVF索引，改用flat索引")
+        index_type = "flat"
+    return index_type
+
+
+def build_index(index_type: str, dimension: int, config: Dict,
+                train_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    构建索引，需要训练的索引使用 train_vectors 训练
+
+    返回的索引均支持 add_with_ids，训练样本不足时会降级为更简单的索引类型
+    """
+    count = 0 if train_vectors is None else len(train_vectors)
+    index_type = _check_trainable(index_type, dimension, config, count)
+    description = index_factory_string(index_type, dimension, config, count)
+    index = faiss.index_factory(dimension, description)
+    if index_type == "hnsw":
+        _unwrap(index).hnsw.efConstruction = config.get("ef_construction", 200)
+    if not index.is_trained:
+        index.train(train_vectors)
+    configure_search(index, config)
+    return index
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    """去掉IDMap外壳，返回实际的索引对象"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+def configure_search(index: faiss.Index, config: Dict):
+    """设置查询参数：IVF的nprobe、HNSW的efSearch"""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(config.get("nprobe", 16), inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config.get("ef_search", 64)
+
+
+def describe_index(index: faiss.Index) -> str:
+    """返回索引的简要描述，用于日志和索引签名"""
+    inner = _unwrap(index)
+    name = type(inner).__name__
+    if isinstance(inner, faiss.IndexIVF):
+        return f"{name}(nlist={inner.nlist})"
+    if isinstance(inner, faiss.IndexHNSW):
+        return f"{name}({type(faiss.downcast_index(inner.storage)).__name__})"
+    return name
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """索引序列化后的字节数，近似其常驻内存占用"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """HNSW 不支持按ID删除，需要重建"""
+    return not isinstance(_unwrap(index), faiss.IndexHNSW)
+
+
+def filtered_search(index: faiss.Index, query_vector: np.ndarray, top_k: int,
+                    allowed_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    只在 allowed_ids 范围内检索
+
+    使用FAISS的IDSelector在索引内部过滤，保留索引已配置的nprobe/efSearch
+    """
+    selector = faiss.IDSelectorBatch(allowed_ids.astype('int64'))
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = inner.nprobe
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = inner.hnsw.efSearch
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    distances, indices = index.search(query_vector, top_k, params=params)
+    # selector 需在检索结束前保持引用
+    del selector
+    return distances, indices
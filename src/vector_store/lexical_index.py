@@ -0,0 +1,156 @@
+"""
+词法索引模块 - 基于字符n-gram的BM25倒排索引，与向量索引配合做混合检索
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from collections import Counter
+import math
+import re
+import numpy as np
+from ..utils.text import normalize_query
+
+# 记录数达到该值后才跳过高频片段，小语料全部参与打分
+MIN_RECORDS_FOR_DF_CUT = 1000
+
+# 词法键中忽略的字符：空白、标点和下划线
+_IGNORED_CHARS = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def lexical_key(text: str) -> str:
+    """去掉空白和标点后的规范化查询，只差空白或标点的查询得到相同的键"""
+    return _IGNORED_CHARS.sub("", normalize_query(text))
+
+
+def char_ngrams(key: str) -> List[str]:
+    """中文查询不分词，取单字和相邻两字作为检索单元"""
+    if len(key) < 2:
+        return list(key)
+    return list(key) + [key[i:i + 2] for i in range(len(key) - 1)]
+
+
+class LexicalIndex:
+    """
+    字符n-gram倒排索引
+
+    exact_ids 返回词法键完全相同的记录，search 按BM25打分。
+    打分时倒排表转换为numpy数组批量计算，记录较多时出现在超过 max_df_ratio 比例记录中的片段区分度很低，不参与打分。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_df_ratio: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # 倒排表的numpy形式 (记录ID数组, 词频数组)，对应片段变化时失效
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lengths: Dict[int, int] = {}
+        # 按记录ID索引的片段数，用于批量计算长度归一化
+        self._length_array = np.zeros(0, dtype='float32')
+        self._keys: Dict[int, str] = {}
+        self._exact: Dict[str, Set[int]] = {}
+        self._total_length = 0
+
+    def reset(self, items: Iterable[Tuple[int, str]]):
+        """用给定的 (记录ID, 查询文本) 重建索引"""
+        self.__init__(self.k1, self.b, self.max_df_ratio)
+        for record_id, text in items:
+            self.add(record_id, text)
+
+    def add(self, record_id: int, text: str):
+        if record_id in self._keys:
+            self.remove(record_id)
+        key = lexical_key(text)
+        grams = Counter(char_ngrams(key))
+        for gram, tf in grams.items():
+            self._postings.setdefault(gram, {})[record_id] = tf
+            self._arrays.pop(gram, None)
+        length = sum(grams.values())
+        self._lengths[record_id] = length
+        if record_id >= len(self._length_array):
+            grown = np.zeros(max(record_id + 1, len(self._length_array) * 2), dtype='float32')
+            grown[:len(self._length_array)] = self._length_array
+            self._length_array = grown
+        self._length_array[record_id] = length
+        self._total_length += length
+        self._keys[record_id] = key
+        self._exact.setdefault(key, set()).add(record_id)
+
+    def remove(self, record_id: int):
+        key = self._keys.pop(record_id, None)
+        if key is None:
+            return
+        for gram in set(char_ngrams(key)):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.pop(record_id, None)
+                self._arrays.pop(gram, None)
+                if not postings:
+                    del self._postings[gram]
+        self._total_length -= self._lengths.pop(record_id)
+        self._length_array[record_id] = 0
+        ids = self._exact[key]
+        ids.discard(record_id)
+        if not ids:
+            del self._exact[key]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def exact_ids(self, text: str) -> Set[int]:
+        """词法键完全相同的记录ID"""
+        return set(self._exact.get(lexical_key(text), ()))
+
+    def _posting_arrays(self, gram: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(gram)
+        if arrays is None:
+            postings = self._postings[gram]
+            arrays = (np.fromiter(postings.keys(), dtype='int64', count=len(postings)),
+                      np.fromiter(postings.values(), dtype='float32', count=len(postings)))
+            self._arrays[gram] = arrays
+        return arrays
+
+    def search(self, text: str, top_k: int,
+               accept: Optional[Callable[[int], bool]] = None) -> List[Tuple[int, float]]:
+        """按BM25得分返回 (记录ID, 得分) 列表，得分从高到低，accept 不为None时只返回其接受的记录"""
+        if not self._keys:
+            return []
+        count = len(self._keys)
+        avg_length = self._total_length / count
+        query_grams = [(gram, query_tf) for gram, query_tf in Counter(char_ngrams(lexical_key(text))).items()
+                       if gram in self._postings]
+        # 只含高频片段的查询仍全部参与打分
+        selective = []
+        if count >= MIN_RECORDS_FOR_DF_CUT:
+            selective = [item for item in query_grams if len(self._postings[item[0]]) <= count * self.max_df_ratio]
+        scores = np.zeros(len(self._length_array), dtype='float32')
+        for gram, query_tf in selective or query_grams:
+            ids, tf = self._posting_arrays(gram)
+            idf = math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._length_array[ids] / avg_length)
+            # 同一片段的倒排表中记录ID不重复，可直接按下标累加
+            scores[ids] += query_tf * idf * tf * (self.k1 + 1) / (tf + norm)
+        return self._top(scores, np.flatnonzero(scores), top_k, accept)
+
+    @staticmethod
+    def _top(scores: np.ndarray, candidates: np.ndarray, top_k: int,
+             accept: Optional[Callable[[int], bool]]) -> List[Tuple[int, float]]:
+        """取得分最高的 top_k 条，被 accept 过滤掉时逐步扩大候选范围"""
+        limit = top_k
+        while True:
+            part = candidates
+            if len(candidates) > limit:
+                part = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+            part = part[np.argsort(-scores[part], kind='stable')]
+            results = [(int(record_id), float(scores[record_id])) for record_id in part
+                       if accept is None or accept(int(record_id))][:top_k]
+            if len(results) >= top_k or len(part) == len(candidates):
+                return results
+            limit *= 4
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """倒数排名融合：多路排序结果按 1/(k+名次) 累加得分，得分从高到低返回"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, record_id in enumerate(ranking):
+            scores[record_id] = scores.get(record_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
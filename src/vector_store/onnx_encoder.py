@@ -0,0 +1,139 @@
+"""
+ONNX编码模块 - 将句向量模型导出为ONNX并做int8动态量化，用onnxruntime在CPU上推理
+
+需要额外安装 onnxruntime 和 onnx，导出时使用 sentence-transformers 自带的 torch
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+import json
+import numpy as np
+import onnxruntime as ort
+
+# 导出时的模型输入名
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+class OnnxEncoder:
+    """
+    句向量模型的ONNX推理封装
+
+    首次使用时从 SentenceTransformer 导出Transformer部分到 cache_dir，
+    池化和归一化在numpy中按原模型的配置完成，输出与原模型 encode 一致的向量。
+    """
+
+    def __init__(self, model, cache_dir: Path, model_id: str, quantize: bool = True,
+                 intra_op_threads: int = 0):
+        """
+        Args:
+            model: 已加载的 SentenceTransformer
+            cache_dir: 导出文件目录
+            model_id: 原模型标识，变化时重新导出
+            quantize: 是否做int8动态量化
+            intra_op_threads: onnxruntime 单次推理使用的线程数，0 表示由onnxruntime决定
+        """
+        transformer = model[0]
+        self.tokenizer = transformer.tokenizer
+        self.max_seq_length = transformer.max_seq_length
+        self.pooling = self._pooling_mode(model)
+        self.normalize = any(type(module).__name__ == "Normalize" for module in model)
+        self.cache_dir = Path(cache_dir)
+        self.quantize = quantize
+
+        model_file = self._export(transformer.auto_model, model_id)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        print(f"ONNX编码器已加载: {model_file}")
+
+    @staticmethod
+    def _pooling_mode(model) -> str:
+        """读取原模型的池化方式，默认取平均"""
+        for module in model:
+            if type(module).__name__ == "Pooling":
+                if getattr(module, "pooling_mode_cls_token", False):
+                    return "cls"
+                if getattr(module, "pooling_mode_max_tokens", False):
+                    return "max"
+        return "mean"
+
+    def _export(self, auto_model, model_id: str) -> Path:
+        """导出ONNX模型并量化，已有相同模型的导出文件时直接复用"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fp32_file = self.cache_dir / 'model.onnx'
+        int8_file = self.cache_dir / 'model.int8.onnx'
+        meta_file = self.cache_dir / 'meta.json'
+        target = int8_file if self.quantize else fp32_file
+
+        meta = {}
+        if meta_file.exists():
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        if meta.get('model_id') == model_id and target.exists():
+            return target
+
+        import torch
+        print("导出ONNX模型...")
+        inputs = self.tokenizer(["示例查询"], return_tensors="pt")
+        names = [name for name in INPUT_NAMES if name in inputs]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        auto_model.eval()
+        with torch.no_grad():
+            torch.onnx.export(auto_model, tuple(inputs[name] for name in names), str(fp32_file),
+                              input_names=names, output_names=["last_hidden_state"],
+                              dynamic_axes=dynamic_axes, opset_version=14)
+        if self.quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            print("对ONNX模型做int8动态量化...")
+            quantize_dynamic(str(fp32_file), str(int8_file), weight_type=QuantType.QInt8)
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump({'model_id': model_id}, f)
+        return target
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """编码文本，返回float32向量矩阵"""
+        inputs = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.max_seq_length, return_tensors="np")
+        feed = {name: inputs[name].astype('int64') for name in INPUT_NAMES
+                if name in inputs and name in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+        mask = inputs["attention_mask"][..., None].astype('float32')
+        if self.pooling == "cls":
+            embeddings = hidden[:, 0]
+        elif self.pooling == "max":
+            embeddings = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype('float32')
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """逐条计算两组向量的余弦相似度，返回最小值和平均值"""
+    reference = reference / np.clip(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12, None)
+    candidate = candidate / np.clip(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12, None)
+    cosines = (reference * candidate).sum(axis=1)
+    return {"min": float(cosines.min()), "mean": float(cosines.mean())}
+
+
+def load_onnx_encoder(model, cache_dir: Path, model_id: str, config: Dict,
+                      sample_texts: List[str]) -> Optional[OnnxEncoder]:
+    """
+    创建ONNX编码器并与原模型的向量比对
+
+    样本向量的最小余弦相似度低于 onnx_min_cosine 时返回None，继续使用原模型
+    """
+    backend = config.get("embedding_backend", "torch")
+    encoder = OnnxEncoder(model, cache_dir, model_id, quantize=(backend == "onnx_int8"),
+                          intra_op_threads=config.get("onnx_intra_op_threads", 0))
+    agreement = cosine_agreement(np.asarray(model.encode(sample_texts), dtype='float32'),
+                                 encoder.encode(sample_texts))
+    print(f"ONNX编码器与原模型的余弦相似度: 最小 {agreement['min']:.4f}，平均 {agreement['mean']:.4f}")
+    if agreement["min"] < config.get("onnx_min_cosine", 0.99):
+        print("ONNX编码器与原模型差异过大，继续使用原模型")
+        return None
+    return encoder
@@ -0,0 +1,148 @@
+"""
+记录存储模块 - 将反馈记录写入磁盘侧文件，通过内存映射按需读取
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from pathlib import Path
+import json
+import mmap
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class PayloadStore:
+    """
+    基于内存映射文件的记录存储
+
+    记录以JSON行追加写入侧文件，内存中只保留 记录ID -> (偏移, 长度)，
+    读取时从映射文件中解析单条记录。提供与dict相近的接口，可替代内存中的记录字典。
+    文件内容由反馈文件派生，每次初始化时重写。
+    偏移只在本进程内有效，因此每个进程使用自己的文件 payloads.<进程ID>.jsonl，
+    进程存活期间对该文件持有文件锁，其他进程据此清理已退出进程遗留的文件。
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.path = self.cache_dir / f'payloads.{os.getpid()}.jsonl'
+        self._offsets: Dict[int, Tuple[int, int]] = {}
+        self._size = 0
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        self._owner_file = None
+        self._lock = threading.Lock()
+
+    def _claim(self):
+        """锁定本进程的文件，并删除已退出进程遗留的文件"""
+        if fcntl is None or self._owner_file is not None:
+            return
+        self._owner_file = open(self.path, 'ab')
+        fcntl.flock(self._owner_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for stale in self.cache_dir.glob('payloads.*.jsonl'):
+            if stale == self.path:
+                continue
+            try:
+                with open(stale, 'rb') as f:
+                    # 能加锁说明持有该文件的进程已退出
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    stale.unlink()
+            except OSError:
+                continue
+
+    def reset(self, items: List[Tuple[int, Dict]]):
+        """用给定记录重写侧文件"""
+        with self._lock:
+            self._close_map()
+            self._offsets = {}
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._claim()
+            offset = 0
+            with open(self.path, 'wb') as f:
+                for record_id, record in items:
+                    line = self._encode(record)
+                    f.write(line)
+                    self._offsets[record_id] = (offset, len(line))
+                    offset += len(line)
+            self._size = offset
+
+    @staticmethod
+    def _encode(record: Dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._mapped_size = 0
+
+    def _read(self, offset: int, length: int) -> Dict:
+        with self._lock:
+            # 文件追加后重新映射
+            if self._mmap is None or self._mapped_size < offset + length:
+                self._close_map()
+                with open(self.path, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped_size = len(self._mmap)
+            data = self._mmap[offset:offset + length]
+        return json.loads(data.decode('utf-8'))
+
+    def __setitem__(self, record_id: int, record: Dict):
+        """追加写入记录，替换已有记录时旧内容留在文件中，下次初始化时清理"""
+        line = self._encode(record)
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(line)
+            self._offsets[record_id] = (self._size, len(line))
+            self._size += len(line)
+
+    def __getitem__(self, record_id: int) -> Dict:
+        offset, length = self._offsets[record_id]
+        return self._read(offset, length)
+
+    def get(self, record_id: int, default=None) -> Optional[Dict]:
+        location = self._offsets.get(record_id)
+        if location is None:
+            return default
+        return self._read(*location)
+
+    def pop(self, record_id: int) -> Dict:
+        record = self[record_id]
+        del self._offsets[record_id]
+        return record
+
+    def __contains__(self, record_id: int) -> bool:
+        return record_id in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._offsets))
+
+    def values(self) -> Iterator[Dict]:
+        for record_id in self:
+            yield self[record_id]
+
+    def items(self) -> Iterator[Tuple[int, Dict]]:
+        for record_id in self:
+            yield record_id, self[record_id]
+
+    def file_bytes(self) -> int:
+        return self._size
+
+    def close(self):
+        """关闭映射并删除本进程的文件"""
+        with self._lock:
+            self._close_map()
+            self._offsets = {}
+            self._size = 0
+            if self._owner_file is not None:
+                self._owner_file.close()
+                self._owner_file = None
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,101 @@
+"""
+查询缓存模块 - 缓存规范化查询文本的向量和近邻记录ID
+"""
+from typing import Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import threading
+import time
+import numpy as np
+
+
+class QueryCache:
+    """
+    查询向量与近邻结果的LRU缓存
+
+    条目数超过 max_size 时淘汰最久未使用的条目，超过 ttl_seconds 的条目视为过期。
+    近邻结果记录生成时的索引版本，索引变化后旧的近邻结果自动失效，
+    而查询向量只依赖模型，索引变化后仍可复用。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.neighbor_hits = 0
+        self.neighbor_misses = 0
+
+    def _get_entry(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["created_at"] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _entry_for_update(self, key: str) -> Dict:
+        entry = self._get_entry(key)
+        if entry is None:
+            entry = {"created_at": time.monotonic(), "embedding": None, "neighbors": {}}
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_embedding(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None or entry["embedding"] is None:
+                self.embedding_misses += 1
+                return None
+            self.embedding_hits += 1
+            return entry["embedding"]
+
+    def put_embedding(self, key: str, embedding: np.ndarray):
+        with self._lock:
+            self._entry_for_update(key)["embedding"] = embedding
+
+    def get_neighbors(self, key: str, variant: Hashable, version: int) -> Optional[List[Tuple[int, float]]]:
+        """
+        获取近邻结果
+
+        Args:
+            key: 规范化查询文本
+            variant: 区分同一查询不同检索参数的键，如top_k
+            version: 当前索引版本，与缓存时的版本不一致则视为未命中
+        """
+        with self._lock:
+            entry = self._get_entry(key)
+            cached = entry["neighbors"].get(variant) if entry else None
+            if cached is None or cached[0] != version:
+                self.neighbor_misses += 1
+                return None
+            self.neighbor_hits += 1
+            return cached[1]
+
+    def put_neighbors(self, key: str, variant: Hashable, version: int, neighbors: List[Tuple[int, float]]):
+        with self._lock:
+            entry = self._entry_for_update(key)
+            # 只保留当前版本的近邻结果
+            entry["neighbors"] = {v: n for v, n in entry["neighbors"].items() if n[0] == version}
+            entry["neighbors"][variant] = (version, neighbors)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "embedding_hits": self.embedding_hits,
+                "embedding_misses": self.embedding_misses,
+                "neighbor_hits": self.neighbor_hits,
+                "neighbor_misses": self.neighbor_misses,
+            }
@@ -0,0 +1,134 @@
+"""
+提示词前缀稳定性测试：同一角色的请求必须共享逐字节相同的 system 消息，才能命中接口侧的前缀缓存
+
+运行: python -m pytest -q test_prompt_builder.py
+"""
+import asyncio
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from src.model.prompt_builder import PromptBuilder, canonical_schema
+from src.schema.schema_selector import SchemaSelector
+
+
+def _table(name, columns, foreign_keys=(), conditions=()):
+    text = f"Table '{name}':\nColumns:\n" + "".join(f"  - {column}: VARCHAR(50)\n" for column in columns)
+    if foreign_keys:
+        text += "Foreign Keys:\n" + "".join(f"  - ['{column}'] -> {referred}.['id']\n" for column, referred in foreign_keys)
+    if conditions:
+        text += "Filter Conditions:\n" + "".join(f"  - WHERE {condition}\n" for condition in conditions)
+    return {
+        "name": name,
+        "columns": [{"name": column, "type": "VARCHAR(50)", "comment": ""} for column in columns],
+        "foreign_keys": [{"column": [column], "referred_table": referred, "referred_columns": ["id"]}
+                         for column, referred in foreign_keys],
+        "text": text,
+    }
+
+
+TABLES = [_table(f"t{i}", ["id", f"value_{i}"]) for i in range(6)]
+STATION = _table("station", ["id", "name"], conditions=["region = 'A'"])
+AIR = _table("air_quality", ["id", "station_id", "AQI", "PM25"], foreign_keys=[("station_id", "station")])
+ROLES = {
+    "analyst": TABLES[:4],
+    "viewer": TABLES[2:] + [STATION, AIR],
+}
+QUERIES = ["坂头2018年1月AQI平均值", "各站点PM2.5最大值", "list stations"]
+EXAMPLE_SETS = [
+    [],
+    [{"query": "坂头AQI", "sql": "SELECT AVG(AQI) FROM air_quality"}],
+    [{"query": "PM2.5", "sql": "SELECT MAX(PM25) FROM air_quality"}, {"query": "站点", "sql": "SELECT name FROM station"}],
+]
+
+
+def _common_prefix_length(first, second):
+    length = 0
+    for left, right in zip(first, second):
+        if left != right:
+            break
+        length += 1
+    return length
+
+
+def _requests(builder, tables, relevant_tables=None):
+    """同一角色的各种问题和示例组合，每次请求的表顺序随机"""
+    rng = random.Random(0)
+    for query in QUERIES:
+        for examples in EXAMPLE_SETS:
+            shuffled = tables[:]
+            rng.shuffle(shuffled)
+            yield builder.build(query, examples, canonical_schema(shuffled), relevant_tables)
+
+
+@pytest.mark.parametrize("role", sorted(ROLES))
+def test_system_message_is_identical_for_a_role(role):
+    builder = PromptBuilder()
+    prefix = builder.stable_prefix(canonical_schema(ROLES[role]))
+    for messages in _requests(builder, ROLES[role]):
+        assert messages[0] == {"role": "system", "content": prefix}
+        assert all(message["role"] == "user" for message in messages[1:])
+
+
+@pytest.mark.parametrize("role", sorted(ROLES))
+def test_serialized_requests_share_the_system_message(role):
+    builder = PromptBuilder()
+    payloads = [json.dumps({"messages": messages}, ensure_ascii=False) for messages in _requests(builder, ROLES[role])]
+    system_json = json.dumps({"messages": [{"role": "system",
+                                            "content": builder.stable_prefix(canonical_schema(ROLES[role]))}]},
+                             ensure_ascii=False)[:-2]
+    shared = min(_common_prefix_length(payloads[0], payload) for payload in payloads[1:])
+    assert shared >= len(system_json)
+
+
+def test_roles_share_the_instructions():
+    builder = PromptBuilder()
+    analyst, viewer = (builder.stable_prefix(canonical_schema(ROLES[role])) for role in ("analyst", "viewer"))
+    assert analyst != viewer
+    assert _common_prefix_length(analyst, viewer) >= len(builder.instructions)
+
+
+def test_relevant_tables_hint_stays_out_of_the_prefix():
+    builder = PromptBuilder()
+    schema_info = canonical_schema(ROLES["viewer"])
+    plain = builder.build(QUERIES[0], EXAMPLE_SETS[1], schema_info)
+    hinted = builder.build(QUERIES[0], EXAMPLE_SETS[1], schema_info, ["air_quality", "station"])
+    assert hinted[0] == plain[0]
+    assert "与问题相关的表：air_quality、station" in hinted[1]["content"]
+    assert "与问题相关的表" not in plain[1]["content"]
+    assert hinted[1]["content"].endswith(f"用户查询: {QUERIES[0]}")
+
+
+def test_pruning_with_prefix_cache_keeps_the_full_schema():
+    """裁剪按问题选出不同的表，但完整schema所在的 system 消息不变"""
+    store = SimpleNamespace(_use_remote=lambda: False, is_ready=False)
+    selector = SchemaSelector(store, {"token_budget": 40, "max_tables": 1, "prefix_cache": True})
+    builder = PromptBuilder()
+    tables = ROLES["viewer"]
+    schema_info = canonical_schema(tables)
+    hints = []
+    for query in ["station name", "value_3"]:
+        selected = asyncio.run(selector.select(query, tables))
+        assert len(selected) < len(tables)
+        hints.append(sorted(table["name"] for table in selected))
+        messages = builder.build(query, [], schema_info, hints[-1])
+        assert messages[0]["content"] == builder.stable_prefix(schema_info)
+    assert hints[0] != hints[1]
+
+
+def test_default_sends_the_pruned_schema_in_stable_order():
+    """默认关闭前缀缓存：发送裁剪后的schema，保留的表相同时与输入顺序无关"""
+    store = SimpleNamespace(_use_remote=lambda: False, is_ready=False)
+    selector = SchemaSelector(store, {"token_budget": 80, "max_tables": 1})
+    assert not selector.config["prefix_cache"]
+    builder = PromptBuilder()
+    tables = ROLES["viewer"]
+    prefixes = set()
+    for shuffled in (tables, tables[::-1]):
+        selected = asyncio.run(selector.select("station name", shuffled))
+        assert {table["name"] for table in selected} == {"station", "air_quality"}
+        prefixes.add(builder.build("station name", [], canonical_schema(selected))[0]["content"])
+    assert len(prefixes) == 1
+    assert "Table 't2'" not in prefixes.pop()